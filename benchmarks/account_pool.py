@@ -0,0 +1,85 @@
+# Measures orders per second sent through an AccountPool with a growing number of accounts.
+#
+# Run it against a local fork of the sidechain so the contract addresses match, with the keys
+# of funded accounts in PRIVATE_KEYS (comma separated), or against the simulated sidechain
+# with generated accounts and --rtt milliseconds of network delay per request, e.g.:
+#
+#   anvil --fork-url https://sidechain.morpher.com
+#   python -m benchmarks.account_pool --rpc http://127.0.0.1:8545 --orders 50
+#   python -m benchmarks.account_pool --simulator --accounts 8 --rtt 50
+
+import argparse
+import os
+import time
+from pool import AccountPool, ROUTE_ROUND_ROBIN
+
+BTC_MARKET_ID = "0x0bc89e95f9fdaab7e8a11719155f2fd638cb0f665623f3d12aab71d1a125daf9"
+
+
+def delayed_sidechain(rtt):
+    """Get a simulated sidechain that waits `rtt` seconds on every transaction and contract call, like a remote node."""
+    from simulator import SimulatedSidechain
+
+    class DelayedSidechain(SimulatedSidechain):
+
+        def call(self, address, name, args):
+            time.sleep(rtt)
+            return super().call(address, name, args)
+
+        def send(self, raw_transaction):
+            time.sleep(rtt)
+            return super().send(raw_transaction)
+
+    return DelayedSidechain(initial_balance=1_000_000)
+
+
+def run(private_keys, rpc_url, orders, backend=None):
+    if backend is not None:
+        pool = AccountPool(private_keys, routing=ROUTE_ROUND_ROBIN, backend=backend)
+    else:
+        pool = AccountPool(private_keys, routing=ROUTE_ROUND_ROBIN, rpc_url=rpc_url)
+    start = time.perf_counter()
+    futures = [
+        pool.submitOpenPosition(
+            BTC_MARKET_ID,
+            mph_token_amount=1,
+            direction=True,
+            leverage=1,
+            only_if_price_above=10_000_000,  # resting limit order, never processed
+        )
+        for _ in range(orders)
+    ]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark order throughput of the account pool.")
+    parser.add_argument("--rpc", default="http://127.0.0.1:8545", help="RPC url of the local chain")
+    parser.add_argument("--orders", type=int, default=50, help="number of orders per run")
+    parser.add_argument("--simulator", action="store_true", help="use the simulated sidechain with generated accounts instead of --rpc")
+    parser.add_argument("--accounts", type=int, default=4, help="number of generated accounts with --simulator")
+    parser.add_argument("--rtt", type=float, default=50, help="network delay per request in milliseconds with --simulator")
+    args = parser.parse_args()
+
+    if args.simulator:
+        private_keys = [f"benchmark-key-{i}" for i in range(args.accounts)]
+    else:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        private_keys = [key.strip() for key in os.getenv("PRIVATE_KEYS", "").split(",") if key.strip()]
+        if len(private_keys) == 0:
+            raise Exception("Set PRIVATE_KEYS to a comma separated list of private keys!")
+
+    for count in range(1, len(private_keys) + 1):
+        backend = delayed_sidechain(args.rtt / 1000) if args.simulator else None
+        elapsed = run(private_keys[:count], args.rpc, args.orders, backend)
+        print(f"{count} account(s): {args.orders} orders in {elapsed:.2f} s, {args.orders / elapsed:.1f} orders/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Measures the wall time to cancel many resting orders, one by one with cancelOrder and
+# all at once with cancelOrders.
+#
+# Run it against a local fork of the sidechain so the contract addresses match and the
+# orders are never processed by the oracle, or against the in-process simulated sidechain,
+# which answers instantly: there the RPC round trips each approach needs are counted, and
+# the wall time is projected for a given round trip time.
+#
+#   anvil --fork-url https://sidechain.morpher.com
+#   python -m benchmarks.cancel_orders --rpc http://127.0.0.1:8545 --orders 100
+#   python -m benchmarks.cancel_orders --simulator --rtt 50
+
+import argparse
+import os
+import time
+from orders import OrderBook
+from trading import MorpherTrading
+
+BTC_MARKET_ID = "0x0bc89e95f9fdaab7e8a11719155f2fd638cb0f665623f3d12aab71d1a125daf9"
+
+
+def place_resting_orders(trading, count):
+    # limit orders that can't trigger, so they stay pending until cancelled
+    return [
+        trading.openPosition(
+            market_id=BTC_MARKET_ID,
+            mph_token_amount=1,
+            direction=True,
+            leverage=1,
+            only_if_price_above=10_000_000,
+        )
+        for _ in range(count)
+    ]
+
+
+def build_trading(args):
+    if args.simulator:
+        from simulator import SimulatedSidechain
+
+        return MorpherTrading("benchmark-key", order_book=OrderBook(), backend=SimulatedSidechain(initial_balance=1_000_000))
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return MorpherTrading(private_key=os.getenv("PRIVATE_KEY"), order_book=OrderBook(), rpc_url=args.rpc)
+
+
+def measure(trading, cancel):
+    """Runs `cancel()`, returns the wall time in seconds and the RPC round trips it took."""
+    calls = trading.rpc.metrics()["calls"]
+    start = time.perf_counter()
+    result = cancel()
+    return time.perf_counter() - start, trading.rpc.metrics()["calls"] - calls, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cancelling pending orders.")
+    parser.add_argument("--rpc", default="http://127.0.0.1:8545", help="RPC url of the local chain")
+    parser.add_argument("--simulator", action="store_true", help="use the in-process simulated sidechain instead of --rpc")
+    parser.add_argument("--rtt", type=float, default=50, help="round trip time in milliseconds to project the simulator runs to")
+    parser.add_argument("--orders", type=int, default=100, help="number of orders to cancel")
+    args = parser.parse_args()
+
+    trading = build_trading(args)
+
+    print(f"Placing {args.orders} resting orders...")
+    order_ids = place_resting_orders(trading, args.orders)
+    sequential, sequential_calls, _ = measure(trading, lambda: [trading.cancelOrder(order_id) for order_id in order_ids])
+    print(f"cancelOrder x {args.orders}: {sequential:.3f} s, {sequential_calls} RPC round trips")
+
+    print(f"Placing {args.orders} resting orders...")
+    place_resting_orders(trading, args.orders)
+    batched, batched_calls, outcomes = measure(trading, trading.cancelAll)
+    sent = sum(1 for outcome in outcomes.values() if outcome["status"] == "sent")
+    print(f"cancelAll ({sent}/{len(outcomes)} sent): {batched:.3f} s, {batched_calls} RPC round trips")
+
+    if args.simulator:
+        sequential += sequential_calls * args.rtt / 1000
+        batched += batched_calls * args.rtt / 1000
+        print(f"Projected at {args.rtt:.0f} ms per round trip: cancelOrder x {args.orders} {sequential:.2f} s, cancelAll {batched:.2f} s")
+    print(f"Speedup: {sequential / batched:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Exercises the retry, rate limit and circuit breaker policies against a local stub server that
+# injects faults: server errors, rate limiting (429), dropped connections, slow answers and a
+# full outage window. The stub answers the Binance price endpoint and the JSON-RPC calls used
+# by getBalance, so the real client code paths are run.
+#
+#   python -m benchmarks.fault_injection --target binance --error-rate 0.2 --drop-rate 0.05
+#   python -m benchmarks.fault_injection --target rpc --outage 2:5 --duration 15
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from errors import MorpherError
+import resilience
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    # set on the server: faults (argparse namespace), started (monotonic start time), requests counter
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _fault(self):
+        """Applies the configured faults, returns True if the request was answered with one."""
+        faults = self.server.faults
+        self.server.requests += 1
+        elapsed = time.monotonic() - self.server.started
+        if faults.outage is not None and faults.outage[0] <= elapsed < faults.outage[0] + faults.outage[1]:
+            return self._reply(503, {"error": "outage"})
+        roll = random.random()
+        if roll < faults.drop_rate:
+            self.close_connection = True
+            self.connection.close()
+            return True
+        roll -= faults.drop_rate
+        if roll < faults.error_rate:
+            return self._reply(503, {"error": "injected"})
+        roll -= faults.error_rate
+        if roll < faults.throttle_rate:
+            return self._reply(429, {"error": "too many requests"})
+        roll -= faults.throttle_rate
+        if roll < faults.slow_rate:
+            time.sleep(faults.slow_seconds)
+        time.sleep(faults.latency / 1000)
+        return False
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def do_GET(self):
+        if self._fault():
+            return
+        if self.path.startswith("/api/v3/ticker/price"):
+            self._reply(200, {"symbol": "BTCUSDT", "price": f"{60000 + random.uniform(-100, 100):.2f}"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self._fault():
+            return
+        if isinstance(body, list):
+            self._reply(200, [self._rpc(request) for request in body])
+        else:
+            self._reply(200, self._rpc(body))
+
+    @staticmethod
+    def _rpc(request):
+        results = {
+            "eth_chainId": "0x15",
+            "eth_blockNumber": "0x100",
+            "eth_getTransactionCount": "0x0",
+            "eth_getLogs": [],
+            "eth_call": "0x" + (1000 * 10 ** 18).to_bytes(32, "big").hex(),  # balanceOf: 1000 MPH
+        }
+        if request.get("method") not in results:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": "method not found"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": results[request["method"]]}
+
+
+def start_stub(faults):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FaultInjectingHandler)
+    server.faults = faults
+    server.started = time.monotonic()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_call(target, url):
+    if target == "binance":
+        import feeds
+
+        feeds.BINANCE_REST_URL = url
+        feeds.BINANCE_TIMEOUT = 2
+        return lambda: feeds.fetch_price("BTCUSDT")
+
+    from trading import MorpherTrading
+
+    trading = MorpherTrading("0x" + "11" * 32, rpc_url=url)
+    return trading.getBalance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the resilience policies against a fault injecting stub server.")
+    parser.add_argument("--target", choices=["binance", "rpc"], default="binance", help="client code path to exercise")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent callers")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="share of requests answered with 429")
+    parser.add_argument("--drop-rate", type=float, default=0.02, help="share of connections closed without an answer")
+    parser.add_argument("--slow-rate", type=float, default=0.02, help="share of requests answered after --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=3, help="delay of slow answers, above the client timeout")
+    parser.add_argument("--latency", type=float, default=5, help="base latency of every answer in milliseconds")
+    parser.add_argument("--outage", help="START:SECONDS window in which every request fails, e.g. 2:5")
+    parser.add_argument("--rate", type=float, default=50, help="client rate limit in calls per second")
+    args = parser.parse_args()
+    args.outage = tuple(float(value) for value in args.outage.split(":")) if args.outage else None
+
+    server = start_stub(args)
+    url = f"http://127.0.0.1:{server.server_port}"
+    name = "binance" if args.target == "binance" else f"rpc {url}"
+    resilience.configure(name, rate=args.rate, burst=args.threads, failure_threshold=5, reset_timeout=1)
+    call = build_call(args.target, url)
+
+    outcomes = {}
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def caller():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                call()
+                outcome = "ok"
+            except MorpherError as e:
+                outcome = type(e).__name__ + (" (transient)" if getattr(e, "transient", False) else "")
+            except Exception as e:
+                outcome = f"untyped {type(e).__name__}"
+            with lock:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if outcome == "ok":
+                    latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for _ in range(args.threads):
+            executor.submit(caller)
+    server.shutdown()
+
+    total = sum(outcomes.values())
+    print(f"{total} calls, {server.requests} requests to the stub")
+    for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1]):
+        print(f"  {outcome}: {count} ({count / total:.1%})")
+    if latencies:
+        latencies.sort()
+        print(f"  latency of successful calls: p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(json.dumps(resilience.metrics()[name], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Guards the startup time of the bot: imports each module in a fresh interpreter with
+# `python -X importtime` and fails when its cumulative import time is over budget.
+#
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time --budget-scale 2   # on a slow machine
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cumulative import time budget per module in milliseconds, none of them should pull in web3
+BUDGETS_MS = {
+    "trading": 80,
+    "orders": 40,
+    "risk": 20,
+    "pool": 80,
+    "feeds": 60,
+    "runner": 120,
+    "strategies.sma": 80,
+    "strategies.rebalancing": 80,
+    "simulator": 80,
+    "ledger": 80,
+    "prices": 20,
+    "resilience": 40,
+    "eventlog": 40,
+    "config": 40,
+    "main": 80,
+}
+
+
+def import_time(module):
+    """Returns the cumulative import time of `module` in milliseconds and the modules it imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise Exception(f"Importing {module} failed:\n{result.stderr}")
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if not fields[1].isdigit():
+            continue  # header line
+        imported[fields[2].strip()] = int(fields[1])
+    return imported.get(module, 0) / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the bot modules.")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply all budgets by this factor")
+    parser.add_argument("--runs", type=int, default=3, help="runs per module, the fastest one counts")
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS_MS.items():
+        budget *= args.budget_scale
+        best, imported = min((import_time(module) for _ in range(args.runs)), key=lambda result: result[0])
+        eager = [name for name in ("web3", "eth_account", "numpy", "requests", "websocket") if name in imported]
+        ok = best <= budget and len(eager) == 0
+        failed = failed or not ok
+        note = f", imports {', '.join(eager)} eagerly" if eager else ""
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {best:.1f} ms (budget {budget:.0f} ms){note}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
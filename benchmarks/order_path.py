@@ -0,0 +1,201 @@
+# End-to-end load and latency benchmark of the order path: orders per second and submit to
+# order id latency at growing concurrency, position reads per second, and strategy tick
+# throughput at growing market counts. Results are written as JSON so runs can be compared.
+#
+# By default it runs against the in-process SimulatedSidechain, which measures the client
+# side of the order path. Pass --rpc to run the same workload against a local chain, e.g. a
+# fork of the sidechain with PRIVATE_KEY set to a funded account:
+#
+#   python -m benchmarks.order_path
+#   anvil --fork-url https://sidechain.morpher.com
+#   python -m benchmarks.order_path --rpc http://127.0.0.1:8545 --orders 50
+#   python -m benchmarks.order_path --compare benchmarks/results/order_path-20240101-120000.json
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+from trading import MorpherTrading
+
+BTC_MARKET_ID = "0x0bc89e95f9fdaab7e8a11719155f2fd638cb0f665623f3d12aab71d1a125daf9"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# metrics where a lower value is better, all others are rates
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "mean_ms")
+
+
+def percentile(samples, q):
+    """Nearest rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def latency_stats(samples, elapsed, unit):
+    return {
+        unit: round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+    }
+
+
+def timed_calls(fn, count, concurrency):
+    """Calls `fn()` `count` times from `concurrency` threads, returns the latencies and the wall time."""
+    def call(_):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        samples = [call(i) for i in range(count)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(call, range(count)))
+    return samples, time.perf_counter() - start
+
+
+def build_trading(args):
+    if args.rpc is None:
+        from simulator import SimulatedSidechain, LastPriceFillModel
+
+        chain = SimulatedSidechain(LastPriceFillModel(), initial_balance=1_000_000)
+        chain.on_price(BTC_MARKET_ID, 60_000)
+        return MorpherTrading("benchmark", backend=chain), chain
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return MorpherTrading(private_key=os.getenv("PRIVATE_KEY"), rpc_url=args.rpc), None
+
+
+def bench_orders(trading, args):
+    """openPosition -> order id, with resting limit orders so they stay pending on a real chain too."""
+    def submit():
+        trading.openPosition(
+            market_id=BTC_MARKET_ID,
+            mph_token_amount=1,
+            direction=True,
+            leverage=1,
+            only_if_price_above=10_000_000,
+        )
+
+    results = {}
+    for concurrency in args.concurrency:
+        samples, elapsed = timed_calls(submit, args.orders, concurrency)
+        results[f"concurrency_{concurrency}"] = latency_stats(samples, elapsed, "orders_per_s")
+        print(f"orders, {concurrency} thread(s): {results[f'concurrency_{concurrency}']}")
+    return results
+
+
+def bench_reads(trading, chain, args):
+    """getPosition, getPositionValue and a portfolio read over several markets."""
+    markets = [BTC_MARKET_ID] + ["0x" + os.urandom(32).hex() for _ in range(args.portfolio_markets - 1)]
+    if chain is not None:
+        trading.openPosition(market_id=BTC_MARKET_ID, mph_token_amount=10, direction=True, leverage=2)
+
+    reads = {
+        "getPosition": lambda: trading.getPosition(BTC_MARKET_ID),
+        "getPositionValue": lambda: trading.getPositionValue(BTC_MARKET_ID, 61_000),
+        f"portfolio_{len(markets)}_markets": lambda: [trading.getPosition(market_id) for market_id in markets],
+    }
+    results = {}
+    for name, read in reads.items():
+        for concurrency in args.concurrency:
+            samples, elapsed = timed_calls(read, args.reads, concurrency)
+            results[f"{name}_concurrency_{concurrency}"] = latency_stats(samples, elapsed, "reads_per_s")
+            print(f"{name}, {concurrency} thread(s): {results[f'{name}_concurrency_{concurrency}']}")
+    return results
+
+
+def bench_ticks(trading, args):
+    """SimpleMovingAverageStrategy.on_price over many markets, with prices inside the band so no orders are sent."""
+    from eventlog import Sampler
+    from strategies.sma import SimpleMovingAverageStrategy
+
+    results = {}
+    for count in args.markets:
+        strategies = []
+        for _ in range(count):
+            strategy = SimpleMovingAverageStrategy(trading, "0x" + os.urandom(32).hex(), 2, 1, 5, 0.5)
+            strategy.minute_prices.extend([60_000.0] * 5)
+            strategy.status_sampler = Sampler(float("inf"))  # keep the status events out of the measurement
+            strategies.append(strategy)
+        prices = [60_000 * (1 + random.uniform(-0.001, 0.001)) for _ in range(1000)]
+
+        ticks = 0
+        start = time.perf_counter()
+        while ticks < args.ticks:
+            for strategy in strategies:
+                strategy.on_price(prices[ticks % len(prices)])
+                ticks += 1
+        elapsed = time.perf_counter() - start
+        results[f"markets_{count}"] = {"ticks_per_s": round(ticks / elapsed, 1)}
+        print(f"ticks, {count} market(s): {results[f'markets_{count}']}")
+    return results
+
+
+def compare(current, previous):
+    """Prints the change of every metric against an earlier run."""
+    print(f"\nCompared to {previous['started']} ({previous['backend']}):")
+    for section, entries in current["results"].items():
+        for name, metrics in entries.items():
+            for metric, value in metrics.items():
+                before = previous["results"].get(section, {}).get(name, {}).get(metric)
+                if not before:
+                    continue
+                change = (value - before) / before * 100
+                better = change < 0 if metric in LOWER_IS_BETTER else change > 0
+                print(f"  {section}.{name}.{metric}: {before} -> {value} ({change:+.1f}%{', better' if better else ''})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the order path end to end.")
+    parser.add_argument("--rpc", help="RPC url of a local chain, the simulated sidechain is used if not set")
+    parser.add_argument("--orders", type=int, default=500, help="orders per concurrency level")
+    parser.add_argument("--reads", type=int, default=2000, help="reads per query and concurrency level")
+    parser.add_argument("--ticks", type=int, default=200_000, help="ticks per market count")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="thread counts to test")
+    parser.add_argument("--markets", type=int, nargs="+", default=[1, 10, 100, 1000], help="market counts for the tick test")
+    parser.add_argument("--portfolio-markets", type=int, default=10, help="markets read by the portfolio query")
+    parser.add_argument("--skip", nargs="+", default=[], choices=["orders", "reads", "ticks"], help="sections to skip")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/order_path-<time>.json)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    trading, chain = build_trading(args)
+    started = datetime.now()
+    run = {
+        "benchmark": "order_path",
+        "started": started.isoformat(timespec="seconds"),
+        "backend": args.rpc or "simulator",
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": {},
+    }
+    if "orders" not in args.skip:
+        run["results"]["orders"] = bench_orders(trading, args)
+    if "reads" not in args.skip:
+        run["results"]["reads"] = bench_reads(trading, chain, args)
+    if "ticks" not in args.skip:
+        run["results"]["ticks"] = bench_ticks(trading, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"order_path-{started:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(run, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
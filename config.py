@@ -0,0 +1,244 @@
+import os
+import re
+
+STRATEGY_SMA = 'sma'
+STRATEGY_REBALANCING = 'rebalancing'
+
+MODE_LIVE = 'live'
+MODE_DRY_RUN = 'dry_run'
+MODE_PAPER = 'paper'
+MODES = (MODE_LIVE, MODE_DRY_RUN, MODE_PAPER)
+
+_MARKET_ID = re.compile(r'^0x[0-9a-fA-F]{64}$')
+_TICKER = re.compile(r'^[A-Z0-9]+$')
+_SYMBOL = re.compile(r'^[a-z0-9]+$')
+
+# allowed keys of every strategy type: key -> (types, required)
+_STRATEGY_KEYS = {
+    STRATEGY_SMA: {
+        "market": (str, False),
+        "market_id": (str, False),
+        "symbol": (str, False),
+        "leverage": ((int, float), True),
+        "mph_tokens": ((int, float), True),
+        "sma_period": (int, True),
+        "threshold": ((int, float), True),
+    },
+    STRATEGY_REBALANCING: {
+        "markets": (dict, True),
+        "rebalance_percentage": ((int, float), True),
+        "drift_band": ((int, float), False),
+        "min_trade_mph": ((int, float), False),
+    },
+}
+_COMMON_KEYS = {"name": (str, True), "type": (str, True), "enabled": (bool, False)}
+_TOP_LEVEL_KEYS = ("mode", "rpc_url", "order_book", "paper_balance", "risk", "strategies")
+_RISK_KEYS = (
+    "min_leverage", "max_leverage", "max_order_mph", "max_market_exposure_mph", "max_total_exposure_mph",
+    "min_free_balance_mph", "max_orders", "orders_window_seconds", "max_snapshot_age"
+)
+
+
+class ConfigError(Exception):
+    """Raised with every problem found in a config file, so they can all be fixed at once."""
+
+    def __init__(self, path: str, problems: list):
+        super().__init__(f"Invalid config {path}:\n" + "\n".join(f"  - {problem}" for problem in problems))
+        self.path = path
+        self.problems = problems
+
+
+def market_id_from_ticker(ticker: str):
+    """Get the morpher market id of a crypto ticker, e.g. BTC."""
+    from eth_hash.auto import keccak
+
+    return '0x' + keccak(("CRYPTO_" + ticker).encode('utf-8')).hex()
+
+
+def read_config(path: str):
+    """
+    Read a TOML or YAML config file into a dict.
+
+    Raises:
+        ConfigError: if the file can't be read or parsed.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == ".toml":
+            import tomllib
+            with open(path, "rb") as f:
+                try:
+                    return tomllib.load(f)
+                except tomllib.TOMLDecodeError as e:
+                    raise ConfigError(path, [f"invalid TOML: {e}"]) from e
+        if extension in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ConfigError(path, ["YAML configs need PyYAML: pip install pyyaml"])
+            with open(path) as f:
+                try:
+                    return yaml.safe_load(f) or {}
+                except yaml.YAMLError as e:
+                    raise ConfigError(path, [f"invalid YAML: {e}"]) from e
+    except OSError as e:
+        raise ConfigError(path, [f"can't read the file: {e.strerror}"]) from e
+    raise ConfigError(path, [f"unknown config format '{extension}', use .toml, .yaml or .yml"])
+
+
+def _check_keys(where, item, allowed, problems):
+    for key in item:
+        if key not in allowed:
+            problems.append(f"{where}: unknown key '{key}'")
+    for key, (types, required) in allowed.items():
+        if key not in item:
+            if required:
+                problems.append(f"{where}: missing '{key}'")
+        elif not isinstance(item[key], types) or (types in ((int, float), int) and isinstance(item[key], bool)):
+            problems.append(f"{where}: '{key}' has the wrong type ({type(item[key]).__name__})")
+
+
+def _validate_sma(where, item, problems):
+    if ("market" in item) == ("market_id" in item):
+        problems.append(f"{where}: set either 'market' (ticker) or 'market_id'")
+    elif "market" in item and isinstance(item["market"], str) and not _TICKER.match(item["market"]):
+        problems.append(f"{where}: 'market' must be an upper case ticker like BTC")
+    elif "market_id" in item and isinstance(item["market_id"], str) and not _MARKET_ID.match(item["market_id"]):
+        problems.append(f"{where}: 'market_id' must be 0x followed by 64 hex characters")
+    if "symbol" in item and isinstance(item["symbol"], str) and not _SYMBOL.match(item["symbol"]):
+        problems.append(f"{where}: 'symbol' must be a lower case Binance symbol like btcusdt")
+    if "market_id" in item and "symbol" not in item:
+        problems.append(f"{where}: 'symbol' is required together with 'market_id'")
+    if isinstance(item.get("leverage"), (int, float)) and not 1 <= item["leverage"] <= 10:
+        problems.append(f"{where}: 'leverage' must be between 1 and 10")
+    if isinstance(item.get("mph_tokens"), (int, float)) and item["mph_tokens"] <= 0:
+        problems.append(f"{where}: 'mph_tokens' must be positive")
+    if isinstance(item.get("sma_period"), int) and item["sma_period"] < 1:
+        problems.append(f"{where}: 'sma_period' must be at least 1")
+    if isinstance(item.get("threshold"), (int, float)) and item["threshold"] <= 0:
+        problems.append(f"{where}: 'threshold' must be positive")
+
+
+def _validate_rebalancing(where, item, problems):
+    markets = item.get("markets")
+    if isinstance(markets, dict):
+        if len(markets) == 0:
+            problems.append(f"{where}: 'markets' is empty")
+        for ticker, weight in markets.items():
+            if not _TICKER.match(str(ticker)):
+                problems.append(f"{where}: market '{ticker}' must be an upper case ticker like BTC")
+            if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight <= 0:
+                problems.append(f"{where}: weight of '{ticker}' must be a positive number")
+        weights = [weight for weight in markets.values() if isinstance(weight, (int, float))]
+        if sum(weights) > 1 + 1e-9:
+            problems.append(f"{where}: market weights add up to {sum(weights):.4f}, more than 1")
+    percentage = item.get("rebalance_percentage")
+    if isinstance(percentage, (int, float)) and not 0 < percentage <= 1:
+        problems.append(f"{where}: 'rebalance_percentage' must be above 0 and at most 1")
+    if isinstance(item.get("drift_band"), (int, float)) and not 0 < item["drift_band"] < 1:
+        problems.append(f"{where}: 'drift_band' must be above 0 and below 1")
+    if isinstance(item.get("min_trade_mph"), (int, float)) and item["min_trade_mph"] < 0:
+        problems.append(f"{where}: 'min_trade_mph' must not be negative")
+    if "min_trade_mph" in item and "drift_band" not in item:
+        problems.append(f"{where}: 'min_trade_mph' needs 'drift_band'")
+
+
+def _normalize(item):
+    strategy = {"name": item["name"], "type": item["type"], "enabled": item.get("enabled", True)}
+    if item["type"] == STRATEGY_SMA:
+        market_id = item.get("market_id") or market_id_from_ticker(item["market"])
+        strategy.update({
+            "market_id": market_id.lower(),
+            "symbol": item.get("symbol") or item["market"].lower() + "usdt",
+            "leverage": float(item["leverage"]),
+            "mph_tokens": float(item["mph_tokens"]),
+            "sma_period": item["sma_period"],
+            "threshold": float(item["threshold"]),
+        })
+    else:
+        strategy.update({
+            "markets": {ticker: float(weight) for ticker, weight in item["markets"].items()},
+            "rebalance_percentage": float(item["rebalance_percentage"]),
+            "drift_band": float(item["drift_band"]) if "drift_band" in item else None,
+            "min_trade_mph": float(item.get("min_trade_mph", 0)),
+        })
+    return strategy
+
+
+def load_config(path: str):
+    """
+    Reads and validates a config file. Nothing is connected while loading, so a bad config
+    fails before the bot touches the chain or the price feeds.
+
+    Returns:
+        dict: The config with defaults filled in and one normalized dict per strategy.
+
+    Raises:
+        ConfigError: listing every problem found.
+    """
+    raw = read_config(path)
+    problems = []
+    if not isinstance(raw, dict):
+        raise ConfigError(path, ["the config must be a mapping"])
+
+    for key in raw:
+        if key not in _TOP_LEVEL_KEYS:
+            problems.append(f"unknown top level key '{key}'")
+    for key in ("rpc_url", "order_book"):
+        if key in raw and not isinstance(raw[key], str):
+            problems.append(f"'{key}' must be a string")
+    paper_balance = raw.get("paper_balance", 1000)
+    if not isinstance(paper_balance, (int, float)) or isinstance(paper_balance, bool) or paper_balance <= 0:
+        problems.append("'paper_balance' must be a positive number")
+    mode = raw.get("mode", MODE_LIVE)
+    if mode not in MODES:
+        problems.append(f"'mode' must be one of {', '.join(MODES)}")
+    risk = raw.get("risk", {})
+    if not isinstance(risk, dict):
+        problems.append("'risk' must be a table")
+        risk = {}
+    for key, value in risk.items():
+        if key not in _RISK_KEYS:
+            problems.append(f"risk: unknown key '{key}'")
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            problems.append(f"risk: '{key}' must be a number")
+
+    items = raw.get("strategies", [])
+    if not isinstance(items, list) or len(items) == 0:
+        problems.append("'strategies' must list at least one strategy")
+        items = []
+
+    names = set()
+    for i, item in enumerate(items):
+        where = f"strategies[{i}]"
+        if not isinstance(item, dict):
+            problems.append(f"{where}: must be a table")
+            continue
+        if isinstance(item.get("name"), str):
+            where = f"strategy '{item['name']}'"
+            if item["name"] in names:
+                problems.append(f"{where}: duplicate name")
+            names.add(item["name"])
+        strategy_type = item.get("type")
+        if strategy_type not in _STRATEGY_KEYS:
+            problems.append(f"{where}: 'type' must be one of {', '.join(_STRATEGY_KEYS)}")
+            continue
+        _check_keys(where, item, {**_COMMON_KEYS, **_STRATEGY_KEYS[strategy_type]}, problems)
+        if strategy_type == STRATEGY_SMA:
+            _validate_sma(where, item, problems)
+        else:
+            _validate_rebalancing(where, item, problems)
+
+    if len(problems) == 0 and not any(item.get("enabled", True) for item in items):
+        problems.append("all strategies are disabled")
+    if len(problems) > 0:
+        raise ConfigError(path, problems)
+
+    return {
+        "mode": mode,
+        "rpc_url": raw.get("rpc_url"),
+        "order_book": raw.get("order_book"),
+        "paper_balance": paper_balance,
+        "risk": risk,
+        "strategies": [_normalize(item) for item in items],
+    }
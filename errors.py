@@ -0,0 +1,77 @@
+class MorpherError(Exception):
+    """Base class of the errors raised by the trading client, so callers can catch them all at once."""
+
+
+class PositionError(MorpherError):
+    """Raised when a market has no position, or a mixed long and short one, for the requested action."""
+
+    def __init__(self, market_id: str, reason: str):
+        super().__init__(reason)
+        self.market_id = market_id
+        self.reason = reason
+
+    def __reduce__(self):
+        return (self.__class__, (self.market_id, self.reason))
+
+
+class OrderError(MorpherError):
+    """Raised when an order can't be sent, cancelled or found on chain."""
+
+
+class TransactionTimeout(OrderError):
+    """Raised when a sent transaction has no receipt in time. It may still be mined later."""
+
+    def __init__(self, tx_hash: str, seconds: float):
+        super().__init__(f"Transaction {tx_hash} not found on chain after {seconds:.0f} seconds!")
+        self.tx_hash = tx_hash
+        self.seconds = seconds
+
+    def __reduce__(self):
+        return (self.__class__, (self.tx_hash, self.seconds))
+
+
+class EndpointError(MorpherError):
+    """
+    Raised when a call to a remote endpoint failed. `transient` tells whether the failure was a
+    connection problem, timeout or server error (after the retries ran out), as opposed to an
+    answer the endpoint gave, e.g. a reverted call.
+    """
+
+    def __init__(self, endpoint: str, cause: str, transient: bool = False):
+        super().__init__(f"{endpoint}: {cause}")
+        self.endpoint = endpoint
+        self.cause = cause
+        self.transient = transient
+
+    def __reduce__(self):
+        return (self.__class__, (self.endpoint, self.cause, self.transient))
+
+
+class RpcError(EndpointError):
+    """Raised when a sidechain RPC call failed."""
+
+
+class SendError(RpcError):
+    """
+    Raised when sending a transaction failed. Unlike a failed read, the transaction may have
+    reached the node anyway and still be mined.
+    """
+
+
+class ExchangeError(EndpointError):
+    """Raised when a call to the exchange (Binance) API failed."""
+
+
+class CircuitOpen(EndpointError):
+    """Raised without calling the endpoint while its circuit breaker is open after repeated failures."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(endpoint, f"circuit open, retrying in {retry_in:.1f} seconds", transient=True)
+        self.retry_in = retry_in
+
+    def __reduce__(self):
+        return (self.__class__, (self.endpoint, self.retry_in))
+
+
+# errors after which an order may be on chain, the position has to be read back before trading again
+ORDER_UNCONFIRMED = (TransactionTimeout, SendError)
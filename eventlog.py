@@ -0,0 +1,174 @@
+import atexit
+from contextlib import contextmanager
+import contextvars
+import itertools
+import logging
+import os
+import queue
+import sys
+import time
+
+# correlation ids of the work in progress (e.g. the tick being handled), added to every event
+_correlation = contextvars.ContextVar("correlation", default={})
+_tick_ids = itertools.count(1)
+_listener = None
+
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def get_logger(name: str):
+    """Get the logger of a component, all bot loggers live under "morpher"."""
+    return logging.getLogger(f"morpher.{name}")
+
+
+def event(logger: logging.Logger, level: int, name: str, **fields):
+    """
+    Logs a structured event: `name` is a short snake case identifier, `fields` its data. Nothing
+    is formatted here, that happens on the writer thread, and events under the logger's level
+    cost a single check.
+    """
+    if logger.isEnabledFor(level):
+        # makeRecord instead of logger.log skips the stack walk that looks up the calling line
+        logger.handle(logger.makeRecord(logger.name, level, "", 0, name, (), None, extra={"fields": fields, "correlation": _correlation.get()}))
+
+
+def new_tick_id():
+    """Get a process-unique id for a tick, to correlate the orders it triggers."""
+    return f"{os.getpid():x}-{next(_tick_ids)}"
+
+
+@contextmanager
+def correlate(**ids):
+    """
+    Adds correlation ids to every event logged inside the block, also by the trading client:
+
+        with correlate(tick=new_tick_id()):
+            trading.openPosition(...)  # its transaction and order events carry the tick id
+    """
+    token = _correlation.set({**_correlation.get(), **ids})
+    try:
+        yield
+    finally:
+        _correlation.reset(token)
+
+
+def correlation():
+    """Get the correlation ids of the current context."""
+    return _correlation.get()
+
+
+class Sampler:
+    """
+    Rate limit for high frequency events such as the per-tick status: `ready()` is True at most
+    once every `interval` seconds, and `skipped` tells how many events were left out since.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.skipped = 0
+        self._next = 0
+
+    def ready(self):
+        now = time.monotonic()
+        if now < self._next:
+            self.skipped += 1
+            return False
+        self._next = now + self.interval
+        return True
+
+    def take_skipped(self):
+        skipped, self.skipped = self.skipped, 0
+        return skipped
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, the correlation ids and the fields."""
+
+    def __init__(self):
+        import json
+
+        super().__init__()
+        self._dumps = json.dumps
+
+    def format(self, record):
+        line = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        line.update(getattr(record, "correlation", None) or {})
+        line.update(getattr(record, "fields", None) or {})
+        # plain `logger.info("...", extra={...})` calls from other code
+        line.update({key: value for key, value in vars(record).items() if key not in _RESERVED and key not in ("fields", "correlation")})
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return self._dumps(line, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines for the console: time, level, event and key=value fields."""
+
+    def format(self, record):
+        fields = {**(getattr(record, "correlation", None) or {}), **(getattr(record, "fields", None) or {})}
+        text = " ".join(f"{key}={value}" for key, value in fields.items())
+        line = f"[{self.formatTime(record)}] {record.levelname:<7} {record.name[len('morpher.'):] or record.name} {record.getMessage()} {text}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _RecordQueueHandler(logging.Handler):
+    # unlike logging.handlers.QueueHandler it doesn't format the record on the calling thread,
+    # the listener does
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        self.records.put_nowait(record)
+
+
+def configure_logging(level: str = "INFO", path: str = None, fmt: str = "json", force: bool = False):
+    """
+    Sends the bot's events to a background writer thread, as JSON lines (or text) to `path` or
+    stdout. Logging calls on the trading threads only put the record on a queue. Calling it again
+    does nothing unless `force` is set.
+
+    Args:
+        level (str): Lowest level written, e.g. "DEBUG", "INFO" or "WARNING".
+        path (str): File to append the events to, None for stdout.
+        fmt (str): "json" for JSON lines, "text" for human readable lines.
+
+    Returns:
+        QueueListener: The writer, stopped (and flushed) at exit.
+    """
+    import logging.handlers
+
+    global _listener
+    if _listener is not None:
+        if not force:
+            return _listener
+        _listener.stop()
+    else:
+        atexit.register(_stop)
+
+    output = logging.FileHandler(path) if path is not None else logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    root = logging.getLogger("morpher")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_RecordQueueHandler(records))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return _listener
+
+
+def _stop():
+    # writes the queued events before the interpreter exits
+    if _listener is not None:
+        _listener.stop()
@@ -0,0 +1,86 @@
+from errors import ExchangeError
+from eventlog import event, get_logger
+import json
+import logging
+from resilience import endpoint
+import time
+
+BINANCE_STREAM_URL = "wss://stream.binance.com:9443/stream?streams="
+BINANCE_REST_URL = "https://api.binance.com"
+BINANCE_TIMEOUT = 10  # seconds to connect and to wait for the answer
+
+# well below the 1200 request weight per minute Binance allows an IP
+binance = endpoint("binance", ExchangeError, rate=10, burst=20)
+
+log = get_logger("feeds")
+
+
+def fetch_price(symbol: str):
+    """
+    Fetch the latest price of a symbol (e.g. BTCUSDT) from the Binance REST API, with retries,
+    rate limiting and a circuit breaker.
+
+    Raises:
+        ExchangeError: if the price could not be fetched.
+    """
+    import requests
+
+    def get():
+        response = requests.get(f"{BINANCE_REST_URL}/api/v3/ticker/price", params={"symbol": symbol.upper()}, timeout=BINANCE_TIMEOUT)
+        response.raise_for_status()
+        return float(response.json()["price"])
+
+    return binance.call(get)
+
+
+class BinanceTradeFeed:
+    """
+    One Binance websocket carrying the trades of several symbols.
+
+    Every trade is passed to the listeners as `listener(symbol, price, timestamp)`, with the
+    symbol in lower case (e.g. "btcusdt") and the trade time in seconds.
+    """
+
+    def __init__(self, symbols: list):
+        self.symbols = sorted(set(symbol.lower() for symbol in symbols))
+        self._listeners = []
+        self._running = False
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _on_message(self, ws, message):
+        trade = json.loads(message)["data"]
+        symbol = trade["s"].lower()
+        price = float(trade["p"])
+        timestamp = trade["T"] / 1000
+        for listener in self._listeners:
+            listener(symbol, price, timestamp)
+
+    def _on_error(self, ws, error):
+        event(log, logging.WARNING, "websocket_error", error=str(error))
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        event(log, logging.INFO, "websocket_closed", code=close_status_code)
+
+    def run_forever(self, reconnect_delay: float = 5):
+        """Streams trades until `stop` is called, reconnecting when the connection drops."""
+        import websocket
+
+        url = BINANCE_STREAM_URL + "/".join(f"{symbol}@trade" for symbol in self.symbols)
+        self._running = True
+        while self._running:
+            self._ws = websocket.WebSocketApp(
+                url,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+            )
+            self._ws.run_forever()
+            if self._running:
+                time.sleep(reconnect_delay)
+
+    def stop(self):
+        self._running = False
+        if getattr(self, "_ws", None) is not None:
+            self._ws.close()
@@ -0,0 +1,288 @@
+import sqlite3
+import threading
+from trading import MorpherTrading, MORPHER_ORACLE_ADDRESS, ORDER_CANCELLED, ORDER_CREATED, ORDER_FAILED, ORDER_PROCESSED
+
+PRECISION = 100000000  # prices, spreads and leverage have 8 decimals
+
+SIDE_OPEN = 'open'
+SIDE_CLOSE = 'close'
+
+_POSITION_FIELDS = ("longShares", "shortShares", "meanEntryPrice", "meanEntrySpread", "meanEntryLeverage")
+
+
+def _topic(value):
+    # log topics are bytes (HexBytes on web3), with or without 0x from .hex() depending on the version
+    value = value.hex() if not isinstance(value, str) else value
+    return value[2:] if value.startswith('0x') else value
+
+
+def _words(data):
+    data = bytes.fromhex(data[2:]) if isinstance(data, str) else bytes(data)
+    return [int.from_bytes(data[i:i + 32], "big") for i in range(0, len(data), 32)]
+
+
+class Ledger:
+    """
+    Local history of the fills, positions and PnL of one account, built from the oracle logs.
+
+    `sync` walks the logs in pages of `page_size` blocks from `start_block` and resumes from
+    the last indexed block on the next call, so the chain is only read once. Every fill is
+    stored with the position after it and its realized PnL, and PnL over any time range is
+    then answered from SQLite without touching the chain:
+
+        ledger = Ledger(trading_engine, "ledger.db", start_block=12_000_000)
+        ledger.sync()
+        ledger.pnl(start=time.time() - 86400)
+
+    Amounts are stored as contract units (WEI, 8 decimals prices and leverage) in strings
+    like the `OrderBook`. Realized PnL is the MPH received for the closed shares minus what
+    they cost to open, spreads included; interest charged by the trade engine is not known
+    from the logs and not included.
+    """
+
+    def __init__(self, trading: MorpherTrading, path: str = ":memory:", start_block: int = 0, page_size: int = 5000):
+        self.trading = trading
+        self.start_block = start_block
+        self.page_size = page_size
+        self._lock = threading.RLock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS orders (
+                orderId TEXT PRIMARY KEY,
+                marketId TEXT NOT NULL,
+                status TEXT NOT NULL,
+                blockNumber INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fills (
+                orderId TEXT PRIMARY KEY,
+                marketId TEXT NOT NULL,
+                blockNumber INTEGER NOT NULL,
+                logIndex INTEGER NOT NULL,
+                txHash TEXT,
+                timestamp REAL NOT NULL,
+                side TEXT NOT NULL,
+                direction INTEGER NOT NULL,
+                shares TEXT NOT NULL,
+                price TEXT NOT NULL,
+                spread TEXT NOT NULL,
+                longShares TEXT NOT NULL,
+                shortShares TEXT NOT NULL,
+                meanEntryPrice TEXT NOT NULL,
+                meanEntrySpread TEXT NOT NULL,
+                meanEntryLeverage TEXT NOT NULL,
+                realizedPnl TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS fills_by_time ON fills (timestamp);
+            CREATE INDEX IF NOT EXISTS fills_by_market ON fills (marketId, timestamp);
+            """
+        )
+        self._db.commit()
+
+    @property
+    def last_block(self):
+        """Last block indexed, None before the first sync."""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'last_block'").fetchone()
+        return int(row[0]) if row is not None else None
+
+    def sync(self, to_block: int = None):
+        """
+        Indexes the logs from the last indexed block (or `start_block`) up to `to_block`.
+
+        Returns:
+            int: Number of new fills.
+        """
+        with self._lock:
+            web3 = self.trading.web3
+            to_block = self.trading.rpc.call(lambda: web3.eth.block_number) if to_block is None else to_block
+            from_block = self.start_block if self.last_block is None else self.last_block + 1
+            fills = 0
+            while from_block <= to_block:
+                page_end = min(from_block + self.page_size - 1, to_block)
+                fills += self._index_page(web3, from_block, page_end)
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_block', ?)", (str(page_end),))
+                self._db.commit()
+                from_block = page_end + 1
+            return fills
+
+    def _index_page(self, web3, from_block, to_block):
+        # our new orders first, so the outcomes in the same page can be matched to them
+        account_topic = '0x' + self.trading.address.lower()[2:].rjust(64, '0')
+        for log in self.trading.rpc.call(web3.eth.get_logs, {
+            "address": MORPHER_ORACLE_ADDRESS,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": ['0x' + ORDER_CREATED, None, account_topic],
+        }):
+            self._db.execute(
+                "INSERT OR IGNORE INTO orders (orderId, marketId, status, blockNumber) VALUES (?, ?, 'open', ?)",
+                ('0x' + _topic(log["topics"][1]), '0x' + _topic(log["topics"][3]), log["blockNumber"])
+            )
+
+        pending = [row[0] for row in self._db.execute("SELECT orderId FROM orders WHERE status = 'open'")]
+        logs = []
+        for i in range(0, len(pending), 100):
+            logs += self.trading.rpc.call(web3.eth.get_logs, {
+                "address": MORPHER_ORACLE_ADDRESS,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [['0x' + ORDER_PROCESSED, '0x' + ORDER_CANCELLED, '0x' + ORDER_FAILED], pending[i:i + 100]],
+            })
+
+        fills = 0
+        for log in sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"])):
+            order_id = '0x' + _topic(log["topics"][1])
+            topic = _topic(log["topics"][0])
+            if topic == ORDER_PROCESSED:
+                self._record_fill(order_id, log)
+                fills += 1
+            status = {ORDER_PROCESSED: 'executed', ORDER_CANCELLED: 'cancelled', ORDER_FAILED: 'failed'}[topic]
+            self._db.execute("UPDATE orders SET status = ? WHERE orderId = ?", (status, order_id))
+        return fills
+
+    def _record_fill(self, order_id, log):
+        (price, _, spread, _, timestamp, long_shares, short_shares,
+         mean_price, mean_spread, mean_leverage, _) = _words(log["data"])[:11]
+        market_id = self._db.execute("SELECT marketId FROM orders WHERE orderId = ?", (order_id,)).fetchone()[0]
+        before = self.position(market_id)
+
+        realized = 0
+        if long_shares < before["longShares"]:
+            # entry cost per share was meanEntryPrice / leverage + spread, the sale returns that plus the price move minus spread
+            closed = before["longShares"] - long_shares
+            realized += closed * (price - before["meanEntryPrice"] - spread - before["meanEntrySpread"])
+        if short_shares < before["shortShares"]:
+            closed = before["shortShares"] - short_shares
+            realized += closed * (before["meanEntryPrice"] - price - spread - before["meanEntrySpread"])
+
+        if long_shares > before["longShares"] or short_shares > before["shortShares"]:
+            side = SIDE_OPEN
+            direction = long_shares > before["longShares"]
+            shares = long_shares - before["longShares"] if direction else short_shares - before["shortShares"]
+        else:
+            side = SIDE_CLOSE
+            direction = long_shares < before["longShares"]
+            shares = before["longShares"] - long_shares if direction else before["shortShares"] - short_shares
+
+        tx_hash = log.get("transactionHash")
+        self._db.execute(
+            "INSERT OR REPLACE INTO fills VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                order_id, market_id, log["blockNumber"], log["logIndex"],
+                '0x' + _topic(tx_hash) if tx_hash is not None else None,
+                timestamp / 1000, side, int(direction), str(shares), str(price), str(spread),
+                str(long_shares), str(short_shares), str(mean_price), str(mean_spread), str(mean_leverage),
+                str(realized),
+            )
+        )
+
+    def fills(self, market_id: str = None, start: float = None, end: float = None):
+        """List the fills, optionally of one market and between two unix timestamps, oldest first."""
+        query = "SELECT * FROM fills WHERE timestamp >= ? AND timestamp <= ?"
+        params = [start if start is not None else 0, end if end is not None else float("inf")]
+        if market_id is not None:
+            query += " AND marketId = ?"
+            params.append(market_id.lower())
+        with self._lock:
+            cursor = self._db.execute(query + " ORDER BY blockNumber, logIndex", params)
+            columns = [column[0] for column in cursor.description]
+            fills = []
+            for row in cursor:
+                fill = dict(zip(columns, row))
+                for key in ("shares", "price", "spread", "realizedPnl") + _POSITION_FIELDS:
+                    fill[key] = int(fill[key])
+                fill["direction"] = bool(fill["direction"])
+                fills.append(fill)
+            return fills
+
+    def position(self, market_id: str, at: float = None):
+        """
+        Get the position in a market after the last fill, or as it was at the unix timestamp `at`.
+
+        Returns:
+            dict: longShares, shortShares, meanEntryPrice, meanEntrySpread and meanEntryLeverage.
+        """
+        query = f"SELECT {', '.join(_POSITION_FIELDS)} FROM fills WHERE marketId = ?"
+        params = [market_id.lower()]
+        if at is not None:
+            query += " AND timestamp <= ?"
+            params.append(at)
+        with self._lock:
+            row = self._db.execute(query + " ORDER BY blockNumber DESC, logIndex DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return {"longShares": 0, "shortShares": 0, "meanEntryPrice": 0, "meanEntrySpread": 0, "meanEntryLeverage": PRECISION}
+        return dict(zip(_POSITION_FIELDS, (int(value) for value in row)))
+
+    def positions(self, at: float = None):
+        """Get the open positions of every market, now or at the unix timestamp `at`."""
+        with self._lock:
+            market_ids = [row[0] for row in self._db.execute("SELECT DISTINCT marketId FROM fills")]
+        positions = {market_id: self.position(market_id, at) for market_id in market_ids}
+        return {
+            market_id: position for market_id, position in positions.items()
+            if position["longShares"] > 0 or position["shortShares"] > 0
+        }
+
+    def realized_pnl(self, start: float = None, end: float = None, market_id: str = None):
+        """
+        Get the PnL realized by the fills between two unix timestamps.
+
+        Returns:
+            dict: Realized PnL in MPH per market id.
+        """
+        pnl = {}
+        for fill in self.fills(market_id, start, end):
+            pnl[fill["marketId"]] = pnl.get(fill["marketId"], 0) + fill["realizedPnl"]
+        return {market_id: value / 1e18 for market_id, value in pnl.items()}
+
+    def unrealized_pnl(self, prices: dict, spreads: dict = None, at: float = None):
+        """
+        Get the PnL of the open positions if they were closed at `prices`.
+
+        Args:
+            prices (dict): Current price per market id.
+            spreads (dict): Current spread per market id, the entry spread is used for missing markets.
+            at (float): Value the positions held at this unix timestamp instead of the current ones.
+
+        Returns:
+            dict: Unrealized PnL in MPH per market id with a position and a price.
+        """
+        prices = {market_id.lower(): price for market_id, price in prices.items()}
+        spreads = {market_id.lower(): spread for market_id, spread in (spreads or {}).items()}
+        pnl = {}
+        for market_id, position in self.positions(at).items():
+            if market_id not in prices:
+                continue
+            price = round(prices[market_id] * PRECISION)
+            spread = round(spreads[market_id] * PRECISION) if market_id in spreads else position["meanEntrySpread"]
+            if position["longShares"] > 0:
+                per_share = price - position["meanEntryPrice"]
+            else:
+                per_share = position["meanEntryPrice"] - price
+            shares = position["longShares"] + position["shortShares"]
+            pnl[market_id] = shares * (per_share - spread - position["meanEntrySpread"]) / 1e18
+        return pnl
+
+    def pnl(self, start: float = None, end: float = None, prices: dict = None):
+        """
+        Summary of the PnL between two unix timestamps.
+
+        Returns:
+            dict: realized (MPH per market), totalRealized and, with `prices` given, unrealized
+            (MPH per market) and totalUnrealized.
+        """
+        realized = self.realized_pnl(start, end)
+        summary = {"realized": realized, "totalRealized": sum(realized.values())}
+        if prices is not None:
+            unrealized = self.unrealized_pnl(prices, at=end)
+            summary.update({"unrealized": unrealized, "totalUnrealized": sum(unrealized.values())})
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._db.close()
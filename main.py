@@ -1,30 +1,228 @@
-from trading import MorpherTrading
-from strategies.sma import SimpleMovingAverageStrategy
-from dotenv import load_dotenv
+import argparse
+import functools
+import logging
 import os
+import queue
+import threading
+from config import load_config, market_id_from_ticker, ConfigError, MODE_DRY_RUN, MODE_PAPER, STRATEGY_SMA
+from eventlog import configure_logging, event, get_logger
 
-load_dotenv()
-private_key = os.getenv("PRIVATE_KEY")
+log = get_logger("main")
 
-# BTC market
-MARKET_ID = "0x0bc89e95f9fdaab7e8a11719155f2fd638cb0f665623f3d12aab71d1a125daf9"
-LEVERAGE = 10.0
-MPH_TOKENS = 5
-MOVING_AVERAGE_PERIOD = 5 # 5 minutes
-THRESHOLD_PERCENTAGE = 0.1 # Open position if price is over / under 0.1% of moving average
 
+class DryRunTrading:
+    """
+    Wraps the trading client for dry runs: reads go to the chain, orders are only logged.
+    """
 
-if __name__ == '__main__':
+    def __init__(self, trading_engine):
+        self.trading = trading_engine
+        self.risk_engine = trading_engine.risk_engine
+        self._order_ids = 0
+
+    def __getattr__(self, name):
+        return getattr(self.trading, name)
+
+    def _order(self, description):
+        self._order_ids += 1
+        order_id = f"dry-run-{self._order_ids}"
+        event(log, logging.INFO, "dry_run_order", order=description, orderId=order_id)
+        return order_id
+
+    def openPosition(self, market_id, mph_token_amount, direction, leverage, **kwargs):
+        if self.risk_engine is not None:
+            self.risk_engine.check_open(market_id, mph_token_amount, direction, leverage)
+        return self._order(f"open {'long' if direction else 'short'} {mph_token_amount} MPH x{leverage} in {market_id}")
+
+    def closePosition(self, market_id, percentage=1, **kwargs):
+        if self.risk_engine is not None:
+            self.risk_engine.check_close(market_id)
+        return self._order(f"close {percentage * 100:.0f}% of {market_id}")
+
+    def cancelOrder(self, order_id):
+        self._order(f"cancel {order_id}")
+        return True
+
+
+class TickDispatcher:
+    """
+    Gives every strategy its own thread and tick queue, so a strategy waiting for an order
+    confirmation doesn't hold up the ticks of the other strategies on the shared feed.
+    """
+
+    def __init__(self):
+        self._queues = {}  # symbol -> list of queues
+
+    def add(self, symbol, on_price):
+        """Calls `on_price(price)` with every trade of `symbol`."""
+        ticks = queue.Queue()
+        self._queues.setdefault(symbol, []).append(ticks)
+
+        def consume():
+            while True:
+                price = ticks.get()
+                try:
+                    on_price(price)
+                except Exception as e:
+                    # one failed tick must not stop the strategy
+                    log.exception("tick_failed", extra={"fields": {"symbol": symbol, "error": str(e)}})
+
+        threading.Thread(target=consume, name=f"strategy-{symbol}", daemon=True).start()
+
+    def on_price(self, symbol, price, timestamp):
+        for ticks in self._queues.get(symbol, ()):
+            ticks.put(price)
+
+
+def build_trading_engine(config):
+    from orders import OrderBook
+    from prices import PriceStore
+    from risk import RiskEngine
+    from trading import MorpherTrading, SIDECHAIN_RPC
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    private_key = os.getenv("PRIVATE_KEY")
+    backend = None
+    if config["mode"] == MODE_PAPER:
+        from simulator import SimulatedSidechain
+
+        backend = SimulatedSidechain(initial_balance=config["paper_balance"])
+        private_key = private_key or "paper"
+    elif not private_key:
+        raise Exception("Set PRIVATE_KEY in the environment or in a .env file!")
+
+    trading_engine = MorpherTrading(
+        private_key=private_key,
+        order_book=OrderBook(config["order_book"]) if config["order_book"] else None,
+        rpc_url=config["rpc_url"] or SIDECHAIN_RPC,
+        risk_engine=RiskEngine(**config["risk"]) if config["risk"] else None,
+        backend=backend,
+        price_store=PriceStore(),
+    )
+    if config["mode"] == MODE_DRY_RUN:
+        return DryRunTrading(trading_engine)
+    return trading_engine
 
-    trading_engine = MorpherTrading(private_key=private_key)
 
-    strategy = SimpleMovingAverageStrategy(
+def build_strategy(trading_engine, item):
+    if item["type"] == STRATEGY_SMA:
+        from strategies.sma import SimpleMovingAverageStrategy
+
+        return SimpleMovingAverageStrategy(
+            trading_engine,
+            item["market_id"],
+            item["leverage"],
+            item["mph_tokens"],
+            item["sma_period"],
+            item["threshold"],
+            symbol=item["symbol"],
+        )
+
+    from strategies.rebalancing import WeightedMarketRebalancingStrategy
+
+    return WeightedMarketRebalancingStrategy(
         trading_engine,
-        MARKET_ID,
-        LEVERAGE,
-        MPH_TOKENS,
-        MOVING_AVERAGE_PERIOD,
-        THRESHOLD_PERCENTAGE
+        item["markets"],
+        item["rebalance_percentage"],
+        drift_band=item["drift_band"],
+        min_trade_mph=item["min_trade_mph"],
     )
 
-    strategy.start_trading()
+
+def print_plan(config):
+    print(f"Mode: {config['mode']}")
+    for item in config["strategies"]:
+        state = "enabled" if item["enabled"] else "disabled"
+        if item["type"] == STRATEGY_SMA:
+            print(f"  {item['name']} ({state}): SMA on {item['symbol']} ({item['market_id']}), {item['mph_tokens']} MPH x{item['leverage']}")
+        else:
+            weights = ", ".join(f"{ticker} {weight:.0%}" for ticker, weight in item["markets"].items())
+            schedule = f"when drifting over {item['drift_band']:.0%}" if item["drift_band"] is not None else "daily"
+            print(f"  {item['name']} ({state}): rebalancing {item['rebalance_percentage']:.0%} of balance over {weights} {schedule}")
+
+
+def run(config):
+    trading_engine = build_trading_engine(config)
+    trading_engine.preload()
+
+    items = [item for item in config["strategies"] if item["enabled"]]
+    strategies = [(item, build_strategy(trading_engine, item)) for item in items]
+
+    event(log, logging.INFO, "balance", balance=trading_engine.getBalance())
+    if trading_engine.risk_engine is not None:
+        market_ids = set()
+        for item in items:
+            if item["type"] == STRATEGY_SMA:
+                market_ids.add(item["market_id"])
+            else:
+                market_ids.update(market_id_from_ticker(ticker) for ticker in item["markets"])
+        trading_engine.risk_engine.refresh(trading_engine, list(market_ids))
+
+    for item, strategy in strategies:
+        if item["type"] != STRATEGY_SMA and item["drift_band"] is None:
+            event(log, logging.INFO, "strategy_starting", strategy=item["name"])
+            threading.Thread(target=strategy.start_trading, name=item["name"], daemon=True).start()
+
+    # symbol -> market id of every market that needs live prices
+    markets = {}
+    dispatcher = TickDispatcher()
+    for item, strategy in strategies:
+        if item["type"] == STRATEGY_SMA:
+            event(log, logging.INFO, "strategy_starting", strategy=item["name"])
+            dispatcher.add(item["symbol"], strategy.on_price)
+            markets[item["symbol"]] = item["market_id"]
+        elif item["drift_band"] is not None:
+            event(log, logging.INFO, "strategy_starting", strategy=item["name"])
+            for ticker in item["markets"]:
+                dispatcher.add(ticker.lower() + "usdt", functools.partial(strategy.on_market_price, ticker))
+                markets[ticker.lower() + "usdt"] = market_id_from_ticker(ticker)
+        else:
+            # the daily rebalancers read their prices from the price store
+            markets.update({ticker.lower() + "usdt": market_id_from_ticker(ticker) for ticker in item["markets"]})
+    if len(markets) == 0:
+        threading.Event().wait()
+
+    from feeds import BinanceTradeFeed
+
+    feed = BinanceTradeFeed(list(markets))
+    # the store first, so it is never behind the ticks the strategies see
+    feed.add_listener(trading_engine.price_store.listener(markets))
+    feed.add_listener(dispatcher.on_price)
+    if config["mode"] == MODE_PAPER:
+        # the simulated oracle fills the paper orders at the live prices
+        feed.add_listener(lambda symbol, price, timestamp: trading_engine.backend.on_price(markets[symbol], price))
+    event(log, logging.INFO, "websocket_starting", symbols=list(markets))
+    feed.run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Morpher trading strategies described in a config file.")
+    parser.add_argument("--config", default="config.toml", help="TOML or YAML config file (default: config.toml)")
+    parser.add_argument("--check", action="store_true", help="validate the config, print the strategies and exit")
+    parser.add_argument("--dry-run", action="store_true", help="run the strategies but only log the orders")
+    parser.add_argument("--log-level", default="INFO", help="lowest level of the logged events (default: INFO)")
+    parser.add_argument("--log-file", help="append the events to this file instead of stdout")
+    parser.add_argument("--log-format", choices=["json", "text"], default="json", help="JSON lines or human readable text (default: json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        print(f"Config {args.config} not found, copy config.example.toml to get started.")
+        raise SystemExit(2)
+    try:
+        config = load_config(args.config)
+    except ConfigError as e:
+        print(e)
+        raise SystemExit(2)
+    if args.dry_run:
+        config["mode"] = MODE_DRY_RUN
+
+    print_plan(config)
+    if args.check:
+        return
+    configure_logging(args.log_level, args.log_file, args.log_format)
+    run(config)
+
+
+if __name__ == '__main__':
+    main()
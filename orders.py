@@ -0,0 +1,220 @@
+from collections import defaultdict
+import sqlite3
+import threading
+import time
+
+
+STATUS_OPEN = 'open'                          # OrderCreated seen, waiting for the oracle to process it
+STATUS_CANCEL_REQUESTED = 'cancel_requested'  # initiateCancelOrder sent, not confirmed yet
+STATUS_EXECUTED = 'executed'
+STATUS_CANCELLED = 'cancelled'
+STATUS_EXPIRED = 'expired'
+STATUS_FAILED = 'failed'
+
+ACTIVE_STATUSES = (STATUS_OPEN, STATUS_CANCEL_REQUESTED)
+
+# allowed state transitions, terminal states have no outgoing edges
+TRANSITIONS = {
+    STATUS_OPEN: (STATUS_CANCEL_REQUESTED, STATUS_EXECUTED, STATUS_CANCELLED, STATUS_EXPIRED, STATUS_FAILED),
+    STATUS_CANCEL_REQUESTED: (STATUS_EXECUTED, STATUS_CANCELLED, STATUS_EXPIRED, STATUS_FAILED),
+    STATUS_EXECUTED: (),
+    STATUS_CANCELLED: (),
+    STATUS_EXPIRED: (),
+    STATUS_FAILED: (),
+}
+
+_COLUMNS = (
+    "orderId",
+    "marketId",
+    "status",
+    "txHash",
+    "blockNumber",
+    "closeSharesAmount",
+    "openMPHTokenAmount",
+    "direction",
+    "leverage",
+    "onlyIfPriceAbove",
+    "onlyIfPriceBelow",
+    "goodUntil",
+    "goodFrom",
+    "createdAt",
+    "updatedAt",
+)
+
+
+class OrderBook:
+    """
+    Local record of every order submitted by this account.
+
+    Orders are kept in memory, indexed by market and status, and every change is written
+    through to SQLite so the book survives restarts. Amounts are stored exactly as sent to
+    the contract (WEI, 8 decimals prices and leverage) as strings, since they overflow
+    SQLite integers.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._lock = threading.RLock()
+        self._orders = {}
+        self._by_market = defaultdict(set)
+        self._by_status = defaultdict(set)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS orders (
+                orderId TEXT PRIMARY KEY,
+                marketId TEXT NOT NULL,
+                status TEXT NOT NULL,
+                txHash TEXT,
+                blockNumber INTEGER,
+                closeSharesAmount TEXT NOT NULL,
+                openMPHTokenAmount TEXT NOT NULL,
+                direction INTEGER NOT NULL,
+                leverage TEXT NOT NULL,
+                onlyIfPriceAbove TEXT NOT NULL,
+                onlyIfPriceBelow TEXT NOT NULL,
+                goodUntil INTEGER NOT NULL,
+                goodFrom INTEGER NOT NULL,
+                createdAt REAL NOT NULL,
+                updatedAt REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        for row in self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM orders"):
+            order = dict(zip(_COLUMNS, row))
+            for key in ("closeSharesAmount", "openMPHTokenAmount", "leverage", "onlyIfPriceAbove", "onlyIfPriceBelow"):
+                order[key] = int(order[key])
+            order["direction"] = bool(order["direction"])
+            self._index(order)
+
+    def _index(self, order):
+        self._orders[order["orderId"]] = order
+        self._by_market[order["marketId"]].add(order["orderId"])
+        self._by_status[order["status"]].add(order["orderId"])
+
+    def _save(self, order):
+        row = dict(order)
+        for key in ("closeSharesAmount", "openMPHTokenAmount", "leverage", "onlyIfPriceAbove", "onlyIfPriceBelow"):
+            row[key] = str(row[key])
+        row["direction"] = int(row["direction"])
+        self._db.execute(
+            f"INSERT OR REPLACE INTO orders ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            [row[column] for column in _COLUMNS]
+        )
+        self._db.commit()
+
+    def add(
+            self,
+            order_id: str,
+            market_id: str,
+            close_shares_amount: int,
+            open_mph_token_amount: int,
+            direction: bool,
+            leverage: int,
+            only_if_price_above: int = 0,
+            only_if_price_below: int = 0,
+            good_until: int = 0,
+            good_from: int = 0,
+            tx_hash: str = None,
+            block_number: int = None
+        ):
+        """
+        Records a newly created order as open. Adding an order that is already known is a no-op.
+
+        Returns:
+            dict: The stored order.
+        """
+        order_id = order_id.lower()
+        with self._lock:
+            if order_id in self._orders:
+                return dict(self._orders[order_id])
+            now = time.time()
+            order = {
+                "orderId": order_id,
+                "marketId": market_id.lower(),
+                "status": STATUS_OPEN,
+                "txHash": tx_hash,
+                "blockNumber": block_number,
+                "closeSharesAmount": close_shares_amount,
+                "openMPHTokenAmount": open_mph_token_amount,
+                "direction": direction,
+                "leverage": leverage,
+                "onlyIfPriceAbove": only_if_price_above,
+                "onlyIfPriceBelow": only_if_price_below,
+                "goodUntil": good_until,
+                "goodFrom": good_from,
+                "createdAt": now,
+                "updatedAt": now,
+            }
+            self._index(order)
+            self._save(order)
+            return dict(order)
+
+    def update_status(self, order_id: str, status: str):
+        """
+        Moves an order to a new state.
+
+        Returns:
+            bool: True if the order changed state, False if it's unknown or the transition is not allowed.
+        """
+        order_id = order_id.lower()
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or status not in TRANSITIONS[order["status"]]:
+                return False
+            self._by_status[order["status"]].discard(order_id)
+            order["status"] = status
+            order["updatedAt"] = time.time()
+            self._by_status[status].add(order_id)
+            self._save(order)
+            return True
+
+    def get(self, order_id: str):
+        """Get a copy of a single order, None if unknown."""
+        with self._lock:
+            order = self._orders.get(order_id.lower())
+            return dict(order) if order is not None else None
+
+    def orders(self, market_id: str = None, statuses: tuple = None):
+        """List orders, optionally filtered by market and status, oldest first."""
+        with self._lock:
+            if market_id is not None:
+                ids = set(self._by_market.get(market_id.lower(), ()))
+            else:
+                ids = set(self._orders)
+            if statuses is not None:
+                ids &= set().union(*(self._by_status.get(status, ()) for status in statuses))
+            return sorted((dict(self._orders[order_id]) for order_id in ids), key=lambda order: order["createdAt"])
+
+    def open_orders(self, market_id: str = None):
+        """List orders that may still be executed on chain."""
+        return self.orders(market_id, ACTIVE_STATUSES)
+
+    def is_active(self, order_id: str):
+        with self._lock:
+            order = self._orders.get(order_id.lower())
+            return order is not None and order["status"] in ACTIVE_STATUSES
+
+    def expire(self, now: float = None):
+        """
+        Marks open orders whose `good_until` has passed as expired.
+
+        Returns:
+            list: IDs of the expired orders.
+        """
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            for order_id in list(self._by_status[STATUS_OPEN] | self._by_status[STATUS_CANCEL_REQUESTED]):
+                good_until = self._orders[order_id]["goodUntil"]
+                if good_until and good_until < now and self.update_status(order_id, STATUS_EXPIRED):
+                    expired.append(order_id)
+        return expired
+
+    def close(self):
+        with self._lock:
+            self._db.close()
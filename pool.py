@@ -0,0 +1,217 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import itertools
+import threading
+from errors import OrderError, PositionError
+from risk import RiskEngine
+from trading import MorpherTrading, SIDECHAIN_RPC, ZERO_ADDRESS
+
+
+ROUTE_BY_MARKET = 'market'
+ROUTE_ROUND_ROBIN = 'round_robin'
+
+
+class AccountPool:
+    """
+    Spreads orders over several accounts so independent markets don't queue behind each other.
+
+    Every account has its own nonce lane: a single worker thread that sends its transactions in
+    order, while different accounts send and wait for confirmations in parallel. Orders are routed
+    by market (every market always trades on the same account) or round-robin. The pool exposes
+    the same methods as `MorpherTrading`, so it can be passed to the strategies as trading engine.
+
+    Every account gets its own `RiskEngine` built from `risk_limits`, since balance and positions
+    are per account. Other keyword arguments are passed to every `MorpherTrading`.
+    """
+
+    def __init__(
+            self,
+            private_keys: list,
+            routing: str = ROUTE_BY_MARKET,
+            rpc_url: str = SIDECHAIN_RPC,
+            risk_limits: dict = None,
+            **kwargs
+        ):
+        if len(private_keys) == 0:
+            raise ValueError("Account pool needs at least one private key!")
+        if routing not in (ROUTE_BY_MARKET, ROUTE_ROUND_ROBIN):
+            raise ValueError(f"Unknown routing: {routing}")
+        if "risk_engine" in kwargs:
+            raise ValueError("A risk engine can't be shared by the accounts, pass its limits as risk_limits!")
+        self.routing = routing
+        self.accounts = [
+            MorpherTrading(
+                private_key=key,
+                rpc_url=rpc_url,
+                risk_engine=RiskEngine(**risk_limits) if risk_limits is not None else None,
+                **kwargs
+            )
+            for key in private_keys
+        ]
+        # refreshes the engines of all accounts when the strategies refresh "the" risk engine
+        self.risk_engine = PoolRiskEngine(self) if risk_limits is not None else None
+        self.price_store = kwargs.get("price_store")  # shared by all accounts
+
+        self._lanes = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"lane-{i}") for i in range(len(self.accounts))]
+        self._readers = ThreadPoolExecutor(max_workers=len(self.accounts), thread_name_prefix="pool-read")
+        self._round_robin = itertools.count()
+        self._round_robin_lock = threading.Lock()
+
+    @property
+    def address(self):
+        # of the first account, read on first use so building the pool doesn't connect
+        return self.accounts[0].address
+
+    def _account_index(self, market_id: str):
+        if self.routing == ROUTE_BY_MARKET:
+            # stable across restarts, so positions are always found on the same account
+            return int(market_id, 16) % len(self.accounts)
+        with self._round_robin_lock:
+            return next(self._round_robin) % len(self.accounts)
+
+    def _submit(self, index: int, fn, *args, **kwargs):
+        # runs in the caller's context, so the lane's events keep the correlation ids of the tick
+        return self._lanes[index].submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def _map_accounts(self, method: str, *args):
+        return list(self._readers.map(lambda account: getattr(account, method)(*args), self.accounts))
+
+    def submitOpenPosition(self, market_id: str, *args, **kwargs):
+        """
+        Queues `MorpherTrading.openPosition` on the lane of the routed account.
+
+        Returns:
+            Future: resolves to the ID of the order.
+        """
+        index = self._account_index(market_id)
+        return self._submit(index, self.accounts[index].openPosition, market_id, *args, **kwargs)
+
+    def submitClosePosition(self, market_id: str, *args, **kwargs):
+        """
+        Queues `MorpherTrading.closePosition` on the lanes of the accounts holding a position in the market.
+
+        Returns:
+            list: Futures resolving to the IDs of the orders, one per account with a position.
+        """
+        if self.routing == ROUTE_BY_MARKET:
+            indexes = [self._account_index(market_id)]
+        else:
+            positions = self._map_accounts("getPosition", market_id)
+            indexes = [i for i, position in enumerate(positions) if position["longShares"] > 0 or position["shortShares"] > 0]
+            if len(indexes) == 0:
+                raise PositionError(market_id, "No position found for this market!")
+        return [self._submit(i, self.accounts[i].closePosition, market_id, *args, **kwargs) for i in indexes]
+
+    def openPosition(self, market_id: str, *args, **kwargs):
+        """Same as `MorpherTrading.openPosition`, on the routed account."""
+        return self.submitOpenPosition(market_id, *args, **kwargs).result()
+
+    def closePosition(self, market_id: str, *args, **kwargs):
+        """
+        Same as `MorpherTrading.closePosition`, on every account holding a position in the market.
+
+        Returns:
+            str: ID of the order, or a list of IDs if the position is spread over several accounts.
+        """
+        order_ids = [future.result() for future in self.submitClosePosition(market_id, *args, **kwargs)]
+        return order_ids[0] if len(order_ids) == 1 else order_ids
+
+    def cancelOrder(self, order_id: str):
+        """Same as `MorpherTrading.cancelOrder`, on the account that created the order."""
+        owner = self.accounts[0].rpc.call(self.accounts[0].morpher_trade_engine.functions.getOrder(order_id).call)[0]
+        if owner == ZERO_ADDRESS:
+            return False
+        for i, account in enumerate(self.accounts):
+            if account.address.lower() == owner.lower():
+                return self._submit(i, account.cancelOrder, order_id).result()
+        raise OrderError("Cannot cancel another user order!")
+
+    def getBalance(self):
+        """
+        Shows the MPH balance of all accounts together.
+
+        Returns:
+            float: total MPH balance.
+        """
+        return sum(self._map_accounts("getBalance"))
+
+    def getBalances(self):
+        """
+        Shows the MPH balance of each account.
+
+        Returns:
+            dict: MPH balance by account address.
+        """
+        return dict(zip((account.address for account in self.accounts), self._map_accounts("getBalance")))
+
+    def getPositions(self, market_id: str):
+        """
+        Shows the position of each account in a market.
+
+        Returns:
+            dict: `MorpherTrading.getPosition` result by account address.
+        """
+        return dict(zip((account.address for account in self.accounts), self._map_accounts("getPosition", market_id)))
+
+    def getPosition(self, market_id: str):
+        """
+        Shows the position of all accounts in a market combined into one, averages are weighted by shares.
+
+        Returns:
+            dict: All information regarding the combined position in the market.
+        """
+        positions = self._map_accounts("getPosition", market_id)
+        long_shares = sum(position["longShares"] for position in positions)
+        short_shares = sum(position["shortShares"] for position in positions)
+        total_shares = long_shares + short_shares
+
+        def weighted(key):
+            if total_shares == 0:
+                return 0
+            return sum(position[key] * (position["longShares"] + position["shortShares"]) for position in positions) // total_shares
+
+        return {
+            "longShares": long_shares,
+            "shortShares": short_shares,
+            "averagePrice": weighted("averagePrice"),
+            "averageSpread": weighted("averageSpread"),
+            "averageLeverage": weighted("averageLeverage"),
+            "liquidationPrice": weighted("liquidationPrice")
+        }
+
+    def getPositionValue(self, market_id: str, current_price: float = None, current_spread: float = None):
+        """
+        Shows the value of the positions of all accounts in a market.
+
+        Returns:
+            float: Position value in MPH.
+        """
+        if current_price is None and self.price_store is not None:
+            # read the store once, so all accounts are valued at the same quote
+            current_price, spread, _ = self.price_store.quote(market_id)
+            if current_spread is None:
+                current_spread = spread
+        return sum(self._map_accounts("getPositionValue", market_id, current_price, current_spread))
+
+    def refreshRisk(self, market_ids: list):
+        """Loads the balance and the positions in `market_ids` of every account into its risk engine."""
+        list(self._readers.map(lambda account: account.risk_engine.refresh(account, market_ids), self.accounts))
+
+    def shutdown(self):
+        """Waits for all queued orders and stops the lanes."""
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+
+class PoolRiskEngine:
+    """
+    Stands in for the risk engine of a single client, for the strategies: `refresh` loads the
+    engine of every account of the pool. The checks run in each account's own engine.
+    """
+
+    def __init__(self, pool: AccountPool):
+        self.pool = pool
+
+    def refresh(self, trading, market_ids: list):
+        self.pool.refreshRisk(market_ids)
@@ -0,0 +1,173 @@
+from array import array
+from errors import MorpherError
+import math
+import threading
+import time
+
+
+class StalePrice(MorpherError):
+    """Raised when a price is missing or older than allowed."""
+
+    def __init__(self, market_id: str, age: float = None):
+        if age is None:
+            super().__init__(f"No price for {market_id}!")
+        else:
+            super().__init__(f"Price of {market_id} is {age:.1f} seconds old!")
+        self.market_id = market_id
+        self.age = age
+
+    def __reduce__(self):
+        return (StalePrice, (self.market_id, self.age))
+
+
+class PriceStore:
+    """
+    Latest price, spread and timestamp of every market, shared by the feeds, the strategies
+    and the valuation calls of one process.
+
+    The values live in flat `array` columns indexed by a slot per market. Any number of feeds
+    can write; reads take no lock and use a per slot sequence number instead (a seqlock): the
+    writer makes it odd while it updates the slot, and a reader retries when it saw an odd or
+    changed sequence, so it never returns a price with the timestamp of another update.
+
+    Prices are floats in USD, timestamps unix seconds. A spread that was never set is NaN and
+    read as None.
+    """
+
+    def __init__(self, capacity: int = 256, max_age: float = 60):
+        self.max_age = max_age  # default staleness limit in seconds for `price`
+        self._slots = {}        # market id -> slot, only ever grows
+        self._seq = array("Q", bytes(8 * capacity))
+        self._prices = array("d", [math.nan] * capacity)
+        self._spreads = array("d", [math.nan] * capacity)
+        self._timestamps = array("d", [0.0] * capacity)
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, market_id: str):
+        return market_id.lower() in self._slots
+
+    def _slot(self, market_id):
+        slot = self._slots.get(market_id)
+        if slot is not None:
+            return slot
+        slot = len(self._slots)
+        if slot == len(self._seq):
+            # double the columns, readers holding the old arrays only see an older snapshot
+            self._seq = self._seq + array("Q", bytes(8 * slot))
+            self._prices = self._prices + array("d", [math.nan] * slot)
+            self._spreads = self._spreads + array("d", [math.nan] * slot)
+            self._timestamps = self._timestamps + array("d", [0.0] * slot)
+        self._slots[market_id] = slot
+        return slot
+
+    def update(self, market_id: str, price: float, spread: float = None, timestamp: float = None):
+        """
+        Stores the latest price of a market. Updates older than the stored one are ignored, so
+        several feeds can write the same market.
+
+        Args:
+            market_id (str): The ID (hash) of the market.
+            price (float): The market price.
+            spread (float): The market spread in USD, None to keep the last known spread.
+            timestamp (float): Time of the price in unix seconds, None for now.
+
+        Returns:
+            bool: True if the price was stored.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._write_lock:
+            slot = self._slot(market_id.lower())
+            if timestamp < self._timestamps[slot]:
+                return False
+            seq = self._seq[slot]
+            self._seq[slot] = seq + 1
+            self._prices[slot] = price
+            if spread is not None:
+                self._spreads[slot] = spread
+            self._timestamps[slot] = timestamp
+            self._seq[slot] = seq + 2
+            return True
+
+    def get(self, market_id: str):
+        """
+        Reads the latest quote of a market without locking.
+
+        Returns:
+            tuple: (price, spread, timestamp), spread None if unknown, or None if the market has no price.
+        """
+        slot = self._slots.get(market_id.lower())
+        if slot is None:
+            return None
+        while True:
+            seq = self._seq[slot]
+            if seq & 1:
+                continue  # being written
+            price, spread, timestamp = self._prices[slot], self._spreads[slot], self._timestamps[slot]
+            if self._seq[slot] == seq:
+                return price, (None if math.isnan(spread) else spread), timestamp
+
+    def age(self, market_id: str, now: float = None):
+        """Seconds since the last price of a market, None if it has none."""
+        quote = self.get(market_id)
+        if quote is None:
+            return None
+        return (time.time() if now is None else now) - quote[2]
+
+    def is_stale(self, market_id: str, max_age: float = None):
+        age = self.age(market_id)
+        return age is None or age > (self.max_age if max_age is None else max_age)
+
+    def quote(self, market_id: str, max_age: float = None):
+        """
+        Get the latest quote of a market, checked for staleness. Price and spread come from the
+        same update, unlike separate `price` and `get` calls.
+
+        Args:
+            max_age (float): Maximum age in seconds, the store's `max_age` if None.
+
+        Returns:
+            tuple: (price, spread, timestamp), spread None if unknown.
+
+        Raises:
+            StalePrice: If the market has no price or it's too old.
+        """
+        quote = self.get(market_id)
+        if quote is None:
+            raise StalePrice(market_id)
+        age = time.time() - quote[2]
+        if age > (self.max_age if max_age is None else max_age):
+            raise StalePrice(market_id, age)
+        return quote
+
+    def price(self, market_id: str, max_age: float = None):
+        """
+        Get the latest price of a market.
+
+        Args:
+            max_age (float): Maximum age in seconds, the store's `max_age` if None.
+
+        Raises:
+            StalePrice: If the market has no price or it's too old.
+        """
+        return self.quote(market_id, max_age)[0]
+
+    def snapshot(self):
+        """Get the latest (price, spread, timestamp) of every market."""
+        return {market_id: self.get(market_id) for market_id in list(self._slots)}
+
+    def listener(self, markets: dict):
+        """
+        Get a `BinanceTradeFeed` listener writing the trades into the store.
+
+        Args:
+            markets (dict): Market id of every Binance symbol, e.g. {"btcusdt": "0x0bc8..."}.
+        """
+        def on_trade(symbol, price, timestamp):
+            market_id = markets.get(symbol)
+            if market_id is not None:
+                self.update(market_id, price, timestamp=timestamp)
+
+        return on_trade
@@ -0,0 +1,254 @@
+import logging
+import random
+import threading
+import time
+from errors import CircuitOpen, EndpointError, MorpherError
+from eventlog import event, get_logger
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+log = get_logger("resilience")
+
+
+def is_transient(error: Exception):
+    """
+    Tells whether a failed call may succeed when repeated: connection errors, timeouts, rate
+    limiting (HTTP 429) and server errors (HTTP 5xx). Answers like a reverted call or a bad
+    request are not.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # requests and urllib3 errors are OSErrors too
+    return isinstance(error, (OSError, TimeoutError))
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average and bursts of up to `burst` calls."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Waits for a token.
+
+        Returns:
+            float: Seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # take the token now, callers queue up behind each other in the negative balance
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` transient failures in a row: the breaker opens and calls
+    are rejected with `CircuitOpen` for `reset_timeout` seconds. Then one trial call is let
+    through (half open), which closes the breaker again on success or reopens it on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened = 0  # times the breaker opened
+        self._opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises `CircuitOpen` if the call is not allowed right now."""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == BREAKER_OPEN and retry_in <= 0:
+                self.state = BREAKER_HALF_OPEN
+            if self.state == BREAKER_HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            raise CircuitOpen(self.name, max(retry_in, 0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != BREAKER_CLOSED:
+                event(log, logging.INFO, "circuit_closed", endpoint=self.name)
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED and self.failures >= self.failure_threshold):
+                self.state = BREAKER_OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                event(log, logging.WARNING, "circuit_opened", endpoint=self.name, failures=self.failures)
+
+
+class Endpoint:
+    """
+    Policies for calling one remote endpoint: rate limiting, retries and a circuit breaker.
+
+    Idempotent calls (reads) are retried on transient errors with exponential backoff and full
+    jitter, so many clients retrying together don't hit the endpoint in lockstep. Other calls
+    (sending a transaction) are tried once. Errors are raised as `error_type`, a subclass of
+    `EndpointError`, with `transient` set if they came from the connection rather than the
+    answer.
+    """
+
+    def __init__(self, name: str, error_type: type = EndpointError, **settings):
+        self.name = name
+        self.error_type = error_type
+        self.configure(**settings)
+
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0  # calls refused by the open breaker
+        self.throttled_seconds = 0
+        self._metrics_lock = threading.Lock()
+
+    def configure(
+            self,
+            rate: float = None,
+            burst: int = None,
+            attempts: int = 3,
+            base_delay: float = 0.2,
+            max_delay: float = 5,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30
+        ):
+        """
+        Sets the policies, the counters are kept.
+
+        Args:
+            rate (float): Calls per second allowed on average, None for no limit.
+            burst (int): Calls allowed at once, `rate` rounded down if None.
+            attempts (int): Tries of an idempotent call before giving up.
+            base_delay (float): Upper bound of the first retry delay in seconds, doubled on every retry.
+            max_delay (float): Upper bound of any retry delay in seconds.
+            failure_threshold (int): Transient failures in a row that open the breaker.
+            reset_timeout (float): Seconds the breaker stays open before a trial call.
+        """
+        self.bucket = TokenBucket(rate, burst) if rate is not None else None
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(self.name, failure_threshold, reset_timeout)
+
+    def _count(self, field, value=1):
+        with self._metrics_lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def call(self, fn, *args, idempotent: bool = True, **kwargs):
+        """
+        Calls `fn(*args, **kwargs)` under the endpoint's policies.
+
+        Raises:
+            CircuitOpen: if the breaker is open, without calling `fn`.
+            EndpointError: `error_type` if the call failed.
+        """
+        attempts = self.attempts if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                self.breaker.before_call()
+            except CircuitOpen:
+                self._count("rejected")
+                raise
+            if self.bucket is not None:
+                self._count("throttled_seconds", self.bucket.acquire())
+            self._count("calls")
+            try:
+                result = fn(*args, **kwargs)
+            except MorpherError:
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                self._count("failures")
+                if not is_transient(e):
+                    # the endpoint answered, it's up
+                    self.breaker.record_success()
+                    raise self.error_type(self.name, f"{type(e).__name__}: {e}") from e
+                self.breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise self.error_type(self.name, f"{type(e).__name__}: {e}", transient=True) from e
+                self._count("retries")
+                event(log, logging.DEBUG, "retry", endpoint=self.name, attempt=attempt + 1, error=f"{type(e).__name__}: {e}")
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                "breaker": self.breaker.state,
+                "breakerOpened": self.breaker.opened,
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "throttledSeconds": round(self.throttled_seconds, 3),
+            }
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint(name: str, error_type: type = None, **settings):
+    """
+    Get the shared `Endpoint` called `name`, so all clients of the same RPC url or API share
+    one rate limit and breaker. `settings` (see `Endpoint.configure`) only apply when it's
+    created, use `configure` to change an existing one.
+    """
+    with _endpoints_lock:
+        if name not in _endpoints:
+            _endpoints[name] = Endpoint(name, error_type or EndpointError, **settings)
+        elif error_type is not None:
+            _endpoints[name].error_type = error_type
+        return _endpoints[name]
+
+
+def configure(name: str, **settings):
+    """Changes the policies of an endpoint, e.g. configure("binance", rate=5)."""
+    item = endpoint(name)
+    item.configure(**settings)
+    return item
+
+
+def metrics():
+    """Get the breaker state and call counters of every endpoint."""
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+    return {item.name: item.metrics() for item in endpoints}
@@ -0,0 +1,260 @@
+from collections import deque
+from errors import MorpherError
+import threading
+import time
+
+
+class RiskRejected(MorpherError):
+    """Raised when an order fails a pre-trade check. Nothing has been signed or sent."""
+
+    def __init__(self, market_id: str, reason: str):
+        super().__init__(f"Order rejected for market {market_id}: {reason}")
+        self.market_id = market_id
+        self.reason = reason
+
+    def __reduce__(self):
+        # keeps the exception picklable, so it can be passed back from another process
+        return (RiskRejected, (self.market_id, self.reason))
+
+
+class RiskEngine:
+    """
+    Pre-trade checks run against a locally cached snapshot of the account.
+
+    The snapshot (balance and positions) is loaded with `refresh`, which is the only method
+    doing RPC calls, and then kept up to date optimistically as orders are sent, so the checks
+    themselves never leave the process. Limits set to None are not checked.
+
+    Clients shared by several threads use `reserve_open` and `reserve_close`, which check an
+    order and take its balance, exposure and order slot in one step, so concurrent orders can't
+    all pass against the same snapshot. The reservation is then either committed once the order
+    is sent or released if it couldn't be.
+    """
+
+    def __init__(
+            self,
+            min_leverage: float = 1.0,
+            max_leverage: float = 10.0,
+            max_order_mph: float = None,
+            max_market_exposure_mph: float = None,
+            max_total_exposure_mph: float = None,
+            min_free_balance_mph: float = 0,
+            max_orders: int = None,
+            orders_window_seconds: float = 60,
+            max_snapshot_age: float = None
+        ):
+        self.min_leverage = min_leverage
+        self.max_leverage = max_leverage
+        self.max_order_mph = max_order_mph
+        self.max_market_exposure_mph = max_market_exposure_mph  # collateral * leverage per market
+        self.max_total_exposure_mph = max_total_exposure_mph
+        self.min_free_balance_mph = min_free_balance_mph
+        self.max_orders = max_orders  # max orders sent per `orders_window_seconds`
+        self.orders_window_seconds = orders_window_seconds
+        self.max_snapshot_age = max_snapshot_age
+
+        self.balance = None
+        self.positions = {}  # market id -> {"longShares": int, "shortShares": int}
+        self.exposure = {}   # market id -> notional exposure in MPH
+        self.snapshot_time = None
+
+        self._order_times = deque()
+        self._pending = {}  # (market id, direction) -> open orders reserved and not committed yet
+        self._lock = threading.Lock()
+
+    def refresh(self, trading, market_ids: list):
+        """Load balance and positions of the given markets from chain."""
+        balance = trading.getBalance()
+        positions = {market_id: trading.getPosition(market_id) for market_id in market_ids}
+        with self._lock:
+            self.balance = balance
+            for market_id, position in positions.items():
+                self._set_position(market_id.lower(), position)
+            self.snapshot_time = time.time()
+
+    def set_snapshot(self, balance: float, positions: dict):
+        """Set the snapshot directly, `positions` maps market ids to `MorpherTrading.getPosition` results."""
+        with self._lock:
+            self.balance = balance
+            for market_id, position in positions.items():
+                self._set_position(market_id.lower(), position)
+            self.snapshot_time = time.time()
+
+    def _set_position(self, market_id, position):
+        self.positions[market_id] = {"longShares": position["longShares"], "shortShares": position["shortShares"]}
+        # shares are valued at the average price with 8 decimals, so shares * price is the notional in WEI
+        shares = position["longShares"] + position["shortShares"]
+        self.exposure[market_id] = shares * position["averagePrice"] / 1e18
+
+    def _check_common(self, market_id, now):
+        if self.snapshot_time is None:
+            raise RiskRejected(market_id, "no account snapshot loaded")
+        if self.max_snapshot_age is not None and now - self.snapshot_time > self.max_snapshot_age:
+            raise RiskRejected(market_id, f"account snapshot older than {self.max_snapshot_age}s")
+        if self.max_orders is not None:
+            while self._order_times and self._order_times[0] < now - self.orders_window_seconds:
+                self._order_times.popleft()
+            if len(self._order_times) >= self.max_orders:
+                raise RiskRejected(market_id, f"more than {self.max_orders} orders in {self.orders_window_seconds}s")
+
+    def check_open(self, market_id: str, mph_token_amount: float, direction: bool, leverage: float):
+        """
+        Validates a new position order.
+
+        Args:
+            market_id (str): The ID (hash) of the market.
+            mph_token_amount (float): The amount of MPH tokens used for the position.
+            direction (bool): `True` for long, `False` for short.
+            leverage (float): The leverage multiplier of the position.
+
+        Raises:
+            RiskRejected: if the order breaks one of the limits.
+        """
+        with self._lock:
+            self._check_open(market_id.lower(), mph_token_amount, direction, leverage, time.time())
+
+    def _check_open(self, market_id, mph_token_amount, direction, leverage, now):
+        self._check_common(market_id, now)
+        if mph_token_amount <= 0:
+            raise RiskRejected(market_id, "order amount must be positive")
+        if leverage < self.min_leverage or leverage > self.max_leverage:
+            raise RiskRejected(market_id, f"leverage {leverage} outside {self.min_leverage}-{self.max_leverage}")
+        if self.max_order_mph is not None and mph_token_amount > self.max_order_mph:
+            raise RiskRejected(market_id, f"order of {mph_token_amount} MPH above {self.max_order_mph} MPH")
+        if mph_token_amount > self.balance - self.min_free_balance_mph:
+            raise RiskRejected(market_id, f"order of {mph_token_amount} MPH above available balance of {self.balance:.2f} MPH")
+
+        position = self.positions.get(market_id)
+        if position is not None:
+            if position["longShares"] > 0 and position["shortShares"] > 0:
+                raise RiskRejected(market_id, "mixed position (long and short)")
+            if (direction and position["shortShares"] > 0) or (not direction and position["longShares"] > 0):
+                raise RiskRejected(market_id, "order direction opposite to the open position")
+        if self._pending.get((market_id, not direction)):
+            raise RiskRejected(market_id, "order direction opposite to a pending order")
+
+        notional = mph_token_amount * leverage
+        market_exposure = self.exposure.get(market_id, 0) + notional
+        if self.max_market_exposure_mph is not None and market_exposure > self.max_market_exposure_mph:
+            raise RiskRejected(market_id, f"market exposure of {market_exposure:.2f} MPH above {self.max_market_exposure_mph} MPH")
+        total_exposure = sum(self.exposure.values()) + notional
+        if self.max_total_exposure_mph is not None and total_exposure > self.max_total_exposure_mph:
+            raise RiskRejected(market_id, f"total exposure of {total_exposure:.2f} MPH above {self.max_total_exposure_mph} MPH")
+
+    def check_close(self, market_id: str):
+        """
+        Validates a close order.
+
+        Raises:
+            RiskRejected: if the order breaks one of the limits.
+        """
+        with self._lock:
+            self._check_close(market_id.lower(), time.time())
+
+    def _check_close(self, market_id, now):
+        self._check_common(market_id, now)
+        position = self.positions.get(market_id)
+        if position is not None and position["longShares"] > 0 and position["shortShares"] > 0:
+            raise RiskRejected(market_id, "mixed position (long and short)")
+
+    def reserve_open(self, market_id: str, mph_token_amount: float, direction: bool, leverage: float):
+        """
+        Validates a new position order like `check_open` and reserves its balance, exposure and
+        order slot in the same step.
+
+        Returns:
+            dict: The reservation, to pass to `commit` once the order is sent or to `release`.
+
+        Raises:
+            RiskRejected: if the order breaks one of the limits, nothing is reserved then.
+        """
+        market_id = market_id.lower()
+        now = time.time()
+        with self._lock:
+            self._check_open(market_id, mph_token_amount, direction, leverage, now)
+            self._order_times.append(now)
+            self.balance -= mph_token_amount
+            self.exposure[market_id] = self.exposure.get(market_id, 0) + mph_token_amount * leverage
+            self._pending[(market_id, direction)] = self._pending.get((market_id, direction), 0) + 1
+            return {
+                "marketId": market_id, "mphTokenAmount": mph_token_amount, "direction": direction,
+                "notional": mph_token_amount * leverage, "time": now, "snapshotTime": self.snapshot_time,
+            }
+
+    def reserve_close(self, market_id: str):
+        """
+        Validates a close order like `check_close` and reserves its order slot in the same step.
+
+        Returns:
+            dict: The reservation, to pass to `commit` once the order is sent or to `release`.
+
+        Raises:
+            RiskRejected: if the order breaks one of the limits, nothing is reserved then.
+        """
+        market_id = market_id.lower()
+        now = time.time()
+        with self._lock:
+            self._check_close(market_id, now)
+            self._order_times.append(now)
+            return {"marketId": market_id, "direction": None, "time": now, "snapshotTime": self.snapshot_time}
+
+    def commit(self, reservation: dict, fraction: float = None):
+        """
+        Updates the snapshot after the reserved order was sent. `fraction` (0 to 1) is the part
+        of the position a close order closes.
+        """
+        market_id = reservation["marketId"]
+        with self._lock:
+            if reservation["direction"] is None:
+                self._reduce_position(market_id, fraction)
+                return
+            self._pending[(market_id, reservation["direction"])] -= 1
+            self._mark_open(market_id, reservation["direction"])
+
+    def release(self, reservation: dict):
+        """Gives back what a reservation took when its order could not be sent."""
+        market_id = reservation["marketId"]
+        with self._lock:
+            try:
+                self._order_times.remove(reservation["time"])
+            except ValueError:
+                pass  # already out of the window
+            if reservation["direction"] is None:
+                return
+            self._pending[(market_id, reservation["direction"])] -= 1
+            if reservation["snapshotTime"] == self.snapshot_time:
+                # a refresh since the reservation already holds the real balance and exposure
+                self.balance += reservation["mphTokenAmount"]
+                self.exposure[market_id] = self.exposure.get(market_id, 0) - reservation["notional"]
+
+    def record_open(self, market_id: str, mph_token_amount: float, direction: bool, leverage: float):
+        """Update the snapshot after an open order was sent."""
+        market_id = market_id.lower()
+        with self._lock:
+            self._order_times.append(time.time())
+            if self.balance is not None:
+                self.balance -= mph_token_amount
+            self.exposure[market_id] = self.exposure.get(market_id, 0) + mph_token_amount * leverage
+            self._mark_open(market_id, direction)
+
+    def _mark_open(self, market_id, direction):
+        position = self.positions.setdefault(market_id, {"longShares": 0, "shortShares": 0})
+        # the share amount is unknown until the order is processed, mark the side as open
+        if direction:
+            position["longShares"] = max(position["longShares"], 1)
+        else:
+            position["shortShares"] = max(position["shortShares"], 1)
+
+    def record_close(self, market_id: str, fraction: float):
+        """Update the snapshot after an order closing `fraction` (0 to 1) of the position was sent."""
+        market_id = market_id.lower()
+        with self._lock:
+            self._order_times.append(time.time())
+            self._reduce_position(market_id, fraction)
+
+    def _reduce_position(self, market_id, fraction):
+        self.exposure[market_id] = self.exposure.get(market_id, 0) * max(0.0, 1 - fraction)
+        position = self.positions.get(market_id)
+        if position is not None:
+            position["longShares"] = round(position["longShares"] * max(0.0, 1 - fraction))
+            position["shortShares"] = round(position["shortShares"] * max(0.0, 1 - fraction))
@@ -0,0 +1,381 @@
+from concurrent.futures import ThreadPoolExecutor
+from eventlog import configure_logging, event, get_logger
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+import os
+import pickle
+import struct
+import threading
+import time
+from feeds import BinanceTradeFeed
+
+_HEADER = struct.Struct("<Q")   # sequence number of the last written tick
+_SLOT = struct.Struct("<QQdd")  # sequence number, symbol index, price, trade timestamp
+
+# per process fields in the shared health array
+HEALTH_HEARTBEAT = 0
+HEALTH_TICKS = 1
+HEALTH_DROPPED = 2
+HEALTH_LAG = 3
+HEALTH_FIELDS = 4
+
+# trading engine methods the workers are allowed to call
+PROXY_METHODS = ("openPosition", "closePosition", "cancelOrder", "getBalance", "getPosition", "getPositionValue")
+
+log = get_logger("runner")
+
+
+class TickRing:
+    """
+    Ring buffer of ticks in shared memory, with one writer and one reader process.
+
+    The writer never waits: a reader that falls more than `slots - 1` ticks behind loses the
+    oldest ones and gets them reported as dropped (the slot after the head is the one the
+    writer overwrites next, so it is never read). Ticks are read in place with `struct.unpack_from`,
+    nothing is serialized or copied through a pipe.
+    """
+
+    def __init__(self, name: str = None, slots: int = 4096):
+        self.slots = slots
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + slots * _SLOT.size)
+            _HEADER.pack_into(self._shm.buf, 0, 0)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.name = self._shm.name
+
+    def head(self):
+        return _HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    def write(self, symbol_index: int, price: float, timestamp: float):
+        seq = self.head() + 1
+        _SLOT.pack_into(self._shm.buf, _HEADER.size + (seq % self.slots) * _SLOT.size, seq, symbol_index, price, timestamp)
+        _HEADER.pack_into(self._shm.buf, 0, seq)
+
+    def read(self, cursor: int):
+        """
+        Reads the ticks written after `cursor`.
+
+        Returns:
+            tuple: list of (symbol index, price, timestamp), the new cursor and the number of dropped ticks.
+        """
+        head = self.head()
+        dropped = 0
+        # the writer may already be overwriting the slot of seq head + 1 - slots with seq head + 1,
+        # so at most the last slots - 1 ticks can be read
+        if head - cursor > self.slots - 1:
+            dropped = head - cursor - (self.slots - 1)
+            cursor = head - self.slots + 1
+        ticks = []
+        for seq in range(cursor + 1, head + 1):
+            slot_seq, symbol_index, price, timestamp = _SLOT.unpack_from(self._shm.buf, _HEADER.size + (seq % self.slots) * _SLOT.size)
+            if slot_seq != seq:
+                dropped += 1
+                continue
+            ticks.append((seq, symbol_index, price, timestamp))
+        # slots the writer lapped, or is writing, while we were reading them may be torn
+        oldest_valid = self.head() - self.slots + 1
+        valid = [(symbol_index, price, timestamp) for seq, symbol_index, price, timestamp in ticks if seq > oldest_valid]
+        return valid, head, dropped + len(ticks) - len(valid)
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class TradingProxy:
+    """
+    Stands in for the trading engine inside a worker process. Calls are sent to the runner over
+    the worker's own pipe, the runner executes them on the one trading engine of the account and
+    returns the result.
+    """
+
+    risk_engine = None  # checked by the trading engine in the main process
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def _call(self, method, *args, **kwargs):
+        self._connection.send((method, args, kwargs))
+        ok, result = self._connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def openPosition(self, *args, **kwargs):
+        return self._call("openPosition", *args, **kwargs)
+
+    def closePosition(self, *args, **kwargs):
+        return self._call("closePosition", *args, **kwargs)
+
+    def cancelOrder(self, *args, **kwargs):
+        return self._call("cancelOrder", *args, **kwargs)
+
+    def getBalance(self):
+        return self._call("getBalance")
+
+    def getPosition(self, *args, **kwargs):
+        return self._call("getPosition", *args, **kwargs)
+
+    def getPositionValue(self, *args, **kwargs):
+        return self._call("getPositionValue", *args, **kwargs)
+
+
+def _feed_main(symbols, ring_names, ring_slots, shards, health, log_level):
+    configure_logging(log_level)
+    rings = [TickRing(name, ring_slots) for name in ring_names]
+    symbol_indexes = {symbol: i for i, symbol in enumerate(symbols)}
+    base = len(ring_names) * HEALTH_FIELDS
+
+    def publish(symbol, price, timestamp):
+        symbol_index = symbol_indexes.get(symbol)
+        if symbol_index is None:
+            return
+        rings[shards[symbol_index]].write(symbol_index, price, timestamp)
+        health[base + HEALTH_HEARTBEAT] = time.time()
+        health[base + HEALTH_TICKS] += 1
+        health[base + HEALTH_LAG] = time.time() - timestamp
+
+    feed = BinanceTradeFeed(symbols)
+    feed.add_listener(publish)
+    feed.run_forever()
+
+
+def _load_position(strategy, health, base):
+    # a restarted strategy starts from a blank state, it must not trade before it knows its position
+    load_position = getattr(strategy, "load_position", None)
+    while load_position is not None:
+        health[base + HEALTH_HEARTBEAT] = time.time()
+        try:
+            load_position()
+            return
+        except Exception as e:
+            event(log, logging.WARNING, "load_position_failed", error=str(e), errorType=type(e).__name__)
+            time.sleep(5)
+
+
+def _worker_main(worker, ring_name, ring_slots, symbols, strategies, connection, health, log_level):
+    configure_logging(log_level)
+    ring = TickRing(ring_name, ring_slots)
+    trading = TradingProxy(connection)
+    base = worker * HEALTH_FIELDS
+    by_symbol = {}
+    for spec in strategies:
+        strategy = spec["factory"](trading, **spec.get("kwargs", {}))
+        _load_position(strategy, health, base)
+        by_symbol.setdefault(symbols.index(spec["symbol"].lower()), []).append(strategy)
+
+    cursor = ring.head()
+    while True:
+        ticks, cursor, dropped = ring.read(cursor)
+        health[base + HEALTH_HEARTBEAT] = time.time()
+        if dropped:
+            health[base + HEALTH_DROPPED] += dropped
+        for symbol_index, price, timestamp in ticks:
+            for strategy in by_symbol.get(symbol_index, ()):
+                try:
+                    strategy.on_price(price)
+                except Exception as e:
+                    # one failed tick must not stop the worker, a restart would lose the strategy's state
+                    log.exception("tick_failed", extra={"fields": {"symbol": symbols[symbol_index], "error": str(e)}})
+            health[base + HEALTH_TICKS] += 1
+            health[base + HEALTH_LAG] = time.time() - timestamp
+        if len(ticks) == 0:
+            time.sleep(0.001)
+
+
+class ShardedRunner:
+    """
+    Runs tick driven strategies (with an `on_price(price)` method) in several worker processes.
+
+    Markets are sharded over the workers by their Binance symbol. A single feed process receives
+    the trades of all symbols and writes each tick to the shared memory ring of the worker owning
+    the symbol. Orders are sent back to this process and executed by the one trading engine, so
+    nonces stay with a single client per account. Dead or hung workers are restarted on their own.
+
+    Every strategy is described by a dict:
+        {"factory": SimpleMovingAverageStrategy, "symbol": "btcusdt", "kwargs": {"market_id": ..., ...}}
+    where `factory(trading_engine, **kwargs)` builds the strategy inside the worker.
+    """
+
+    def __init__(
+            self,
+            trading_engine,
+            strategies: list,
+            workers: int = None,
+            ring_slots: int = 4096,
+            report_interval: float = 30,
+            hang_timeout: float = 120,
+            log_level: str = "INFO"
+        ):
+        self.trading = trading_engine
+        self.strategies = strategies
+        self.symbols = sorted(set(spec["symbol"].lower() for spec in strategies))
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(self.symbols)))
+        self.ring_slots = ring_slots
+        self.report_interval = report_interval
+        self.hang_timeout = hang_timeout  # strategies block while their orders confirm, keep this generous
+        self.log_level = log_level  # of the feed and worker processes, they write JSON lines to stdout
+
+        # symbols are dealt out in order, so every worker gets a similar number of markets
+        self.shards = [i % self.workers for i in range(len(self.symbols))]
+        self.restarts = [0] * (self.workers + 1)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = ThreadPoolExecutor(max_workers=max(4, self.workers), thread_name_prefix="runner-orders")
+        self._running = False
+
+    def _worker_args(self, worker, connection):
+        strategies = [spec for spec in self.strategies if self.shards[self.symbols.index(spec["symbol"].lower())] == worker]
+        return (worker, self._rings[worker].name, self.ring_slots, self.symbols, strategies, connection, self._health, self.log_level)
+
+    def _start_worker(self, worker):
+        # a new pipe for every process: a killed worker may have left a message half written or read
+        # on the old one. The old pipe is closed by the request thread once it reads its end.
+        connection, worker_connection = self._context.Pipe()
+        self._health[worker * HEALTH_FIELDS + HEALTH_HEARTBEAT] = time.time()
+        process = self._context.Process(target=_worker_main, args=self._worker_args(worker, worker_connection), name=f"strategy-worker-{worker}", daemon=True)
+        process.start()
+        worker_connection.close()  # only the worker holds its end, so its death is seen as end of file
+        with self._connections_lock:
+            self._connections[connection] = threading.Lock()
+        self._processes[worker] = process
+
+    def _start_feed(self):
+        self._health[self.workers * HEALTH_FIELDS + HEALTH_HEARTBEAT] = time.time()
+        process = self._context.Process(
+            target=_feed_main,
+            args=(self.symbols, [ring.name for ring in self._rings], self.ring_slots, self.shards, self._health, self.log_level),
+            name="market-feed",
+            daemon=True
+        )
+        process.start()
+        self._processes[self.workers] = process
+
+    def _execute(self, connection, method, args, kwargs):
+        try:
+            if method not in PROXY_METHODS:
+                raise Exception(f"Method {method} is not available to strategy workers!")
+            ok, result = True, getattr(self.trading, method)(*args, **kwargs)
+        except Exception as e:
+            ok, result = False, e
+        try:
+            pickle.dumps(result)
+        except Exception:
+            ok, result = False, Exception(str(result))
+        with self._connections_lock:
+            send_lock = self._connections.get(connection)
+        if send_lock is None:
+            return  # the worker is gone, its replacement didn't ask
+        with send_lock:
+            try:
+                connection.send((ok, result))
+            except OSError:
+                pass
+
+    def _serve_orders(self):
+        while self._running:
+            with self._connections_lock:
+                connections = list(self._connections)
+            for connection in wait(connections, timeout=1):
+                try:
+                    method, args, kwargs = connection.recv()
+                except Exception:
+                    # the worker died, maybe halfway through a message: its pipe isn't used again
+                    with self._connections_lock:
+                        send_lock = self._connections.pop(connection)
+                    with send_lock:
+                        connection.close()
+                    continue
+                self._executor.submit(self._execute, connection, method, args, kwargs)
+
+    def _supervise(self):
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            heartbeat = self._health[index * HEALTH_FIELDS + HEALTH_HEARTBEAT]
+            if process.is_alive() and now - heartbeat < self.hang_timeout:
+                continue
+            name = "feed" if index == self.workers else f"worker {index}"
+            if process.is_alive():
+                event(log, logging.WARNING, "process_hung", process=name, seconds=now - heartbeat)
+                process.terminate()
+                process.join(5)
+            else:
+                event(log, logging.WARNING, "process_died", process=name, exitCode=process.exitcode)
+            self.restarts[index] += 1
+            if index == self.workers:
+                self._start_feed()
+            else:
+                self._start_worker(index)
+
+    def health(self):
+        """
+        Shows the state of the feed and worker processes.
+
+        Returns:
+            list: One dict per worker and a last one for the feed.
+        """
+        now = time.time()
+        report = []
+        for index, process in enumerate(self._processes):
+            base = index * HEALTH_FIELDS
+            report.append({
+                "name": "feed" if index == self.workers else f"worker-{index}",
+                "symbols": [symbol for i, symbol in enumerate(self.symbols) if index == self.workers or self.shards[i] == index],
+                "alive": process.is_alive(),
+                "restarts": self.restarts[index],
+                "ticks": int(self._health[base + HEALTH_TICKS]),
+                "dropped": int(self._health[base + HEALTH_DROPPED]),
+                "lag": self._health[base + HEALTH_LAG],
+                "heartbeatAge": now - self._health[base + HEALTH_HEARTBEAT],
+            })
+        return report
+
+    def _report(self):
+        for item in self.health():
+            event(log, logging.INFO, "process_health", process=item.pop("name"), **item)
+
+    def start_trading(self):
+        configure_logging(self.log_level)
+        event(log, logging.INFO, "launching", strategies=len(self.strategies), workers=self.workers)
+        if self.trading.risk_engine is not None:
+            market_ids = set(spec["kwargs"]["market_id"] for spec in self.strategies if "market_id" in spec.get("kwargs", {}))
+            self.trading.risk_engine.refresh(self.trading, list(market_ids))
+
+        self._open()
+        try:
+            for worker in range(self.workers):
+                self._start_worker(worker)
+            self._start_feed()
+            last_report = time.time()
+            while True:
+                time.sleep(1)
+                self._supervise()
+                if time.time() > last_report + self.report_interval:
+                    last_report = time.time()
+                    self._report()
+        finally:
+            self._close()
+
+    def _open(self):
+        self._rings = [TickRing(slots=self.ring_slots) for _ in range(self.workers)]
+        self._health = self._context.RawArray('d', (self.workers + 1) * HEALTH_FIELDS)
+        self._connections = {}  # runner end of each worker's pipe -> lock of the replies sent on it
+        self._connections_lock = threading.Lock()
+        self._processes = [None] * (self.workers + 1)
+        self._running = True
+        threading.Thread(target=self._serve_orders, name="runner-requests", daemon=True).start()
+
+    def _close(self):
+        self._running = False
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for ring in self._rings:
+            ring.close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,544 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import csv
+import hashlib
+import threading
+import time
+from trading import MORPHER_ORACLE_ADDRESS, ORDER_CANCELLED, ORDER_CREATED, ORDER_FAILED, ORDER_PROCESSED, ZERO_ADDRESS
+
+PRECISION = 100000000  # prices, spreads and leverage have 8 decimals
+
+
+class TransactionNotFound(Exception):
+    """Raised for receipts of transactions that are not executed yet."""
+
+
+class FillModel(ABC):
+    """
+    Decides at which price the simulated oracle executes orders.
+
+    `quote` returns the current (price, spread) of a market as floats, or None when there is no
+    price yet, in which case orders stay pending.
+    """
+
+    @abstractmethod
+    def quote(self, market_id: str):
+        pass
+
+
+class LastPriceFillModel(FillModel):
+    """Fills at the last price pushed with `update`, e.g. from a live feed."""
+
+    def __init__(self, spread: float = 0):
+        self.spread = spread
+        self.prices = {}
+
+    def update(self, market_id: str, price: float, spread: float = None):
+        self.prices[market_id.lower()] = (price, self.spread if spread is None else spread)
+
+    def quote(self, market_id: str):
+        return self.prices.get(market_id.lower())
+
+
+class RecordedPriceFillModel(FillModel):
+    """
+    Replays prices recorded in a CSV file with the columns timestamp, market_id, price and
+    optionally spread. `advance(timestamp)` or `SimulatedSidechain.replay(timestamp)` moves the
+    replay forward.
+    """
+
+    def __init__(self, path: str, spread: float = 0):
+        self.spread = spread
+        with open(path, newline="") as f:
+            self.rows = sorted(
+                (float(row["timestamp"]), row["market_id"].lower(), float(row["price"]), float(row.get("spread") or spread))
+                for row in csv.DictReader(f)
+            )
+        self.cursor = 0
+        self.prices = {}
+        self.timestamp = self.rows[0][0] if self.rows else 0
+
+    def advance(self, timestamp: float):
+        """
+        Applies all recorded prices up to `timestamp`.
+
+        Returns:
+            list: The market ids whose price changed.
+        """
+        changed = []
+        while self.cursor < len(self.rows) and self.rows[self.cursor][0] <= timestamp:
+            _, market_id, price, spread = self.rows[self.cursor]
+            self.prices[market_id] = (price, spread)
+            changed.append(market_id)
+            self.cursor += 1
+        self.timestamp = timestamp
+        return changed
+
+    def quote(self, market_id: str):
+        return self.prices.get(market_id.lower())
+
+
+def _word(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return value.to_bytes(32, "big")
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value).rjust(32, b"\0")
+    return bytes(value).rjust(32, b"\0")
+
+
+def _hex(value):
+    return "0x" + bytes(value).hex()
+
+
+class _RawTransaction(bytes):
+    # stands in for a signed transaction: the bytes are its hash, the transaction rides along
+    pass
+
+
+class SimulatedSidechain:
+    """
+    In-process stand-in for the Morpher sidechain. It implements the contract functions used by
+    `MorpherTrading` (createOrder, initiateCancelOrder, getOrder, getPosition, balanceOf,
+    getLastUpdated, longShareValue and shortShareValue), so strategies and load tests can trade
+    without any network access:
+
+        chain = SimulatedSidechain(LastPriceFillModel(), initial_balance=1000)
+        trading_engine = MorpherTrading(private_key, backend=chain)
+
+    Orders are executed by a simulated oracle as soon as the fill model has a price that meets
+    their limits, otherwise they wait for `process_orders`. Interest and the oracle's execution
+    delay are not modelled.
+    """
+
+    TransactionNotFound = TransactionNotFound
+
+    def __init__(self, fill_model: FillModel = None, initial_balance: float = 1000):
+        self.fill_model = fill_model or LastPriceFillModel()
+        self.initial_balance = round(initial_balance * 1e18)
+
+        self.block_number = 0
+        self.balances = {}
+        self.positions = {}  # (address, market id) -> position dict
+        self.orders = {}     # order id -> order dict
+        self.nonces = {}
+        self.queued = {}     # address -> {nonce: raw transaction} waiting for a nonce gap to close
+        self.receipts = {}
+        self.logs = []
+
+        self._lock = threading.RLock()
+
+    def connect(self):
+        """Get a web3 lookalike talking to this chain."""
+        return SimulatedWeb3(self)
+
+    def set_balance(self, address: str, mph_token_amount: float):
+        with self._lock:
+            self.balances[address.lower()] = round(mph_token_amount * 1e18)
+
+    def _balance(self, address):
+        return self.balances.setdefault(address, self.initial_balance)
+
+    def _position(self, address, market_id):
+        return self.positions.setdefault((address, market_id), {
+            "longShares": 0,
+            "shortShares": 0,
+            "meanEntryPrice": 0,
+            "meanEntrySpread": 0,
+            "meanEntryLeverage": PRECISION,
+            "liquidationPrice": 0,
+            "lastUpdated": 0,
+        })
+
+    # contract reads
+
+    def call(self, address: str, name: str, args: tuple):
+        with self._lock:
+            if name == "balanceOf":
+                return self._balance(args[0].lower())
+            if name == "getPosition":
+                position = self._position(args[0].lower(), args[1].lower())
+                return (
+                    position["longShares"],
+                    position["shortShares"],
+                    position["meanEntryPrice"],
+                    position["meanEntrySpread"],
+                    position["meanEntryLeverage"],
+                    position["liquidationPrice"],
+                )
+            if name == "getLastUpdated":
+                return self._position(args[0].lower(), args[1].lower())["lastUpdated"]
+            if name == "getOrder":
+                order = self.orders.get(_hex(_word(args[0])))
+                if order is None:
+                    return (ZERO_ADDRESS, b"\0" * 32, 0, 0, 0, 0, 0)
+                return (order["userId"], _word(order["marketId"]), order["closeSharesAmount"], order["openMPHTokenAmount"], 0, 0, order["orderLeverage"])
+            if name == "longShareValue":
+                return self.long_share_value(*args)
+            if name == "shortShareValue":
+                return self.short_share_value(*args)
+        raise Exception(f"Function {name} is not simulated!")
+
+    @staticmethod
+    def long_share_value(average_price, average_leverage, timestamp, price, spread, order_leverage, sell):
+        value = average_price * PRECISION // average_leverage + price - average_price
+        value = value - spread if sell else value + spread
+        return max(value, 0)
+
+    @staticmethod
+    def short_share_value(average_price, average_leverage, timestamp, price, spread, order_leverage, sell):
+        value = average_price * PRECISION // average_leverage + average_price - price
+        value = value - spread if sell else value + spread
+        return max(value, 0)
+
+    # transactions
+
+    def send(self, raw_transaction: _RawTransaction):
+        tx = raw_transaction.tx
+        sender = tx["from"].lower()
+        with self._lock:
+            expected = self.nonces.get(sender, 0)
+            if tx["nonce"] < expected:
+                raise ValueError("nonce too low")
+            self.queued.setdefault(sender, {})[tx["nonce"]] = raw_transaction
+            # execute every transaction whose nonce is now next in line
+            while self.nonces.get(sender, 0) in self.queued[sender]:
+                nonce = self.nonces.get(sender, 0)
+                self._execute(self.queued[sender].pop(nonce))
+                self.nonces[sender] = nonce + 1
+        return bytes(raw_transaction)
+
+    def _new_block(self):
+        self.block_number += 1
+        return self.block_number
+
+    def _emit(self, address, topics, data, tx_hash, block_number):
+        log = {
+            "address": address,
+            "topics": [_word(topic) for topic in topics],
+            "data": b"".join(_word(value) for value in data),
+            "blockNumber": block_number,
+            "transactionHash": tx_hash,
+            "logIndex": len(self.logs),
+        }
+        self.logs.append(log)
+        return log
+
+    def _execute(self, raw_transaction):
+        tx = raw_transaction.tx
+        tx_hash = bytes(raw_transaction)
+        block_number = self._new_block()
+        sender = tx["from"].lower()
+        logs = []
+        status = 1
+        if tx["to"] == MORPHER_ORACLE_ADDRESS and tx["function"] == "createOrder":
+            order_id = _hex(hashlib.sha256(tx_hash + b"order").digest())
+            market_id, close_shares, open_mph, direction, leverage, above, below, good_until, good_from = tx["args"]
+            order = {
+                "orderId": order_id,
+                "userId": tx["from"],
+                "marketId": market_id.lower(),
+                "closeSharesAmount": close_shares,
+                "openMPHTokenAmount": open_mph,
+                "tradeDirection": direction,
+                "orderLeverage": leverage,
+                "onlyIfPriceAbove": above,
+                "onlyIfPriceBelow": below,
+                "goodUntil": good_until,
+                "goodFrom": good_from,
+            }
+            self.orders[order_id] = order
+            logs.append(self._emit(
+                MORPHER_ORACLE_ADDRESS,
+                [ORDER_CREATED, order_id, tx["from"], market_id],
+                [close_shares, open_mph, direction, leverage, below, above, good_from, good_until],
+                tx_hash,
+                block_number
+            ))
+        elif tx["to"] == MORPHER_ORACLE_ADDRESS and tx["function"] == "initiateCancelOrder":
+            order = self.orders.get(_hex(_word(tx["args"][0])))
+            if order is None or order["userId"].lower() != sender:
+                status = 0
+            else:
+                del self.orders[order["orderId"]]
+                logs.append(self._emit(MORPHER_ORACLE_ADDRESS, [ORDER_CANCELLED, order["orderId"], tx["from"], MORPHER_ORACLE_ADDRESS], [], tx_hash, block_number))
+        else:
+            status = 0
+
+        self.receipts[tx_hash] = {
+            "transactionHash": tx_hash,
+            "blockNumber": block_number,
+            "status": status,
+            "logs": logs,
+        }
+        if status == 1 and tx["function"] == "createOrder":
+            self.process_orders(market_id)
+
+    def process_orders(self, market_id: str = None, now: float = None):
+        """
+        Lets the simulated oracle execute or expire the pending orders, of one market or all. `now`
+        defaults to the replayed time of a `RecordedPriceFillModel`, to the wall clock otherwise.
+
+        Returns:
+            int: Number of orders that were executed, failed or expired.
+        """
+        if now is None:
+            now = self.fill_model.timestamp if isinstance(self.fill_model, RecordedPriceFillModel) else time.time()
+        processed = 0
+        with self._lock:
+            for order in list(self.orders.values()):
+                if market_id is not None and order["marketId"] != market_id.lower():
+                    continue
+                if order["goodUntil"] and order["goodUntil"] < now:
+                    del self.orders[order["orderId"]]
+                    self._emit(MORPHER_ORACLE_ADDRESS, [ORDER_CANCELLED, order["orderId"], MORPHER_ORACLE_ADDRESS, MORPHER_ORACLE_ADDRESS], [], b"", self._new_block())
+                    processed += 1
+                    continue
+                if order["goodFrom"] and order["goodFrom"] > now:
+                    continue
+                quote = self.fill_model.quote(order["marketId"])
+                if quote is None:
+                    continue
+                price, spread = round(quote[0] * PRECISION), round(quote[1] * PRECISION)
+                if order["onlyIfPriceAbove"] and price < order["onlyIfPriceAbove"]:
+                    continue
+                if order["onlyIfPriceBelow"] and price > order["onlyIfPriceBelow"]:
+                    continue
+                del self.orders[order["orderId"]]
+                self._fill(order, price, spread, now)
+                processed += 1
+        return processed
+
+    def _fill(self, order, price, spread, now):
+        address = order["userId"].lower()
+        position = self._position(address, order["marketId"])
+        timestamp = round(now * 1000)
+        block_number = self._new_block()
+        mint = burn = 0
+
+        long_position = position["longShares"] > 0
+        short_position = position["shortShares"] > 0
+        if order["openMPHTokenAmount"] > 0:
+            opposite = short_position if order["tradeDirection"] else long_position
+            if opposite or order["openMPHTokenAmount"] > self._balance(address):
+                self._emit_failed(order, block_number)
+                return
+            leverage = order["orderLeverage"]
+            share_value = price * PRECISION // leverage + spread
+            shares = order["openMPHTokenAmount"] // share_value
+            key = "longShares" if order["tradeDirection"] else "shortShares"
+            old_shares = position[key]
+            total = old_shares + shares
+            position["meanEntryPrice"] = (position["meanEntryPrice"] * old_shares + price * shares) // total
+            position["meanEntrySpread"] = (position["meanEntrySpread"] * old_shares + spread * shares) // total
+            position["meanEntryLeverage"] = (position["meanEntryLeverage"] * old_shares + leverage * shares) // total
+            position[key] = total
+            burn = shares * share_value
+            self.balances[address] -= burn
+        else:
+            key = "longShares" if long_position else "shortShares"
+            shares = min(order["closeSharesAmount"], position[key])
+            if shares == 0:
+                self._emit_failed(order, block_number)
+                return
+            share_value = (self.long_share_value if long_position else self.short_share_value)(
+                position["meanEntryPrice"], position["meanEntryLeverage"], position["lastUpdated"], price, spread, PRECISION, True
+            )
+            mint = shares * share_value
+            self.balances[address] = self._balance(address) + mint
+            position[key] -= shares
+            if position[key] == 0:
+                position.update({"meanEntryPrice": 0, "meanEntrySpread": 0, "meanEntryLeverage": PRECISION})
+
+        if position["longShares"] > 0:
+            position["liquidationPrice"] = position["meanEntryPrice"] - position["meanEntryPrice"] * PRECISION // position["meanEntryLeverage"]
+        elif position["shortShares"] > 0:
+            position["liquidationPrice"] = position["meanEntryPrice"] + position["meanEntryPrice"] * PRECISION // position["meanEntryLeverage"]
+        else:
+            position["liquidationPrice"] = 0
+        position["lastUpdated"] = timestamp
+
+        self._emit(MORPHER_ORACLE_ADDRESS, [ORDER_PROCESSED, order["orderId"]], [
+            price, price, spread, 0, timestamp,
+            position["longShares"], position["shortShares"], position["meanEntryPrice"],
+            position["meanEntrySpread"], position["meanEntryLeverage"], position["liquidationPrice"]
+        ], b"", block_number)
+
+    def _emit_failed(self, order, block_number):
+        self._emit(MORPHER_ORACLE_ADDRESS, [ORDER_FAILED, order["orderId"], order["userId"], order["marketId"]], [
+            order["closeSharesAmount"], order["openMPHTokenAmount"], order["tradeDirection"], order["orderLeverage"],
+            order["onlyIfPriceBelow"], order["onlyIfPriceAbove"], order["goodFrom"], order["goodUntil"]
+        ], b"", block_number)
+
+    def on_price(self, market_id: str, price: float, spread: float = None):
+        """Pushes a price into a `LastPriceFillModel` and processes the pending orders of the market."""
+        if not isinstance(self.fill_model, LastPriceFillModel):
+            raise TypeError(f"on_price needs a LastPriceFillModel, not {type(self.fill_model).__name__}, use replay to advance recorded prices")
+        self.fill_model.update(market_id, price, spread)
+        return self.process_orders(market_id)
+
+    def replay(self, timestamp: float):
+        """
+        Advances a `RecordedPriceFillModel` to `timestamp` and processes the pending orders of the
+        markets whose price changed, at the recorded time.
+
+        Returns:
+            int: Number of orders that were executed, failed or expired.
+        """
+        if not isinstance(self.fill_model, RecordedPriceFillModel):
+            raise TypeError(f"replay needs a RecordedPriceFillModel, not {type(self.fill_model).__name__}")
+        return sum(self.process_orders(market_id, now=timestamp) for market_id in set(self.fill_model.advance(timestamp)))
+
+    def get_logs(self, filter_params: dict):
+        from_block = filter_params.get("fromBlock", 0)
+        to_block = filter_params.get("toBlock", "latest")
+        address = filter_params.get("address")
+        topics = filter_params.get("topics", [])
+        with self._lock:
+            to_block = self.block_number if to_block == "latest" else to_block
+            result = []
+            for log in self.logs:
+                if not from_block <= log["blockNumber"] <= to_block:
+                    continue
+                if address is not None and log["address"].lower() != address.lower():
+                    continue
+                if all(self._topic_matches(log, i, topic) for i, topic in enumerate(topics)):
+                    result.append(log)
+            return result
+
+    @staticmethod
+    def _topic_matches(log, index, expected):
+        if expected is None:
+            return True
+        if index >= len(log["topics"]):
+            return False
+        options = expected if isinstance(expected, (list, tuple)) else [expected]
+        return _hex(log["topics"][index]).lower() in (option.lower() for option in options)
+
+
+class _SimulatedFunction:
+
+    def __init__(self, chain, address, name, args):
+        self.chain = chain
+        self.address = address
+        self.name = name
+        self.args = args
+
+    def call(self):
+        return self.chain.call(self.address, self.name, self.args)
+
+    def build_transaction(self, params: dict):
+        return {**params, "to": self.address, "function": self.name, "args": self.args}
+
+
+class _SimulatedFunctions:
+
+    def __init__(self, chain, address):
+        self._chain = chain
+        self._address = address
+
+    def __getattr__(self, name):
+        return lambda *args: _SimulatedFunction(self._chain, self._address, name, args)
+
+
+class _SimulatedContract:
+
+    def __init__(self, chain, address):
+        self.address = address
+        self.functions = _SimulatedFunctions(chain, address)
+
+
+class _SimulatedAccount:
+
+    def __init__(self, address):
+        self.address = address
+
+
+class _SimulatedSignedTransaction:
+
+    def __init__(self, raw_transaction):
+        self.raw_transaction = raw_transaction
+
+
+class _SimulatedAccounts:
+
+    @staticmethod
+    def from_key(private_key: str):
+        # not the real key derivation, but stable and unique per key
+        return _SimulatedAccount("0x" + hashlib.sha256(("account" + private_key).encode()).digest()[:20].hex())
+
+    def sign_transaction(self, tx: dict, private_key: str):
+        raw = _RawTransaction(hashlib.sha256(repr(sorted(tx.items())).encode() + private_key.encode()).digest())
+        raw.tx = {**tx, "from": self.from_key(private_key).address}
+        return _SimulatedSignedTransaction(raw)
+
+
+class _SimulatedBatch:
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, item):
+        self._items.append(item)
+
+    def execute(self):
+        return [item.call() if isinstance(item, _SimulatedFunction) else item for item in self._items]
+
+
+class _SimulatedEth:
+
+    def __init__(self, chain):
+        self._chain = chain
+        self.account = _SimulatedAccounts()
+
+    def contract(self, address: str, abi: list = None):
+        return _SimulatedContract(self._chain, address)
+
+    def get_transaction_count(self, address: str, block_identifier: str = "latest"):
+        with self._chain._lock:
+            return self._chain.nonces.get(address.lower(), 0)
+
+    def send_raw_transaction(self, raw_transaction):
+        return self._chain.send(raw_transaction)
+
+    def get_transaction_receipt(self, tx_hash):
+        tx_hash = bytes.fromhex(tx_hash[2:]) if isinstance(tx_hash, str) else bytes(tx_hash)
+        receipt = self._chain.receipts.get(tx_hash)
+        if receipt is None:
+            raise TransactionNotFound(f"Transaction {_hex(tx_hash)} not found")
+        return receipt
+
+    def get_logs(self, filter_params: dict):
+        return self._chain.get_logs(filter_params)
+
+    @property
+    def block_number(self):
+        return self._chain.block_number
+
+    @property
+    def chain_id(self):
+        return 21  # the Morpher sidechain
+
+
+class SimulatedWeb3:
+    """The subset of the `Web3` interface used by `MorpherTrading`, backed by a `SimulatedSidechain`."""
+
+    def __init__(self, chain: SimulatedSidechain):
+        self.eth = _SimulatedEth(chain)
+
+    @staticmethod
+    def to_hex(value):
+        return _hex(value)
+
+    @staticmethod
+    def to_checksum_address(address: str):
+        return address
+
+    @staticmethod
+    def keccak(value):
+        return hashlib.sha256(bytes(value)).digest()
+
+    @contextmanager
+    def batch_requests(self):
+        yield _SimulatedBatch()
@@ -1,6 +1,9 @@
-import requests
-from eth_hash.auto import keccak
+from config import market_id_from_ticker
 from datetime import datetime, timedelta
+from errors import ExchangeError, MorpherError, ORDER_UNCONFIRMED
+from eventlog import configure_logging, correlate, event, get_logger, new_tick_id
+import logging
+import threading
 import time
 from trading import MorpherTrading
 
@@ -11,24 +14,51 @@ class WeightedMarketRebalancingStrategy:
             self,
             trading_engine: MorpherTrading,
             weighted_markets: dict,
-            rebalance_percentage: float
+            rebalance_percentage: float,
+            drift_band: float = None,
+            min_trade_mph: float = 0,
+            resync_interval: float = 300,
+            reconcile_delay: float = 60
         ):
         self.trading = trading_engine
         self.weighted_markets = weighted_markets  # e.g., {"BTC": 0.3, "ETH": 0.3, "DOGE": 0.4}
         self.rebalance_percentage = rebalance_percentage  # e.g., 0.5 (50% of total balance)
 
         self.last_rebalance_time = None
+        self.log = get_logger("rebalancing")
+
+        # continuous mode: trade a market only once its value drifts more than drift_band
+        # (e.g. 0.05 = 5%) away from its target, instead of rebalancing everything once a day
+        self.drift_band = drift_band
+        self.min_trade_mph = min_trade_mph  # smaller adjustments are left to net out with later price moves
+        self.resync_interval = resync_interval  # seconds between reading the real positions from the chain
+        # markets with an order of unknown outcome -> time it was sent, not traded until a sync at least
+        # reconcile_delay seconds later read their position back
+        self.unconfirmed = {}
+        self.reconcile_delay = reconcile_delay
+        self.sync_retry_at = 0  # after a failed sync the chain is called again at most every 10 seconds
+
+        self.prices = {}            # ticker -> last streamed price
+        self.cash = None            # MPH balance, None until the first sync
+        self.values = {}            # ticker -> estimated position value in MPH
+        self.reference_prices = {}  # ticker -> price at which values[ticker] was estimated
+        self.invested = 0
+        self.last_sync = 0
+        self._state_lock = threading.Lock()
+        self._rebalance_lock = threading.Lock()
 
     def _fetch_market_price(self, market):
-        """Fetch the latest price for a given market using Binance REST API."""
-        url = f"https://api.binance.com/api/v3/ticker/price?symbol={market}USDT"
+        """Get the latest price for a given market from the price store, or else the Binance REST API."""
+        price_store = getattr(self.trading, "price_store", None)
+        if price_store is not None and not price_store.is_stale(self._get_market_id(market)):
+            return price_store.get(self._get_market_id(market))[0]
+
+        from feeds import fetch_price
+
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            return float(data['price'])
-        except requests.RequestException as e:
-            print(f"Error fetching price for {market}: {e}")
+            return fetch_price(f"{market}USDT")
+        except ExchangeError as e:
+            event(self.log, logging.WARNING, "price_fetch_failed", market=market, error=str(e))
             return None
 
     def _calculate_target_allocation(self, balance):
@@ -46,9 +76,10 @@ class WeightedMarketRebalancingStrategy:
             current_position = self.trading.getPositionValue(self._get_market_id(market), prices[market])
             current_positions[market] = current_position
             total_balance += current_position
-        print(f"Total balance: {total_balance:.2f} MPH.")
-        print(f"Current invested: {(total_balance - balance):.2f} MPH, current cash: {balance:.2f}.")
-        print(f"New invested: {(total_balance * self.rebalance_percentage):.2f} MPH, new cash: {(total_balance * (1 - self.rebalance_percentage)):.2f}.")
+        event(
+            self.log, logging.INFO, "portfolio", totalBalance=total_balance, invested=total_balance - balance, cash=balance,
+            targetInvested=total_balance * self.rebalance_percentage, targetCash=total_balance * (1 - self.rebalance_percentage)
+        )
 
         target_allocation = self._calculate_target_allocation(total_balance)
 
@@ -56,53 +87,208 @@ class WeightedMarketRebalancingStrategy:
             current_position = current_positions[market]
             difference = target_amount - current_position
 
-            if difference > 0: # Need to increase position
+            try:
+                if difference > 0: # Need to increase position
+                    self.trading.openPosition(
+                        market_id=self._get_market_id(market),
+                        mph_token_amount=difference,
+                        direction=True, # Long positions for allocation
+                        leverage=1,
+                    )
+                    event(self.log, logging.INFO, "position_increased", market=market, amount=difference)
+                    time.sleep(5)
+                elif difference < 0: # Need to decrease position
+                    self.trading.closePosition(
+                        market_id=self._get_market_id(market),
+                        percentage=abs(difference) / current_position,
+                    )
+                    event(self.log, logging.INFO, "position_decreased", market=market, amount=abs(difference))
+                    time.sleep(5)
+            except ORDER_UNCONFIRMED as e:
+                # may still be mined, the next rebalance reads the position back from the chain
+                event(self.log, logging.ERROR, "order_unconfirmed", market=market, error=str(e), errorType=type(e).__name__)
+            except MorpherError as e:
+                event(self.log, logging.WARNING, "market_skipped", market=market, error=str(e), errorType=type(e).__name__)
+
+        event(self.log, logging.INFO, "rebalanced", targetAllocation=target_allocation)
+
+    def on_market_price(self, market, price):
+        """
+        Continuous mode: takes a streamed price of one market (ticker, e.g. BTC), updates the
+        portfolio weights and trades the markets that drifted out of their band.
+        """
+        with self._state_lock:
+            self.prices[market] = price
+            if market in self.values:
+                # a leverage 1 long position moves with the price, the estimate is corrected on every sync
+                value = self.values[market] * price / self.reference_prices[market]
+                self.invested += value - self.values[market]
+                self.values[market] = value
+                self.reference_prices[market] = price
+            if len(self.prices) < len(self.weighted_markets):
+                return
+
+        # ticks arriving while orders are sent only update the weights
+        if not self._rebalance_lock.acquire(blocking=False):
+            return
+        try:
+            if self._sync_due():
+                if time.time() < self.sync_retry_at:
+                    return  # the last sync failed, don't trade on the old estimates
+                try:
+                    self._sync()
+                except MorpherError as e:
+                    event(self.log, logging.WARNING, "sync_failed", error=str(e), errorType=type(e).__name__)
+                    self.sync_retry_at = time.time() + 10
+                    return
+            self._rebalance_drifted()
+        finally:
+            self._rebalance_lock.release()
+
+    def _sync_due(self):
+        now = time.time()
+        return now > self.last_sync + self.resync_interval or any(
+            sent + self.reconcile_delay < now for sent in self.unconfirmed.values()
+        )
+
+    def _sync(self):
+        """Reads the balance and the position values from the chain at the last streamed prices."""
+        started = time.time()
+        balance = self.trading.getBalance()
+        if self.trading.risk_engine is not None:
+            self.trading.risk_engine.refresh(
+                self.trading,
+                [self._get_market_id(market) for market in self.weighted_markets.keys()]
+            )
+        with self._state_lock:
+            prices = dict(self.prices)
+        values = {
+            market: self.trading.getPositionValue(self._get_market_id(market), prices[market])
+            for market in self.weighted_markets.keys()
+        }
+        with self._state_lock:
+            self.cash = balance
+            for market, value in values.items():
+                # prices that streamed in during the reads
+                self.values[market] = value * self.prices[market] / prices[market]
+                self.reference_prices[market] = self.prices[market]
+            self.invested = sum(self.values.values())
+            self.last_sync = time.time()
+            # orders sent long enough before the reads are in the values now
+            self.unconfirmed = {
+                market: sent for market, sent in self.unconfirmed.items() if sent + self.reconcile_delay >= started
+            }
+
+    def _drift(self):
+        """
+        Get the adjustment in MPH every market needs to reach its target, for the markets outside
+        their drift band only.
+        """
+        with self._state_lock:
+            total_balance = self.cash + self.invested
+            target_allocation = self._calculate_target_allocation(total_balance)
+            adjustments = {}
+            for market, target_amount in target_allocation.items():
+                if market in self.unconfirmed:
+                    continue
+                difference = target_amount - self.values[market]
+                if abs(difference) > self.drift_band * target_amount and abs(difference) >= self.min_trade_mph:
+                    adjustments[market] = difference
+            return adjustments
+
+    def _rebalance_drifted(self):
+        adjustments = self._drift()
+        if len(adjustments) == 0:
+            return
+
+        # decrease first, so the freed MPH can fund the increases
+        for market, difference in sorted(adjustments.items(), key=lambda item: item[1]):
+            with correlate(tick=new_tick_id(), marketId=self._get_market_id(market)):
+                self._adjust(market, difference)
+
+    def _adjust(self, market, difference):
+        """Trades a drifted market back to its target, `difference` is the adjustment in MPH."""
+        try:
+            if difference < 0:
+                percentage = min(1, abs(difference) / self.values[market])
+                self.trading.closePosition(market_id=self._get_market_id(market), percentage=percentage)
+                with self._state_lock:
+                    self.values[market] -= abs(difference)
+                    self.invested -= abs(difference)
+                    self.cash += abs(difference)
+                event(self.log, logging.INFO, "position_decreased", market=market, amount=abs(difference), reason="drift")
+            else:
+                difference = min(difference, self.cash)
+                if difference < max(self.min_trade_mph, 1e-9):
+                    return
                 self.trading.openPosition(
                     market_id=self._get_market_id(market),
                     mph_token_amount=difference,
-                    direction=True, # Long positions for allocation
+                    direction=True,
                     leverage=1,
                 )
-                print(f"[{datetime.now()}] Increased position in {market} by {difference:.2f} MPH.")
-                time.sleep(5)
-            elif difference < 0: # Need to decrease position
-                self.trading.closePosition(
-                    market_id=self._get_market_id(market),
-                    percentage=abs(difference) / current_position,
-                )
-                print(f"[{datetime.now()}] Decreased position in {market} by {abs(difference):.2f} MPH.")
-                time.sleep(5)
-
-        print(f"[{datetime.now()}] Rebalancing complete. Target allocation: {target_allocation}")
+                with self._state_lock:
+                    self.values[market] += difference
+                    self.invested += difference
+                    self.cash -= difference
+                event(self.log, logging.INFO, "position_increased", market=market, amount=difference, reason="drift")
+        except ORDER_UNCONFIRMED as e:
+            # the estimate can't tell whether it was traded, trading the same drift again could double it
+            event(self.log, logging.ERROR, "order_unconfirmed", market=market, error=str(e), errorType=type(e).__name__)
+            with self._state_lock:
+                self.unconfirmed[market] = time.time()
+        except MorpherError as e:
+            event(self.log, logging.WARNING, "market_skipped", market=market, error=str(e), errorType=type(e).__name__)
 
     @staticmethod
     def _get_market_id(market):
         """Get the morpher market id from the ticker"""
-        string = "CRYPTO_" + market
-        input_bytes = string.encode('utf-8')
-        return '0x' + keccak(input_bytes).hex()
+        return market_id_from_ticker(market)
 
     def start_trading(self):
-        print("Launching weighted market rebalancing bot...")
-        
+        configure_logging()
+        event(self.log, logging.INFO, "launching", markets=list(self.weighted_markets), continuous=self.drift_band is not None)
+
+        if self.drift_band is not None:
+            from feeds import BinanceTradeFeed
+
+            symbols = {market.lower() + "usdt": market for market in self.weighted_markets.keys()}
+            feed = BinanceTradeFeed(list(symbols))
+            feed.add_listener(lambda symbol, price, timestamp: self.on_market_price(symbols[symbol], price))
+            event(self.log, logging.INFO, "websocket_starting", symbols=list(symbols))
+            feed.run_forever()
+            return
+
         while True:
             now = datetime.now()
 
             if self.last_rebalance_time is None or now > self.last_rebalance_time + timedelta(days=1):
-                print(f"[{now}] Rebalancing positions...")
-                balance = self.trading.getBalance()
-                print(f"[{now}] Current balance: {balance:.2f} MPH")
-
-                prices = {}
-                for market in self.weighted_markets.keys():
-                    price = self._fetch_market_price(market)
-                    if price is not None:
-                        print(f"[{now}] {market} price: {price:.2f} USDT")
-                        prices[market] = price
-                    else:
-                        raise Exception("Cannot rebalance without price!")
-
-                self._rebalance_positions(balance, prices)
-                self.last_rebalance_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                try:
+                    self._daily_rebalance()
+                    self.last_rebalance_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                except MorpherError as e:
+                    # nothing was traded yet, the whole rebalance is tried again on the next wake-up
+                    event(self.log, logging.ERROR, "rebalance_failed", error=str(e), errorType=type(e).__name__)
 
             time.sleep(300)
+
+    def _daily_rebalance(self):
+        event(self.log, logging.INFO, "rebalancing")
+        balance = self.trading.getBalance()
+        event(self.log, logging.INFO, "balance", balance=balance)
+        if self.trading.risk_engine is not None:
+            self.trading.risk_engine.refresh(
+                self.trading,
+                [self._get_market_id(market) for market in self.weighted_markets.keys()]
+            )
+
+        prices = {}
+        for market in self.weighted_markets.keys():
+            price = self._fetch_market_price(market)
+            if price is not None:
+                event(self.log, logging.INFO, "price", market=market, price=price)
+                prices[market] = price
+            else:
+                raise MorpherError(f"Cannot rebalance without the price of {market}!")
+
+        self._rebalance_positions(balance, prices)
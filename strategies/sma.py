@@ -1,9 +1,10 @@
 import json
-import websocket
-import numpy as np
 from collections import deque
 from datetime import datetime
+import logging
 import time
+from errors import MorpherError, ORDER_UNCONFIRMED
+from eventlog import configure_logging, correlate, event, get_logger, new_tick_id, Sampler
 from trading import MorpherTrading
 
 # simple scalping strategy: open when price is outside the band and close when it crosses the band on the other side
@@ -18,10 +19,13 @@ class SimpleMovingAverageStrategy:
             leverage: float,
             trading_size: float,
             sma_period: int,
-            trigger_threshold: float
+            trigger_threshold: float,
+            symbol: str = "btcusdt",
+            reconcile_delay: float = 60
         ):
         self.trading = trading_engine
         self.market_id = market_id
+        self.symbol = symbol.lower()  # Binance symbol of the price feed
         self.leverage = leverage
         self.mph_tokens = trading_size
         self.moving_average_period = sma_period
@@ -31,14 +35,31 @@ class SimpleMovingAverageStrategy:
         self.current_minute = None
         self.last_price = None
 
-        self.last_print = time.time()
+        self.log = get_logger(f"sma.{self.symbol}")
+        self.status_sampler = Sampler(5)  # per-tick status at most every 5 seconds
 
         self.current_position = None
         self.executing = False
+        # (expected position, position before, time) of an order that may or may not be on chain
+        self.unconfirmed = None
+        self.reconcile_delay = reconcile_delay  # seconds before its outcome is read back from the chain
+
+    def load_position(self):
+        """
+        Reads the position of the market back from the chain, e.g. when the strategy is restarted
+        while a position is open. Its stop loss and take profit are set from the next moving average.
+        """
+        position = self.trading.getPosition(self.market_id)
+        is_long = position["longShares"] > 0
+        if is_long or position["shortShares"] > 0:
+            self.current_position = {"is_long": is_long, "stop_loss": None, "take_profit": None}
+        else:
+            self.current_position = None
+        event(self.log, logging.INFO, "position_loaded", position=position)
 
     @staticmethod
     def _calculate_moving_average(prices):
-        return np.mean(prices)
+        return sum(prices) / len(prices)
 
     def _process_price(self, price):
 
@@ -52,123 +73,208 @@ class SimpleMovingAverageStrategy:
         if current_min > self.current_minute:
             if self.last_price is not None:
                 self.minute_prices.append(self.last_price)
-                print(f"[{datetime.now()}] Minute closed: {self.current_minute}, Price: {self.last_price}")
+                event(self.log, logging.INFO, "minute_closed", minute=self.current_minute.isoformat(), price=self.last_price)
             self.current_minute = current_min
         self.last_price = price
 
     def _open_long_position(self, price, ma):
-        order_id = self.trading.openPosition(
-            market_id=self.market_id,
-            mph_token_amount=self.mph_tokens,
-            direction=True, # True for long, False for short
-            leverage=self.leverage,
-        )
-        print(f"[{datetime.now()}] Opened long position at price {price} (MA: {ma}). Order ID: {order_id}")
+        try:
+            order_id = self.trading.openPosition(
+                market_id=self.market_id,
+                mph_token_amount=self.mph_tokens,
+                direction=True, # True for long, False for short
+                leverage=self.leverage,
+            )
+        except ORDER_UNCONFIRMED:
+            raise
+        except MorpherError as e:
+            # not sent: rejected by the risk engine, no position or the RPC failed before sending
+            event(self.log, logging.WARNING, "order_rejected", error=str(e), errorType=type(e).__name__)
+            return None
+        event(self.log, logging.INFO, "position_opened", direction="long", price=price, movingAverage=ma, orderId=order_id)
+        return order_id
 
     def _open_short_position(self, price, ma):
-        order_id = self.trading.openPosition(
-            market_id=self.market_id,
-            mph_token_amount=self.mph_tokens,
-            direction=False,
-            leverage=self.leverage,
-        )
-        print(f"[{datetime.now()}] Opened short position at price {price} (MA: {ma}). Order ID: {order_id}")
+        try:
+            order_id = self.trading.openPosition(
+                market_id=self.market_id,
+                mph_token_amount=self.mph_tokens,
+                direction=False,
+                leverage=self.leverage,
+            )
+        except ORDER_UNCONFIRMED:
+            raise
+        except MorpherError as e:
+            event(self.log, logging.WARNING, "order_rejected", error=str(e), errorType=type(e).__name__)
+            return None
+        event(self.log, logging.INFO, "position_opened", direction="short", price=price, movingAverage=ma, orderId=order_id)
+        return order_id
 
     def _close_position(self, price, ma):
-        order_id = self.trading.closePosition(
-            market_id=self.market_id,
-            percentage=1, # fully close the position for this strategy
-        )
-        print(f"[{datetime.now()}] Closed position at price {price} (MA: {ma}). Order ID: {order_id}")
+        try:
+            order_id = self.trading.closePosition(
+                market_id=self.market_id,
+                percentage=1, # fully close the position for this strategy
+            )
+        except ORDER_UNCONFIRMED:
+            raise
+        except MorpherError as e:
+            event(self.log, logging.WARNING, "order_rejected", error=str(e), errorType=type(e).__name__)
+            return None
+        event(self.log, logging.INFO, "position_closed", price=price, movingAverage=ma, orderId=order_id)
+        return order_id
 
     def _on_message(self, ws, message):
         data = json.loads(message)
-        price = float(data['p'])
+        self.on_price(float(data['p']))
 
+    def on_price(self, price):
         self._process_price(price)
 
         moving_average = self._calculate_moving_average(self.minute_prices) if len(self.minute_prices) == self.moving_average_period else 0
         lower_threshold = moving_average * (1 - self.threshold_percentage / 100)
         upper_threshold = moving_average * (1 + self.threshold_percentage / 100)
 
-        if time.time() > self.last_print + 5:
-            self.last_print = time.time()
-            if len(self.minute_prices) < self.moving_average_period:
-                print(f"[{datetime.now()}] Collecting minute prices... ({len(self.minute_prices)}/{self.moving_average_period})")
-            elif self.executing:
-                print("Closing position...")
-            elif self.current_position is not None:
-                sl = self.current_position["stop_loss"]
-                tp = self.current_position["take_profit"]
-                pv = self.trading.getPositionValue(self.market_id, price)
-                print(f"[{datetime.now()}] Price: {price}, Position value: {pv:.2f}, SL: {sl:.2f}, TP: {tp:.2f}")
-            else:
-                print(f"[{datetime.now()}] Price: {price}, MA: {moving_average:.2f}, Lower: {lower_threshold:.2f}, Upper: {upper_threshold:.2f}")
+        if self.log.isEnabledFor(logging.INFO) and self.status_sampler.ready():
+            self._log_status(price, moving_average, lower_threshold, upper_threshold)
 
         # wait until we have the correct number of minutely prices
         if len(self.minute_prices) < self.moving_average_period:
             return
 
+        # an order of unknown outcome, read the position back before trading again
+        if self.unconfirmed is not None:
+            self._reconcile()
+            return
+
         # wait until order is confirmed
         if self.executing:
             return
 
         # triggers
+        if self.current_position is not None and self.current_position["stop_loss"] is None:
+            # loaded from the chain, the exits are set as if it had been opened now
+            if self.current_position["is_long"]:
+                self.current_position["stop_loss"] = moving_average * (1 - 2 * self.threshold_percentage / 100)
+                self.current_position["take_profit"] = upper_threshold
+            else:
+                self.current_position["stop_loss"] = moving_average * (1 + 2 * self.threshold_percentage / 100)
+                self.current_position["take_profit"] = lower_threshold
         if self.current_position is not None:
             # check stop loss / take profit (you can execute istant closePositions as stop loss and take
             # profit or you can closePosition by specifying only_if_price_below and only_if_price_above)
             if self.current_position["is_long"]:
                 if price < self.current_position["stop_loss"] or price > self.current_position["take_profit"]:
-                    self.executing = True
-                    self._close_position(price, moving_average)
-                    time.sleep(10) # wait a bit after closing a position before opening a new one
-                    self.current_position = None
-                    self.executing = False
+                    self._execute(self._close_position, price, moving_average, None)
             else:
                 if price > self.current_position["stop_loss"] or price < self.current_position["take_profit"]:
-                    self.executing = True
-                    self._close_position(price, moving_average)
-                    time.sleep(10)
-                    self.current_position = None
-                    self.executing = False
+                    self._execute(self._close_position, price, moving_average, None)
 
         else:
             if price < lower_threshold:
-                self.executing = True
-                self._open_long_position(price, moving_average)
-                time.sleep(10)
-                self.current_position = {
+                self._execute(self._open_long_position, price, moving_average, {
                     "is_long": True,
                     "stop_loss": moving_average * (1 - 2 * self.threshold_percentage / 100),
                     "take_profit": upper_threshold
-                }
-                self.executing = False
+                })
             elif price > upper_threshold:
-                self.executing = True
-                self._open_short_position(price, moving_average)
-                time.sleep(10)
-                self.current_position = {
+                self._execute(self._open_short_position, price, moving_average, {
                     "is_long": False,
                     "stop_loss": moving_average * (1 + 2 * self.threshold_percentage / 100),
-                    "take_profit": lower_threshold 
-                }
+                    "take_profit": lower_threshold
+                })
+
+    def _execute(self, order, price, ma, position):
+        # sends the order and moves to `position` (None after a close) once it's on chain
+        self.executing = True
+        try:
+            order_id = self._trade(order, price, ma)
+        except ORDER_UNCONFIRMED as e:
+            # the order may still be mined, sending it again could double the position:
+            # stay executing until the position is read back
+            event(self.log, logging.ERROR, "order_unconfirmed", error=str(e), errorType=type(e).__name__)
+            self.unconfirmed = (position, self.current_position, time.time())
+            return
+        except Exception:
+            self.executing = False  # an unexpected error must not leave the strategy stuck executing
+            raise
+        if order_id is not None:
+            time.sleep(10) # wait a bit after closing a position before opening a new one
+            self.current_position = position
+        self.executing = False
+
+    def _reconcile(self):
+        expected, before, since = self.unconfirmed
+        if time.time() - since < self.reconcile_delay:
+            return
+        try:
+            position = self.trading.getPosition(self.market_id)
+        except MorpherError as e:
+            event(self.log, logging.WARNING, "reconcile_failed", error=str(e), errorType=type(e).__name__)
+            self.unconfirmed = (expected, before, time.time())
+            return
+        is_long = position["longShares"] > 0
+        is_open = is_long or position["shortShares"] > 0
+        mixed = is_long and position["shortShares"] > 0
+        for candidate in (expected, before) if not mixed else ():
+            if (candidate is None and not is_open) or (candidate is not None and is_open and candidate["is_long"] == is_long):
+                event(self.log, logging.INFO, "reconciled", executed=candidate is expected, position=position)
+                self.current_position = candidate
+                self.unconfirmed = None
                 self.executing = False
-    
+                return
+        # a mixed position or one this strategy didn't open, don't trade until it's sorted out
+        event(self.log, logging.ERROR, "position_mismatch", position=position)
+        self.unconfirmed = (expected, before, time.time())
+
+    def _trade(self, order, price, ma):
+        # the tick id ties the signal to the order and transaction events of the trading client
+        with correlate(tick=new_tick_id(), marketId=self.market_id):
+            event(self.log, logging.INFO, "signal", price=price, movingAverage=ma, action=order.__name__.strip("_"))
+            return order(price, ma)
+
+    def _log_status(self, price, moving_average, lower_threshold, upper_threshold):
+        skipped = self.status_sampler.take_skipped()
+        if len(self.minute_prices) < self.moving_average_period:
+            event(self.log, logging.INFO, "collecting_prices", minutes=len(self.minute_prices), period=self.moving_average_period, skipped=skipped)
+        elif self.executing:
+            event(self.log, logging.INFO, "executing", price=price, skipped=skipped)
+        elif self.current_position is not None:
+            try:
+                position_value = self.trading.getPositionValue(self.market_id, price)
+            except MorpherError as e:
+                position_value = None
+                event(self.log, logging.WARNING, "position_value_failed", error=str(e))
+            event(
+                self.log, logging.INFO, "status", price=price, positionValue=position_value,
+                stopLoss=self.current_position["stop_loss"], takeProfit=self.current_position["take_profit"], skipped=skipped
+            )
+        else:
+            event(
+                self.log, logging.INFO, "status", price=price, movingAverage=moving_average,
+                lower=lower_threshold, upper=upper_threshold, skipped=skipped
+            )
+
     def _on_error(self, ws, error):
-        print(f"WebSocket error: {error}")
+        event(self.log, logging.WARNING, "websocket_error", error=str(error))
 
     def _on_close(self, ws, close_status_code, close_msg):
-        print("WebSocket closed")
+        event(self.log, logging.INFO, "websocket_closed", code=close_status_code)
 
     def start_trading(self):
-        print("Launching bot...")
-        print(f"User balance: {self.trading.getBalance()} MPH")
-        url = "wss://stream.binance.com:9443/ws/btcusdt@trade"
+        import websocket
+
+        configure_logging()
+        event(self.log, logging.INFO, "launching", marketId=self.market_id)
+        event(self.log, logging.INFO, "balance", balance=self.trading.getBalance())
+        if self.trading.risk_engine is not None:
+            self.trading.risk_engine.refresh(self.trading, [self.market_id])
+        url = f"wss://stream.binance.com:9443/ws/{self.symbol}@trade"
         ws = websocket.WebSocketApp(
             url,
             on_message=self._on_message,
             on_error=self._on_error,
             on_close=self._on_close,
         )
-        print("Starting WebSocket stream...")
+        event(self.log, logging.INFO, "websocket_starting", url=url)
         ws.run_forever()
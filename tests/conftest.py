@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orders import OrderBook
+from simulator import SimulatedSidechain
+from trading import MorpherTrading
+
+BTC_MARKET_ID = "0x0bc89e95f9fdaab7e8a11719155f2fd638cb0f665623f3d12aab71d1a125daf9"
+ETH_MARKET_ID = "0x5376ff169a3705b2003892fe730060ee74ec83e5701da29318221aa782271779"
+
+
+@pytest.fixture
+def chain():
+    return SimulatedSidechain(initial_balance=1000)
+
+
+@pytest.fixture
+def trading(chain):
+    return MorpherTrading("test-key", order_book=OrderBook(), backend=chain)
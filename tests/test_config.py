@@ -0,0 +1,46 @@
+import pytest
+
+from config import ConfigError, load_config, read_config
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_reads_toml_and_yaml(tmp_path):
+    assert read_config(write(tmp_path, "bot.toml", 'mode = "paper"\n')) == {"mode": "paper"}
+    pytest.importorskip("yaml")
+    assert read_config(write(tmp_path, "bot.yaml", "mode: paper\n")) == {"mode": "paper"}
+    assert read_config(write(tmp_path, "empty.yml", "")) == {}
+
+
+@pytest.mark.parametrize("name, text, problem", [
+    ("bot.toml", "mode = \n", "invalid TOML"),
+    ("bot.json", "{}", "unknown config format '.json'"),
+])
+def test_unreadable_config(tmp_path, name, text, problem):
+    path = write(tmp_path, name, text)
+    with pytest.raises(ConfigError) as info:
+        load_config(path)
+    assert info.value.path == path
+    assert problem in info.value.problems[0]
+
+
+def test_invalid_yaml(tmp_path):
+    pytest.importorskip("yaml")
+    with pytest.raises(ConfigError, match="invalid YAML"):
+        read_config(write(tmp_path, "bot.yaml", "mode: [paper\n"))
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(ConfigError, match="can't read the file"):
+        read_config(str(tmp_path / "missing.toml"))
+
+
+def test_all_problems_are_reported(tmp_path):
+    path = write(tmp_path, "bot.toml", 'mode = "yolo"\nfoo = 1\n[[strategies]]\nname = "x"\ntype = "sma"\n')
+    with pytest.raises(ConfigError) as info:
+        load_config(path)
+    assert len(info.value.problems) > 2
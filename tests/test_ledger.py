@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+from ledger import SIDE_CLOSE, SIDE_OPEN, Ledger
+
+
+def test_sync_resumes_from_last_block(tmp_path, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    trading.openPosition(ETH_MARKET_ID, 10, True, 1)  # no price yet, stays pending
+
+    path = str(tmp_path / "ledger.db")
+    ledger = Ledger(trading, path, page_size=2)
+    assert ledger.last_block is None
+    assert ledger.sync() == 1
+    synced_to = ledger.last_block
+    assert synced_to == chain.block_number
+    assert ledger.sync() == 0
+    ledger.close()
+
+    # the pending order is executed after the first sync, a new ledger on the same file picks up from there
+    chain.on_price(ETH_MARKET_ID, 3000)
+    ledger = Ledger(trading, path, page_size=2)
+    assert ledger.last_block == synced_to
+    from_blocks = []
+    get_logs = trading.web3.eth.get_logs
+    trading.web3.eth.get_logs = lambda filter_params: from_blocks.append(filter_params["fromBlock"]) or get_logs(filter_params)
+    assert ledger.sync() == 1
+    assert min(from_blocks) == synced_to + 1
+    assert [fill["marketId"] for fill in ledger.fills()] == [BTC_MARKET_ID, ETH_MARKET_ID]
+    assert set(ledger.positions()) == {BTC_MARKET_ID, ETH_MARKET_ID}
+    ledger.close()
+
+
+def test_pnl_of_partial_close(chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    balance = trading.getBalance()
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    chain.on_price(BTC_MARKET_ID, 110)
+    ledger = Ledger(trading)
+    ledger.sync()
+    assert ledger.realized_pnl() == {BTC_MARKET_ID: 0}
+    assert ledger.unrealized_pnl({BTC_MARKET_ID: 110}) == {BTC_MARKET_ID: pytest.approx(1)}
+
+    trading.closePosition(BTC_MARKET_ID, 0.5)
+    assert ledger.sync() == 1
+    opened, closed = ledger.fills(BTC_MARKET_ID)
+    assert (opened["side"], closed["side"]) == (SIDE_OPEN, SIDE_CLOSE)
+    assert closed["shares"] == opened["shares"] // 2
+    assert closed["longShares"] == opened["longShares"] - closed["shares"]
+
+    summary = ledger.pnl(prices={BTC_MARKET_ID: 110})
+    assert summary["realized"] == {BTC_MARKET_ID: pytest.approx(0.5)}
+    assert summary["unrealized"] == {BTC_MARKET_ID: pytest.approx(0.5)}
+    # the realized part is what the close paid out on top of its share of the deposit
+    assert trading.getBalance() - balance == pytest.approx(-10 + 5 + 0.5)
+
+    # the position before the close is still answered from the history
+    assert ledger.position(BTC_MARKET_ID, at=opened["timestamp"])["longShares"] == opened["longShares"]
+    ledger.close()
@@ -0,0 +1,233 @@
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+from errors import SendError, TransactionTimeout
+from orders import OrderBook, STATUS_CANCEL_REQUESTED, STATUS_CANCELLED, STATUS_EXECUTED, STATUS_EXPIRED, STATUS_FAILED, STATUS_OPEN
+import trading as trading_module
+from trading import CANCEL_NOT_FOUND, CANCEL_NOT_OWNER, CANCEL_SENT, MorpherTrading
+
+
+def add_order(book, order_id="0x01", market_id=BTC_MARKET_ID, **kwargs):
+    return book.add(order_id, market_id, 0, 10 * 10 ** 18, True, 2 * 10 ** 8, **kwargs)
+
+
+def test_new_order_is_open():
+    book = OrderBook()
+    order = add_order(book, "0xAB")
+    assert order["orderId"] == "0xab"
+    assert order["status"] == STATUS_OPEN
+    assert book.is_active("0xAB")
+    assert add_order(book, "0xab")["createdAt"] == order["createdAt"]  # adding again is a no-op
+
+
+def test_allowed_transitions():
+    book = OrderBook()
+    add_order(book, "0x01")
+    assert book.update_status("0x01", STATUS_CANCEL_REQUESTED)
+    assert book.update_status("0x01", STATUS_CANCELLED)
+    assert not book.is_active("0x01")
+
+    add_order(book, "0x02")
+    assert book.update_status("0x02", STATUS_EXECUTED)
+
+
+def test_terminal_states_are_final():
+    book = OrderBook()
+    for order_id, status in (("0x01", STATUS_EXECUTED), ("0x02", STATUS_CANCELLED), ("0x03", STATUS_FAILED), ("0x04", STATUS_EXPIRED)):
+        add_order(book, order_id)
+        assert book.update_status(order_id, status)
+        for other in (STATUS_OPEN, STATUS_CANCEL_REQUESTED, STATUS_EXECUTED, STATUS_CANCELLED):
+            assert not book.update_status(order_id, other)
+        assert book.get(order_id)["status"] == status
+
+
+def test_invalid_transitions():
+    book = OrderBook()
+    add_order(book, "0x01")
+    assert not book.update_status("0x01", STATUS_OPEN)
+    book.update_status("0x01", STATUS_CANCEL_REQUESTED)
+    assert not book.update_status("0x01", STATUS_CANCEL_REQUESTED)
+    assert not book.update_status("0x01", STATUS_OPEN)
+    assert not book.update_status("0x99", STATUS_EXECUTED)
+
+
+def test_filters_by_market_and_status():
+    book = OrderBook()
+    add_order(book, "0x01", BTC_MARKET_ID)
+    add_order(book, "0x02", ETH_MARKET_ID)
+    add_order(book, "0x03", BTC_MARKET_ID)
+    book.update_status("0x03", STATUS_EXECUTED)
+    assert [order["orderId"] for order in book.open_orders()] == ["0x01", "0x02"]
+    assert [order["orderId"] for order in book.open_orders(BTC_MARKET_ID.upper())] == ["0x01"]
+    assert [order["orderId"] for order in book.orders(statuses=(STATUS_EXECUTED,))] == ["0x03"]
+
+
+def test_expire():
+    book = OrderBook()
+    add_order(book, "0x01", good_until=100)
+    add_order(book, "0x02", good_until=300)
+    add_order(book, "0x03")  # no expiration
+    assert book.expire(now=200) == ["0x01"]
+    assert book.get("0x01")["status"] == STATUS_EXPIRED
+    assert book.get("0x02")["status"] == STATUS_OPEN
+    assert book.get("0x03")["status"] == STATUS_OPEN
+
+
+def test_reload_from_sqlite(tmp_path):
+    path = str(tmp_path / "orders.db")
+    book = OrderBook(path)
+    add_order(book, "0x01", tx_hash="0xaa", block_number=7, only_if_price_above=2 ** 70)
+    add_order(book, "0x02", ETH_MARKET_ID)
+    book.update_status("0x01", STATUS_CANCEL_REQUESTED)
+    book.update_status("0x02", STATUS_EXECUTED)
+    book.close()
+
+    book = OrderBook(path)
+    order = book.get("0x01")
+    assert order["status"] == STATUS_CANCEL_REQUESTED
+    assert order["openMPHTokenAmount"] == 10 * 10 ** 18
+    assert order["onlyIfPriceAbove"] == 2 ** 70  # amounts overflowing SQLite integers survive
+    assert order["direction"] is True
+    assert order["txHash"] == "0xaa" and order["blockNumber"] == 7
+    assert [order["orderId"] for order in book.open_orders()] == ["0x01"]
+    # the reloaded state machine is enforced as well
+    assert not book.update_status("0x02", STATUS_CANCELLED)
+    assert book.update_status("0x01", STATUS_CANCELLED)
+
+
+def test_orders_are_tracked_until_executed(chain, trading):
+    # no price yet, the order stays pending on the simulated oracle
+    order_id = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    order = trading.order_book.get(order_id)
+    assert order["status"] == STATUS_OPEN
+    assert order["blockNumber"] is not None
+    assert trading.syncOrders() == 0
+
+    chain.on_price(BTC_MARKET_ID, 60000)
+    assert trading.syncOrders() == 1
+    assert trading.order_book.get(order_id)["status"] == STATUS_EXECUTED
+    assert trading.getOpenOrders() == []
+
+
+def test_sync_orders_marks_failed_orders(chain, trading):
+    chain.set_balance(trading.address, 5)
+    order_id = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    chain.on_price(BTC_MARKET_ID, 60000)  # not enough balance, the oracle fails the order
+    assert trading.syncOrders() == 1
+    assert trading.order_book.get(order_id)["status"] == STATUS_FAILED
+
+
+def test_cancel_all(chain, trading):
+    btc_orders = [trading.openPosition(BTC_MARKET_ID, 10, True, 2) for _ in range(3)]
+    eth_order = trading.openPosition(ETH_MARKET_ID, 10, True, 2)
+
+    outcomes = trading.cancelAll(BTC_MARKET_ID)
+    assert set(outcomes) == set(btc_orders)
+    assert all(outcome["status"] == CANCEL_SENT and outcome["txHash"] is not None for outcome in outcomes.values())
+    assert all(trading.order_book.get(order_id)["status"] == STATUS_CANCEL_REQUESTED for order_id in btc_orders)
+    assert trading.order_book.get(eth_order)["status"] == STATUS_OPEN
+
+    # orders with a cancel in flight are not cancelled twice
+    assert set(trading.cancelAll()) == {eth_order}
+
+    assert trading.syncOrders() == 4
+    assert all(trading.order_book.get(order_id)["status"] == STATUS_CANCELLED for order_id in btc_orders + [eth_order])
+    assert trading.cancelAll() == {}
+
+
+def test_cancel_orders_outcomes(chain, trading):
+    pending = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    executed = trading.openPosition(ETH_MARKET_ID, 10, True, 2)
+    chain.on_price(ETH_MARKET_ID, 3000)  # executed on chain, the book doesn't know yet
+    other = MorpherTrading("other-key", backend=chain).openPosition(BTC_MARKET_ID, 10, True, 2)
+
+    outcomes = trading.cancelOrders([pending, executed, other, pending])
+    assert outcomes[pending]["status"] == CANCEL_SENT
+    assert outcomes[executed]["status"] == CANCEL_NOT_FOUND
+    assert outcomes[other]["status"] == CANCEL_NOT_OWNER
+    # the missing order is resolved from the book state
+    assert trading.order_book.get(executed)["status"] == STATUS_EXECUTED
+    # a known terminal order is answered from the book
+    assert trading.cancelOrders([executed])[executed]["status"] == CANCEL_NOT_FOUND
+
+
+def test_failed_send_raises_send_error(monkeypatch, chain, trading):
+    def send(raw_transaction):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(chain, "send", send)
+    with pytest.raises(SendError) as info:
+        trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    assert info.value.transient
+    assert trading._nonce is None  # read again from the chain before the next order
+
+
+def test_receipt_is_polled_with_backoff(monkeypatch, chain, trading):
+    sleeps = []
+    monkeypatch.setattr(trading_module.time, "sleep", sleeps.append)
+
+    def get_transaction_receipt(tx_hash):
+        raise chain.TransactionNotFound(tx_hash)  # never mined
+
+    monkeypatch.setattr(trading.web3.eth, "get_transaction_receipt", get_transaction_receipt)
+    with pytest.raises(TransactionTimeout):
+        trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    assert sleeps[:3] == [0.05, 0.1, 0.2] and max(sleeps) == 2
+    assert trading_module.RECEIPT_TIMEOUT <= sum(sleeps) < trading_module.RECEIPT_TIMEOUT + 2
+    assert trading._nonce is None
+
+
+def test_failed_build_does_not_reserve_a_nonce(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    nonce = trading._nonce
+    monkeypatch.setattr(trading, "_buildTransaction", lambda function: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    assert trading._nonce == nonce
+    monkeypatch.undo()
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)  # no gap in the nonce sequence
+    assert chain.nonces[trading.address.lower()] == nonce + 1
+
+
+def test_transactions_carry_the_chain_id(monkeypatch, chain, trading):
+    sent = []
+    send = chain.send
+    monkeypatch.setattr(chain, "send", lambda raw_transaction: sent.append(raw_transaction.tx) or send(raw_transaction))
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    assert sent[0]["chainId"] == trading.web3.eth.chain_id
+
+
+def test_missing_order_is_resolved_from_its_log(chain, trading):
+    chain.set_balance(trading.address, 5)
+    failed = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    chain.on_price(BTC_MARKET_ID, 60000)  # not enough balance, the oracle fails and deletes the order
+    assert trading.cancelOrder(failed) is False
+    assert trading.order_book.get(failed)["status"] == STATUS_FAILED
+
+
+def test_missing_order_without_log_stays_active(monkeypatch, chain, trading):
+    order_id = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    chain.on_price(BTC_MARKET_ID, 60000)
+    monkeypatch.setattr(trading, "_getOrderLogs", lambda orders, from_block=None: [])  # the node is behind
+    assert trading.cancelOrders([order_id])[order_id]["status"] == CANCEL_NOT_FOUND
+    assert trading.order_book.get(order_id)["status"] == STATUS_OPEN
+    monkeypatch.undo()
+    assert trading.syncOrders() == 1
+    assert trading.order_book.get(order_id)["status"] == STATUS_EXECUTED
+
+
+def test_sync_orders_reads_logs_in_pages(monkeypatch, chain, trading):
+    monkeypatch.setattr(trading_module, "LOG_PAGE_SIZE", 2)
+    order_id = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    for _ in range(5):
+        trading.openPosition(ETH_MARKET_ID, 10, True, 2)
+    chain.on_price(BTC_MARKET_ID, 60000)
+
+    ranges = []
+    get_logs = trading.web3.eth.get_logs
+    trading.web3.eth.get_logs = lambda filter_params: ranges.append((filter_params["fromBlock"], filter_params["toBlock"])) or get_logs(filter_params)
+    assert trading.syncOrders() == 1
+    assert trading.order_book.get(order_id)["status"] == STATUS_EXECUTED
+    assert len(ranges) > 1 and all(to_block - from_block < 2 for from_block, to_block in ranges)
+    assert ranges[-1][1] == chain.block_number
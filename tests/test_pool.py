@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+from pool import AccountPool, ROUTE_ROUND_ROBIN
+from risk import RiskEngine, RiskRejected
+
+
+def test_invalid_arguments(chain):
+    with pytest.raises(ValueError, match="at least one private key"):
+        AccountPool([], backend=chain)
+    with pytest.raises(ValueError, match="Unknown routing"):
+        AccountPool(["key-1"], routing="random", backend=chain)
+
+
+def test_pool_connects_on_first_use(chain):
+    pool = AccountPool(["key-1", "key-2"], backend=chain)
+    assert all("web3" not in vars(account) for account in pool.accounts)
+    assert pool.address == pool.accounts[0].address
+    pool.shutdown()
+
+
+def test_risk_engine_can_not_be_shared(chain):
+    with pytest.raises(ValueError):
+        AccountPool(["key-1", "key-2"], backend=chain, risk_engine=RiskEngine())
+
+
+def test_one_risk_engine_per_account(chain):
+    pool = AccountPool(["key-1", "key-2"], backend=chain, risk_limits={"max_leverage": 5})
+    engines = [account.risk_engine for account in pool.accounts]
+    assert engines[0] is not engines[1]
+    assert all(engine.max_leverage == 5 for engine in engines)
+    pool.shutdown()
+
+
+def test_orders_pass_after_refresh(chain):
+    chain.on_price(BTC_MARKET_ID, 100)
+    pool = AccountPool(["key-1", "key-2"], backend=chain, risk_limits={})
+    with pytest.raises(RiskRejected, match="no account snapshot"):
+        pool.openPosition(BTC_MARKET_ID, 10, True, 1)
+
+    # the way the strategies refresh a single client's engine
+    pool.risk_engine.refresh(pool, [BTC_MARKET_ID])
+    assert pool.openPosition(BTC_MARKET_ID, 10, True, 1) is not None
+    pool.shutdown()
+
+
+def test_each_engine_holds_its_own_account(chain):
+    chain.on_price(BTC_MARKET_ID, 100)
+    pool = AccountPool(["key-1", "key-2"], routing=ROUTE_ROUND_ROBIN, backend=chain, risk_limits={})
+    chain.set_balance(pool.accounts[0].address, 100)
+    chain.set_balance(pool.accounts[1].address, 20)
+    pool.refreshRisk([BTC_MARKET_ID, ETH_MARKET_ID])
+    assert [account.risk_engine.balance for account in pool.accounts] == [100, 20]
+
+    pool.openPosition(BTC_MARKET_ID, 50, True, 1)  # first account
+    with pytest.raises(RiskRejected, match="available balance"):
+        pool.openPosition(BTC_MARKET_ID, 50, True, 1)  # second account, 20 MPH only
+    pool.shutdown()
+
+
+def test_no_risk_limits(chain):
+    pool = AccountPool(["key-1"], backend=chain)
+    assert pool.risk_engine is None and pool.accounts[0].risk_engine is None
+    pool.shutdown()
@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import BTC_MARKET_ID
+from pool import AccountPool
+from prices import PriceStore, StalePrice
+from trading import MorpherTrading
+
+
+class CountingPriceStore(PriceStore):
+    """Counts the reads, every one of them could see another update."""
+
+    reads = 0
+
+    def get(self, market_id):
+        self.reads += 1
+        return super().get(market_id)
+
+
+def test_quote_staleness():
+    store = PriceStore(max_age=60)
+    with pytest.raises(StalePrice, match="No price"):
+        store.quote(BTC_MARKET_ID)
+    store.update(BTC_MARKET_ID, 100, 0.5)
+    assert store.quote(BTC_MARKET_ID.upper())[:2] == (100, 0.5)
+    store.update(BTC_MARKET_ID, 101, timestamp=store.get(BTC_MARKET_ID)[2] + 1)
+    assert store.quote(BTC_MARKET_ID)[:2] == (101, 0.5)  # the last known spread is kept
+
+    store = PriceStore(max_age=60)
+    store.update(BTC_MARKET_ID, 100, timestamp=0)
+    with pytest.raises(StalePrice, match="seconds old"):
+        store.quote(BTC_MARKET_ID)
+    assert store.quote(BTC_MARKET_ID, max_age=float("inf"))[0] == 100
+
+
+def test_position_value_reads_one_quote(chain):
+    chain.on_price(BTC_MARKET_ID, 100)
+    store = CountingPriceStore()
+    store.update(BTC_MARKET_ID, 110, 0)
+    trading = MorpherTrading("test-key", backend=chain, price_store=store)
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+
+    value = trading.getPositionValueExact(BTC_MARKET_ID)
+    assert store.reads == 1
+    assert value == trading.getPositionValueExact(BTC_MARKET_ID, 110, 0)
+
+
+def test_pool_position_value_reads_one_quote(chain):
+    chain.on_price(BTC_MARKET_ID, 100)
+    store = CountingPriceStore()
+    store.update(BTC_MARKET_ID, 110, 0)
+    pool = AccountPool(["key-1", "key-2"], backend=chain, price_store=store)
+    pool.openPosition(BTC_MARKET_ID, 10, True, 1)
+    pool.openPosition(BTC_MARKET_ID, 10, True, 1)
+
+    assert pool.getPositionValue(BTC_MARKET_ID) == pytest.approx(pool.getPositionValue(BTC_MARKET_ID, 110, 0))
+    assert store.reads == 1
+    pool.shutdown()
@@ -0,0 +1,150 @@
+from argparse import Namespace
+import json
+import time
+from types import SimpleNamespace
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fault_injection import start_stub
+from errors import CircuitOpen, EndpointError
+import resilience
+from resilience import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, Endpoint
+
+
+class HttpStatusError(Exception):
+    # shaped like requests.HTTPError, whose response status `resilience.is_transient` reads
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(url, data, timeout=2) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise HttpStatusError(e.code) from None
+
+
+@pytest.fixture
+def stub():
+    faults = Namespace(
+        error_rate=0, throttle_rate=0, drop_rate=0, slow_rate=0, slow_seconds=0, latency=0, outage=None
+    )
+    server = start_stub(faults)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.price_url = server.url + "/api/v3/ticker/price?symbol=BTCUSDT"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def failing_first(stub, fault, failures):
+    """Price request that fails with `fault` the first `failures` times."""
+    def call():
+        setattr(stub.faults, fault, 1 if stub.requests < failures else 0)
+        return request(stub.price_url)
+    return call
+
+
+@pytest.mark.parametrize("fault", ["error_rate", "throttle_rate", "drop_rate"])
+def test_reads_are_retried(stub, fault):
+    endpoint = Endpoint("stub", EndpointError, attempts=3, base_delay=0)
+    assert endpoint.call(failing_first(stub, fault, 2))["symbol"] == "BTCUSDT"
+    assert stub.requests == 3
+    metrics = endpoint.metrics()
+    assert (metrics["calls"], metrics["failures"], metrics["retries"]) == (3, 2, 2)
+    assert metrics["breaker"] == BREAKER_CLOSED
+
+
+def test_reads_give_up_after_the_attempts(stub):
+    stub.faults.error_rate = 1
+    endpoint = Endpoint("stub", EndpointError, attempts=3, base_delay=0)
+    with pytest.raises(EndpointError, match="HTTP 503") as info:
+        endpoint.call(request, stub.price_url)
+    assert info.value.transient
+    assert stub.requests == 3 and endpoint.metrics()["retries"] == 2
+
+
+def test_answers_are_not_retried(stub):
+    endpoint = Endpoint("stub", EndpointError, attempts=3, base_delay=0, failure_threshold=1)
+    with pytest.raises(EndpointError, match="HTTP 404") as info:
+        endpoint.call(request, stub.url + "/missing")
+    assert not info.value.transient
+    assert stub.requests == 1
+    assert endpoint.metrics()["breaker"] == BREAKER_CLOSED  # the endpoint is up
+
+
+def test_sends_are_not_retried(stub):
+    stub.faults.error_rate = 1
+    endpoint = Endpoint("stub", EndpointError, attempts=3, base_delay=0)
+    rpc = {"jsonrpc": "2.0", "id": 1, "method": "eth_sendRawTransaction", "params": ["0x00"]}
+    with pytest.raises(EndpointError) as info:
+        endpoint.call(request, stub.url, rpc, idempotent=False)
+    assert info.value.transient
+    assert stub.requests == 1
+    metrics = endpoint.metrics()
+    assert (metrics["calls"], metrics["failures"], metrics["retries"]) == (1, 1, 0)
+
+
+def test_breaker_opens_and_closes(stub):
+    stub.faults.error_rate = 1
+    endpoint = Endpoint("stub", EndpointError, attempts=1, failure_threshold=3, reset_timeout=0.2)
+    for _ in range(3):
+        with pytest.raises(EndpointError, match="HTTP 503"):
+            endpoint.call(request, stub.price_url)
+    assert endpoint.breaker.state == BREAKER_OPEN
+
+    with pytest.raises(CircuitOpen) as info:
+        endpoint.call(request, stub.price_url)
+    assert 0 < info.value.retry_in <= 0.2
+    assert stub.requests == 3  # rejected without calling the stub
+
+    # a failed trial call opens it again
+    time.sleep(0.25)
+    with pytest.raises(EndpointError, match="HTTP 503"):
+        endpoint.call(request, stub.price_url)
+    assert endpoint.breaker.state == BREAKER_OPEN
+
+    # a successful one closes it
+    stub.faults.error_rate = 0
+    time.sleep(0.25)
+    assert endpoint.call(request, stub.price_url)["symbol"] == "BTCUSDT"
+    assert endpoint.breaker.state == BREAKER_CLOSED
+    assert endpoint.metrics() == {
+        "breaker": BREAKER_CLOSED,
+        "breakerOpened": 2,
+        "calls": 5,
+        "failures": 4,
+        "retries": 0,
+        "rejected": 1,
+        "throttledSeconds": 0,
+    }
+
+
+def test_half_open_lets_one_trial_through(stub):
+    endpoint = Endpoint("stub", EndpointError, attempts=1, failure_threshold=1, reset_timeout=0)
+    stub.faults.error_rate = 1
+    with pytest.raises(EndpointError):
+        endpoint.call(request, stub.price_url)
+    endpoint.breaker.before_call()  # the trial call is running
+    assert endpoint.breaker.state == BREAKER_HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        endpoint.call(request, stub.price_url)
+    endpoint.breaker.record_success()
+    stub.faults.error_rate = 0
+    assert endpoint.call(request, stub.price_url)["symbol"] == "BTCUSDT"
+
+
+def test_shared_endpoint_metrics(stub):
+    name = f"stub {stub.url}"
+    resilience.configure(name, rate=1000, attempts=2, base_delay=0)
+    stub.faults.throttle_rate = 1
+    with pytest.raises(EndpointError, match="HTTP 429"):
+        resilience.endpoint(name).call(request, stub.price_url)
+    metrics = resilience.metrics()[name]
+    assert (metrics["calls"], metrics["failures"], metrics["retries"], metrics["rejected"]) == (2, 2, 1, 0)
+    assert stub.requests == 2
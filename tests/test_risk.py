@@ -0,0 +1,247 @@
+import pickle
+import threading
+
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+import risk
+from errors import MorpherError
+from risk import RiskEngine, RiskRejected
+
+
+def position(long_shares=0, short_shares=0, average_price=0):
+    return {
+        "longShares": long_shares,
+        "shortShares": short_shares,
+        "averagePrice": average_price,
+        "averageSpread": 0,
+        "averageLeverage": 10 ** 8,
+        "liquidationPrice": 0,
+    }
+
+
+def engine(balance=1000, positions=None, **limits):
+    risk_engine = RiskEngine(**limits)
+    risk_engine.set_snapshot(balance, positions or {})
+    return risk_engine
+
+
+def rejected(fn, *args):
+    with pytest.raises(RiskRejected) as info:
+        fn(*args)
+    return info.value.reason
+
+
+def test_accepts_order_within_limits():
+    risk_engine = engine(max_order_mph=100, max_market_exposure_mph=1000, max_total_exposure_mph=2000)
+    risk_engine.check_open(BTC_MARKET_ID, 50, True, 2)
+    risk_engine.check_close(BTC_MARKET_ID)
+
+
+def test_no_snapshot():
+    assert rejected(RiskEngine().check_open, BTC_MARKET_ID, 10, True, 1) == "no account snapshot loaded"
+    assert rejected(RiskEngine().check_close, BTC_MARKET_ID) == "no account snapshot loaded"
+
+
+def test_snapshot_age(monkeypatch):
+    risk_engine = engine(max_snapshot_age=30)
+    now = risk.time.time()
+    monkeypatch.setattr(risk.time, "time", lambda: now + 29)
+    risk_engine.check_open(BTC_MARKET_ID, 10, True, 1)
+    monkeypatch.setattr(risk.time, "time", lambda: now + 31)
+    assert "older than 30s" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, True, 1)
+    assert "older than 30s" in rejected(risk_engine.check_close, BTC_MARKET_ID)
+
+
+@pytest.mark.parametrize("leverage", [0.5, 10.5])
+def test_leverage_bounds(leverage):
+    assert "leverage" in rejected(engine().check_open, BTC_MARKET_ID, 10, True, leverage)
+
+
+def test_leverage_bounds_are_inclusive():
+    risk_engine = engine(min_leverage=2, max_leverage=5)
+    risk_engine.check_open(BTC_MARKET_ID, 10, True, 2)
+    risk_engine.check_open(BTC_MARKET_ID, 10, True, 5)
+    assert "outside 2-5" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, True, 1)
+
+
+def test_order_amount():
+    assert "must be positive" in rejected(engine().check_open, BTC_MARKET_ID, 0, True, 1)
+    assert "above 100 MPH" in rejected(engine(max_order_mph=100).check_open, BTC_MARKET_ID, 101, True, 1)
+
+
+def test_balance():
+    risk_engine = engine(balance=100, min_free_balance_mph=20)
+    risk_engine.check_open(BTC_MARKET_ID, 80, True, 1)
+    assert "available balance" in rejected(risk_engine.check_open, BTC_MARKET_ID, 81, True, 1)
+
+
+def test_balance_is_reserved_by_sent_orders():
+    risk_engine = engine(balance=100)
+    risk_engine.record_open(BTC_MARKET_ID, 70, True, 1)
+    assert "available balance" in rejected(risk_engine.check_open, ETH_MARKET_ID, 40, True, 1)
+
+
+def test_market_exposure():
+    # a share is worth its price with 8 decimals in WEI, 10^11 shares at 100 USD are 1000 MPH
+    positions = {BTC_MARKET_ID: position(long_shares=10 ** 11, average_price=100 * 10 ** 8)}
+    risk_engine = engine(balance=10_000, positions=positions, max_market_exposure_mph=1500)
+    risk_engine.check_open(BTC_MARKET_ID, 250, True, 2)
+    assert "market exposure of 1520.00 MPH" in rejected(risk_engine.check_open, BTC_MARKET_ID, 260, True, 2)
+    # other markets have their own limit
+    risk_engine.check_open(ETH_MARKET_ID, 700, True, 2)
+
+
+def test_total_exposure():
+    positions = {BTC_MARKET_ID: position(long_shares=10 ** 11, average_price=100 * 10 ** 8)}
+    risk_engine = engine(balance=10_000, positions=positions, max_total_exposure_mph=2000)
+    risk_engine.check_open(ETH_MARKET_ID, 500, True, 2)
+    assert "total exposure of 2010.00 MPH" in rejected(risk_engine.check_open, ETH_MARKET_ID, 505, True, 2)
+
+
+def test_opposite_position():
+    positions = {BTC_MARKET_ID: position(long_shares=5), ETH_MARKET_ID: position(short_shares=5)}
+    risk_engine = engine(positions=positions)
+    risk_engine.check_open(BTC_MARKET_ID, 10, True, 1)
+    risk_engine.check_open(ETH_MARKET_ID, 10, False, 1)
+    assert "opposite" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, False, 1)
+    assert "opposite" in rejected(risk_engine.check_open, ETH_MARKET_ID, 10, True, 1)
+
+
+def test_opposite_position_of_sent_order():
+    risk_engine = engine()
+    risk_engine.record_open(BTC_MARKET_ID, 10, True, 1)
+    assert "opposite" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, False, 1)
+
+
+def test_mixed_position():
+    risk_engine = engine(positions={BTC_MARKET_ID: position(long_shares=5, short_shares=5)})
+    assert "mixed" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, True, 1)
+    assert "mixed" in rejected(risk_engine.check_close, BTC_MARKET_ID)
+
+
+def test_rate_window(monkeypatch):
+    now = risk.time.time()
+    monkeypatch.setattr(risk.time, "time", lambda: now)
+    risk_engine = engine(max_orders=2, orders_window_seconds=60)
+    risk_engine.record_open(BTC_MARKET_ID, 10, True, 1)
+    risk_engine.record_close(BTC_MARKET_ID, 1)
+    assert "more than 2 orders in 60s" in rejected(risk_engine.check_open, ETH_MARKET_ID, 10, True, 1)
+    assert "more than 2 orders" in rejected(risk_engine.check_close, BTC_MARKET_ID)
+
+    monkeypatch.setattr(risk.time, "time", lambda: now + 61)
+    risk_engine.check_open(ETH_MARKET_ID, 10, True, 1)
+
+
+def test_record_close_reduces_exposure():
+    positions = {BTC_MARKET_ID: position(long_shares=10 ** 11, average_price=100 * 10 ** 8)}
+    risk_engine = engine(balance=10_000, positions=positions, max_market_exposure_mph=1000)
+    assert "market exposure" in rejected(risk_engine.check_open, BTC_MARKET_ID, 100, True, 1)
+    risk_engine.record_close(BTC_MARKET_ID, 0.5)
+    risk_engine.check_open(BTC_MARKET_ID, 100, True, 1)
+    assert risk_engine.positions[BTC_MARKET_ID.lower()]["longShares"] == 5 * 10 ** 10
+
+
+def test_market_ids_are_case_insensitive():
+    risk_engine = engine(positions={BTC_MARKET_ID.upper(): position(long_shares=5)})
+    assert "opposite" in rejected(risk_engine.check_open, BTC_MARKET_ID, 10, False, 1)
+
+
+def test_rejection_is_picklable():
+    error = pickle.loads(pickle.dumps(RiskRejected(BTC_MARKET_ID, "too big")))
+    assert (error.market_id, error.reason) == (BTC_MARKET_ID, "too big")
+
+
+def test_rejected_orders_are_not_sent(chain, trading):
+    trading.risk_engine = engine(balance=5)
+    with pytest.raises(RiskRejected):
+        trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    assert chain.nonces == {} and chain.orders == {}
+
+
+def test_close_is_checked_once(chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    trading.risk_engine = engine()
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+
+    checks = []
+    reserve_close = trading.risk_engine.reserve_close
+    trading.risk_engine.reserve_close = lambda market_id: checks.append(market_id) or reserve_close(market_id)
+    trading.closePosition(BTC_MARKET_ID, 0.5)
+    assert checks == [BTC_MARKET_ID]
+    trading.closePositionExact(BTC_MARKET_ID, 1)
+    assert checks == [BTC_MARKET_ID] * 2
+
+
+def test_reservations_hold_the_limits():
+    risk_engine = engine(balance=100, max_orders=3, max_market_exposure_mph=150)
+    first = risk_engine.reserve_open(BTC_MARKET_ID, 60, True, 2)
+    # the first order is not sent yet, its balance and exposure are taken already
+    assert "available balance" in rejected(risk_engine.reserve_open, ETH_MARKET_ID, 50, True, 1)
+    assert "market exposure" in rejected(risk_engine.reserve_open, BTC_MARKET_ID, 20, True, 2)
+    assert "opposite to a pending order" in rejected(risk_engine.reserve_open, BTC_MARKET_ID, 10, False, 1)
+    risk_engine.reserve_close(ETH_MARKET_ID)
+    risk_engine.reserve_open(ETH_MARKET_ID, 10, True, 1)
+    assert "more than 3 orders" in rejected(risk_engine.reserve_open, ETH_MARKET_ID, 10, True, 1)
+
+    risk_engine.release(first)
+    assert risk_engine.balance == 90
+    risk_engine.reserve_open(BTC_MARKET_ID, 10, False, 1)
+
+
+def test_commit_marks_the_position():
+    risk_engine = engine()
+    risk_engine.commit(risk_engine.reserve_open(BTC_MARKET_ID, 10, True, 1))
+    assert "opposite to the open position" in rejected(risk_engine.reserve_open, BTC_MARKET_ID, 10, False, 1)
+    positions = {ETH_MARKET_ID: position(long_shares=10 ** 11, average_price=100 * 10 ** 8)}
+    risk_engine.set_snapshot(1000, positions)
+    risk_engine.commit(risk_engine.reserve_close(ETH_MARKET_ID), 0.5)
+    assert risk_engine.exposure[ETH_MARKET_ID.lower()] == 500
+
+
+def test_concurrent_orders_share_the_balance():
+    risk_engine = engine(balance=100)
+    barrier = threading.Barrier(8)
+    outcomes = []
+
+    def order():
+        barrier.wait()
+        try:
+            risk_engine.reserve_open(BTC_MARKET_ID, 30, True, 1)
+            outcomes.append(True)
+        except RiskRejected:
+            outcomes.append(False)
+
+    threads = [threading.Thread(target=order) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outcomes.count(True) == 3 and risk_engine.balance == 10
+
+
+def test_reservation_is_released_when_the_order_is_not_sent(monkeypatch, chain, trading):
+    trading.risk_engine = engine(balance=100, max_orders=1)
+
+    def send(raw_transaction):
+        raise ValueError("invalid transaction")  # answered by the node, nothing was sent
+
+    monkeypatch.setattr(chain, "send", send)
+    with pytest.raises(MorpherError):
+        trading.openPosition(BTC_MARKET_ID, 60, True, 1)
+    assert trading.risk_engine.balance == 100
+    monkeypatch.undo()
+    trading.openPosition(BTC_MARKET_ID, 60, True, 1)
+    assert trading.risk_engine.balance == 40
+
+
+def test_reservation_is_kept_when_the_send_may_have_gone_through(monkeypatch, chain, trading):
+    trading.risk_engine = engine(balance=100)
+
+    def send(raw_transaction):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(chain, "send", send)
+    with pytest.raises(MorpherError):
+        trading.openPosition(BTC_MARKET_ID, 60, True, 1)
+    assert trading.risk_engine.balance == 40
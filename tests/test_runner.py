@@ -0,0 +1,155 @@
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+
+from runner import _HEADER, _SLOT, HEALTH_TICKS, ShardedRunner, TickRing
+
+
+def test_read_in_order():
+    ring = TickRing(slots=8)
+    try:
+        for i in range(1, 6):
+            ring.write(i % 3, float(i), float(i))
+        ticks, cursor, dropped = ring.read(0)
+        assert ticks == [(i % 3, float(i), float(i)) for i in range(1, 6)]
+        assert (cursor, dropped) == (5, 0)
+        assert ring.read(cursor) == ([], 5, 0)
+    finally:
+        ring.close()
+
+
+def test_lapped_reader_drops_oldest_ticks():
+    ring = TickRing(slots=8)
+    try:
+        for i in range(1, 21):
+            ring.write(0, float(i), float(i))
+        ticks, cursor, dropped = ring.read(0)
+        # the slot after the head may be overwritten next, only slots - 1 ticks are safe to read
+        assert [price for _, price, _ in ticks] == [float(i) for i in range(14, 21)]
+        assert (cursor, dropped) == (20, 13)
+    finally:
+        ring.close()
+
+
+def test_slot_being_written_is_not_read():
+    ring = TickRing(slots=8)
+    try:
+        for i in range(1, 9):
+            ring.write(0, float(i), float(i))
+        # the writer is in the middle of writing seq 9 over the slot of seq 1: the new price is
+        # in, the slot's sequence number and the head are not updated yet
+        struct.pack_into("<d", ring._shm.buf, _HEADER.size + (9 % 8) * _SLOT.size + 16, 9.0)
+        for cursor in (0, 1):
+            ticks, _, _ = ring.read(cursor)
+            assert all(price == timestamp for _, price, timestamp in ticks), ticks
+            assert [price for _, price, _ in ticks] == [float(i) for i in range(2, 9)]
+    finally:
+        ring.close()
+
+
+def _write_forever(name, slots, stop):
+    ring = TickRing(name, slots)
+    seq = ring.head()
+    while not stop.is_set():
+        seq += 1
+        # every field is derived from the sequence number, so a torn slot is visible
+        ring.write(seq % 7, float(seq), float(seq))
+
+
+def test_concurrent_reader_never_sees_torn_ticks():
+    slots = 8
+    ring = TickRing(slots=slots)
+    context = multiprocessing.get_context("fork")
+    stop = context.Event()
+    writer = context.Process(target=_write_forever, args=(ring.name, slots, stop), daemon=True)
+    writer.start()
+    try:
+        deadline = time.monotonic() + 2
+        reads = 0
+        while time.monotonic() < deadline:
+            # read at the edge the writer is about to lap
+            ticks, _, _ = ring.read(max(0, ring.head() - slots))
+            previous = None
+            for symbol_index, price, timestamp in ticks:
+                assert price == timestamp and symbol_index == int(price) % 7, (symbol_index, price, timestamp)
+                assert previous is None or price > previous
+                previous = price
+            reads += 1
+        assert reads > 0 and ring.head() > slots
+    finally:
+        stop.set()
+        writer.join(5)
+        ring.close()
+
+
+class _Trading:
+    risk_engine = None
+
+    def __init__(self):
+        self.calls = queue.Queue()
+        self.release = threading.Event()
+
+    def getPosition(self, market_id):
+        self.calls.put(("getPosition", market_id))
+        return {"longShares": 0, "shortShares": 0}
+
+    def openPosition(self, market_id, price):
+        self.calls.put(("openPosition", price))
+        if price == 1:
+            self.release.wait()  # like an order waiting for its confirmation
+        return "0x01"
+
+
+class _Strategy:
+
+    def __init__(self, trading, market_id):
+        self.trading = trading
+        self.market_id = market_id
+
+    def load_position(self):
+        self.trading.getPosition(self.market_id)
+
+    def on_price(self, price):
+        if price < 0:
+            raise ValueError("bad tick")
+        self.trading.openPosition(self.market_id, price)
+
+
+def _wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_worker_restarted_while_waiting_for_a_reply():
+    trading = _Trading()
+    runner = ShardedRunner(trading, [{"factory": _Strategy, "symbol": "btcusdt", "kwargs": {"market_id": "BTC"}}], workers=1)
+    runner._open()
+    try:
+        runner._start_worker(0)
+        assert trading.calls.get(timeout=30) == ("getPosition", "BTC")
+        ring = runner._rings[0]
+
+        def ticks():
+            ring.write(0, -1.0, time.time())  # fails, the worker goes on with the next tick
+            return runner._health[HEALTH_TICKS] > 0
+
+        _wait_for(ticks)
+        ring.write(0, 1.0, time.time())
+        assert trading.calls.get(timeout=10) == ("openPosition", 1.0)
+
+        # killed while it waits for the reply, the restarted worker gets its own pipe
+        runner._processes[0].terminate()
+        runner._processes[0].join(5)
+        runner._start_worker(0)
+        assert trading.calls.get(timeout=30) == ("getPosition", "BTC")
+        trading.release.set()
+
+        done = runner._health[HEALTH_TICKS]
+        _wait_for(lambda: ring.write(0, 2.0, time.time()) or runner._health[HEALTH_TICKS] > done)
+        assert ("openPosition", 2.0) in list(trading.calls.queue)
+    finally:
+        runner._close()
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+from simulator import FillModel, LastPriceFillModel, RecordedPriceFillModel, SimulatedSidechain
+from trading import MorpherTrading
+
+
+def test_fill_model_needs_quote():
+    with pytest.raises(TypeError):
+        FillModel()
+
+
+def test_last_price_fill_model(chain, trading):
+    order_id = trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    assert order_id in chain.orders
+    assert chain.on_price(BTC_MARKET_ID, 60000, 5) == 1
+    assert chain.fill_model.quote(BTC_MARKET_ID) == (60000, 5)
+    assert trading.getPosition(BTC_MARKET_ID)["longShares"] > 0
+
+
+def test_replay_recorded_prices(tmp_path):
+    path = tmp_path / "prices.csv"
+    path.write_text(f"timestamp,market_id,price,spread\n100,{BTC_MARKET_ID},60000,\n200,{ETH_MARKET_ID},3000,1\n")
+    chain = SimulatedSidechain(RecordedPriceFillModel(str(path)))
+    trading = MorpherTrading("test-key", backend=chain)
+    trading.openPosition(BTC_MARKET_ID, 10, True, 2)
+    trading.openPosition(ETH_MARKET_ID, 10, True, 2)
+
+    assert chain.replay(150) == 1
+    assert chain.fill_model.quote(ETH_MARKET_ID) is None
+    assert trading.getPosition(BTC_MARKET_ID)["longShares"] > 0
+    assert chain.replay(250) == 1
+    assert chain.fill_model.quote(ETH_MARKET_ID) == (3000, 1)
+    assert chain.orders == {}
+
+
+def test_replayed_orders_expire_at_the_recorded_time(tmp_path):
+    path = tmp_path / "prices.csv"
+    path.write_text(f"timestamp,market_id,price\n1000,{ETH_MARKET_ID},3000\n1100,{BTC_MARKET_ID},60000\n")
+    chain = SimulatedSidechain(RecordedPriceFillModel(str(path)))
+    trading = MorpherTrading("test-key", backend=chain)
+    chain.replay(1000)
+    expiring = trading.openPosition(BTC_MARKET_ID, 10, True, 2, good_until=1060)
+    lasting = trading.openPosition(BTC_MARKET_ID, 10, True, 2, good_until=1200)
+    assert set(chain.orders) == {expiring, lasting}  # not expired when placed
+
+    assert chain.replay(1100) == 2
+    assert chain.orders == {}
+    assert trading.getPosition(BTC_MARKET_ID)["longShares"] > 0
+
+
+def test_fill_model_mismatch(tmp_path):
+    path = tmp_path / "prices.csv"
+    path.write_text("timestamp,market_id,price\n")
+    with pytest.raises(TypeError, match="use replay"):
+        SimulatedSidechain(RecordedPriceFillModel(str(path))).on_price(BTC_MARKET_ID, 60000)
+    with pytest.raises(TypeError, match="RecordedPriceFillModel"):
+        SimulatedSidechain(LastPriceFillModel()).replay(100)
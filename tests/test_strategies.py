@@ -0,0 +1,179 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import BTC_MARKET_ID, ETH_MARKET_ID
+from errors import RpcError, SendError, TransactionTimeout
+from risk import RiskEngine
+from strategies import rebalancing, sma
+from strategies.rebalancing import WeightedMarketRebalancingStrategy
+from strategies.sma import SimpleMovingAverageStrategy
+
+MARKET_IDS = {"BTC": BTC_MARKET_ID, "ETH": ETH_MARKET_ID}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(sma.time, "sleep", lambda seconds: None)
+
+
+def fail_once(monkeypatch, trading, name, error, send=True):
+    """Makes the next `name` call raise `error`, after sending the order if `send`."""
+    method = getattr(trading, name)
+    calls = []
+
+    def failing(*args, **kwargs):
+        calls.append(args or kwargs)
+        if len(calls) > 1:
+            return method(*args, **kwargs)
+        if send:
+            method(*args, **kwargs)
+        raise error
+
+    monkeypatch.setattr(trading, name, failing)
+    return calls
+
+
+def sma_strategy(trading):
+    strategy = SimpleMovingAverageStrategy(trading, BTC_MARKET_ID, 1, 10, 1, 1, reconcile_delay=60)
+    strategy.minute_prices.append(100.0)
+    strategy.current_minute = datetime(9999, 1, 1)  # keeps the moving average at 100
+    return strategy
+
+
+def test_sma_retries_rejected_orders(chain, trading):
+    chain.on_price(BTC_MARKET_ID, 90)
+    trading.risk_engine = RiskEngine(max_order_mph=5)
+    trading.risk_engine.set_snapshot(1000, {})
+    strategy = sma_strategy(trading)
+    strategy.on_price(90)
+    assert not strategy.executing and strategy.current_position is None and strategy.unconfirmed is None
+
+    trading.risk_engine.max_order_mph = None
+    strategy.on_price(90)
+    assert strategy.current_position["is_long"]
+
+
+def test_sma_waits_for_unconfirmed_order(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 90)
+    calls = fail_once(monkeypatch, trading, "openPosition", TransactionTimeout("0xaa", 30))
+    strategy = sma_strategy(trading)
+    strategy.on_price(90)
+    assert strategy.executing and strategy.unconfirmed is not None
+
+    strategy.on_price(90)  # too early to read the position back, nothing is sent
+    assert len(calls) == 1 and strategy.executing
+
+    strategy.unconfirmed = strategy.unconfirmed[:2] + (0,)  # the reconcile delay has passed
+    strategy.on_price(90)
+    assert strategy.unconfirmed is None and not strategy.executing
+    assert strategy.current_position["is_long"]  # the order was executed after all
+    strategy.on_price(90)
+    assert len(calls) == 1
+
+
+def test_sma_trades_again_when_order_was_not_executed(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 90)
+    calls = fail_once(monkeypatch, trading, "openPosition", SendError("rpc", "timeout", True), send=False)
+    strategy = sma_strategy(trading)
+    strategy.on_price(90)
+    assert strategy.unconfirmed is not None
+
+    strategy.unconfirmed = strategy.unconfirmed[:2] + (0,)
+    strategy.on_price(90)
+    assert strategy.unconfirmed is None and strategy.current_position is None
+    strategy.on_price(90)
+    assert len(calls) == 2 and strategy.current_position["is_long"]
+
+
+def test_sma_is_not_stuck_executing_after_unexpected_error(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 90)
+    fail_once(monkeypatch, trading, "openPosition", KeyError("unexpected"), send=False)
+    strategy = sma_strategy(trading)
+    with pytest.raises(KeyError):
+        strategy.on_price(90)
+    assert not strategy.executing and strategy.unconfirmed is None
+    strategy.on_price(90)
+    assert strategy.current_position["is_long"]
+
+
+def test_sma_loads_its_position_after_a_restart(chain, trading):
+    chain.on_price(BTC_MARKET_ID, 90)
+    trading.openPosition(BTC_MARKET_ID, 10, True, 1)
+    strategy = sma_strategy(trading)
+    strategy.load_position()
+    assert strategy.current_position == {"is_long": True, "stop_loss": None, "take_profit": None}
+
+    strategy.on_price(99.5)  # the exits are set from the moving average of 100
+    assert strategy.current_position == {"is_long": True, "stop_loss": pytest.approx(98), "take_profit": pytest.approx(101)}
+    strategy.on_price(97)
+    assert strategy.current_position is None
+    assert trading.getPosition(BTC_MARKET_ID)["longShares"] == 0
+
+
+def rebalancer(trading, **kwargs):
+    strategy = WeightedMarketRebalancingStrategy(trading, {"BTC": 0.5, "ETH": 0.5}, 0.5, **kwargs)
+    strategy._get_market_id = MARKET_IDS.get
+    return strategy
+
+
+def test_rebalancer_does_not_trade_unconfirmed_drift_again(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    chain.on_price(ETH_MARKET_ID, 10)
+    calls = fail_once(monkeypatch, trading, "openPosition", TransactionTimeout("0xaa", 30))
+    strategy = rebalancer(trading, drift_band=0.05)
+    strategy.on_market_price("BTC", 100)
+    strategy.on_market_price("ETH", 10)
+    assert len(calls) == 2 and list(strategy.unconfirmed) == ["BTC"]
+    assert strategy.values["BTC"] == 0  # the estimate doesn't know whether it was traded
+
+    strategy.on_market_price("BTC", 100)
+    assert len(calls) == 2
+
+    strategy.unconfirmed["BTC"] -= 61  # the reconcile delay has passed
+    strategy.on_market_price("BTC", 100)
+    assert strategy.unconfirmed == {} and strategy.values["BTC"] == pytest.approx(250)
+    assert len(calls) == 2
+    assert trading.getPositionValue(BTC_MARKET_ID, 100) == pytest.approx(250)
+
+
+def test_rebalancer_skips_ticks_while_sync_fails(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    chain.on_price(ETH_MARKET_ID, 10)
+    fail_once(monkeypatch, trading, "getBalance", RpcError("rpc", "timeout", True), send=False)
+    strategy = rebalancer(trading, drift_band=0.05)
+    strategy.on_market_price("BTC", 100)
+    strategy.on_market_price("ETH", 10)
+    assert strategy.cash is None and trading.order_book.open_orders() == []
+
+    strategy.on_market_price("ETH", 10)  # too early to retry
+    assert strategy.cash is None
+    strategy.sync_retry_at = 0  # the retry interval has passed
+    strategy.on_market_price("ETH", 10)
+    assert strategy.cash == pytest.approx(500)
+
+
+def test_daily_rebalance_is_retried_after_errors(monkeypatch, chain, trading):
+    chain.on_price(BTC_MARKET_ID, 100)
+    chain.on_price(ETH_MARKET_ID, 10)
+    fail_once(monkeypatch, trading, "getBalance", RpcError("rpc", "timeout", True), send=False)
+    strategy = rebalancer(trading)
+    strategy._fetch_market_price = {"BTC": 100, "ETH": 10}.get
+    monkeypatch.setattr(rebalancing, "configure_logging", lambda: None)
+
+    wake_ups = []
+
+    class Stop(Exception):
+        pass
+
+    def sleep(seconds):
+        if seconds == 300:
+            wake_ups.append(strategy.last_rebalance_time)
+            if len(wake_ups) == 2:
+                raise Stop
+
+    monkeypatch.setattr(rebalancing.time, "sleep", sleep)
+    with pytest.raises(Stop):
+        strategy.start_trading()
+    assert wake_ups[0] is None and wake_ups[1] is not None
+    assert trading.getPositionValue(BTC_MARKET_ID, 100) == pytest.approx(250)
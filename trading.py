@@ -1,9 +1,16 @@
-from abis import morpher_oracle_abi, morpher_state_abi, morpher_token_abi, morpher_trade_engine_abi
-from eth_account import Account
-import json
+from functools import cached_property
+from orders import OrderBook, STATUS_CANCEL_REQUESTED, STATUS_CANCELLED, STATUS_EXECUTED, STATUS_FAILED
+from errors import MorpherError, OrderError, PositionError, RpcError, SendError, TransactionTimeout
+from eventlog import event, get_logger
+import logging
+from prices import PriceStore
+from resilience import endpoint
+from risk import RiskEngine
+import threading
 import time
-from web3 import Web3
-from web3.exceptions import TransactionNotFound
+
+# web3, eth_account and the ABIs take most of the startup time, they are only imported
+# when the client first needs them (or in the background with `preload`)
 
 
 SIDECHAIN_RPC = 'https://sidechain.morpher.com'
@@ -12,18 +19,111 @@ MORPHER_ORACLE_ADDRESS='0xf8B5b1699A00EDfdB6F15524646Bd5071bA419Fb'
 MORPHER_TRADE_ENGINE_ADDRESS='0xc4a877Ed48c2727278183E18fd558f4b0c26030A'
 MORPHER_STATE_ADDRESS='0xB4881186b9E52F8BD6EC5F19708450cE57b24370'
 ORDER_CREATED='c7392b9822094f2dca86d2a7a97945e80918a8aee61c04de90253f3683b56950'
+ORDER_PROCESSED='f45eeb03060db0baf36cec20acde5e8464f49340c9877c55029d6ffe0e5cdac1'
+ORDER_CANCELLED='6bacc01dbe442496068f7d234edd811f1a5f833243e0aec824f86ab861f3c90d'
+ORDER_FAILED='e27c49d1eafe79b2bc5109b33b96343dba653822906061750c5b6f591b8c7531'
+ZERO_ADDRESS='0x0000000000000000000000000000000000000000'
+LOG_PAGE_SIZE=5000  # blocks per eth_getLogs request, nodes limit the range of a single request
+RECEIPT_TIMEOUT=30  # seconds to wait for the receipt of a sent transaction
+
+CANCEL_SENT='sent'
+CANCEL_NOT_FOUND='not_found'
+CANCEL_NOT_OWNER='not_owner'
+CANCEL_ERROR='error'
+
+# order book state reached when the oracle emits each event
+ORDER_EVENT_STATUS = {
+    ORDER_PROCESSED: STATUS_EXECUTED,
+    ORDER_CANCELLED: STATUS_CANCELLED,
+    ORDER_FAILED: STATUS_FAILED,
+}
 
 
 class MorpherTrading:
 
-    def __init__(self, private_key: str):
+    def __init__(
+            self,
+            private_key: str,
+            order_book: OrderBook = None,
+            rpc_url: str = SIDECHAIN_RPC,
+            risk_engine: RiskEngine = None,
+            backend = None,
+            price_store: PriceStore = None
+        ):
         self.private_key = private_key
-        self.address = Web3.to_checksum_address(Account.from_key(private_key).address)
-        self.web3 = Web3(Web3.HTTPProvider(SIDECHAIN_RPC))
-        self.morpher_token = self.web3.eth.contract(address=MORPHER_TOKEN_ADDRESS, abi=morpher_token_abi)
-        self.morpher_oracle = self.web3.eth.contract(address=MORPHER_ORACLE_ADDRESS, abi=morpher_oracle_abi)
-        self.morpher_trade_engine = self.web3.eth.contract(address=MORPHER_TRADE_ENGINE_ADDRESS, abi=morpher_trade_engine_abi)
-        self.morpher_state = self.web3.eth.contract(address=MORPHER_STATE_ADDRESS, abi=morpher_state_abi)
+        self.order_book = order_book
+        self.risk_engine = risk_engine
+        self.price_store = price_store  # where getPositionValue takes the price from when none is given
+        self.rpc_url = rpc_url
+        self.backend = backend  # e.g. a simulator.SimulatedSidechain for paper trading, None for rpc_url
+        # retries, rate limit and circuit breaker of the RPC, shared by all clients of the same url
+        self.log = get_logger("trading")
+        self.rpc = endpoint("simulator" if backend is not None else f"rpc {rpc_url}", RpcError)
+
+        # nonces are assigned locally so several transactions can be sent without waiting for each other
+        self._nonce = None
+        self._nonce_lock = threading.Lock()
+
+
+    @cached_property
+    def address(self):
+        return self.web3.to_checksum_address(self.web3.eth.account.from_key(self.private_key).address)
+
+
+    @cached_property
+    def web3(self):
+        if self.backend is not None:
+            return self.backend.connect()
+        from web3 import Web3
+        # retries are left to self.rpc, the provider would otherwise retry on its own underneath
+        return Web3(Web3.HTTPProvider(self.rpc_url, exception_retry_configuration=None))
+
+
+    @cached_property
+    def chain_id(self):
+        # read once through the endpoint, web3 would otherwise ask the node for it on every build
+        return self.rpc.call(lambda: self.web3.eth.chain_id)
+
+
+    @cached_property
+    def morpher_token(self):
+        from abis import morpher_token_abi
+        return self.web3.eth.contract(address=MORPHER_TOKEN_ADDRESS, abi=morpher_token_abi)
+
+
+    @cached_property
+    def morpher_oracle(self):
+        from abis import morpher_oracle_abi
+        return self.web3.eth.contract(address=MORPHER_ORACLE_ADDRESS, abi=morpher_oracle_abi)
+
+
+    @cached_property
+    def morpher_trade_engine(self):
+        from abis import morpher_trade_engine_abi
+        return self.web3.eth.contract(address=MORPHER_TRADE_ENGINE_ADDRESS, abi=morpher_trade_engine_abi)
+
+
+    @cached_property
+    def morpher_state(self):
+        from abis import morpher_state_abi
+        return self.web3.eth.contract(address=MORPHER_STATE_ADDRESS, abi=morpher_state_abi)
+
+
+    def preload(self):
+        """
+        Imports web3 and builds the contract objects in a background thread, so the first order
+        doesn't pay for it. Useful to overlap the startup with connecting to the price feeds.
+
+        Returns:
+            threading.Thread: The started thread, join it to wait until the client is ready.
+        """
+        def load():
+            for name in ("address", "web3", "morpher_token", "morpher_oracle", "morpher_trade_engine", "morpher_state"):
+                getattr(self, name)
+
+        thread = threading.Thread(target=load, name="morpher-preload", daemon=True)
+        thread.start()
+        return thread
 
 
     def openPosition(
@@ -90,8 +190,18 @@ class MorpherTrading:
 
         Returns:
             str: ID of the order.
+
+        Raises:
+            RiskRejected: if a risk engine is configured and the order fails its checks.
+            RpcError: if the sidechain RPC failed, see `resilience.Endpoint`. `SendError` if it
+                failed sending the order, which may still be mined.
+            TransactionTimeout: if the order transaction has no receipt after 30 seconds.
         """
-        tx = self.morpher_oracle.functions.createOrder(
+        reservation = None
+        if self.risk_engine is not None:
+            reservation = self.risk_engine.reserve_open(market_id, mph_token_amount / 1e18, direction, leverage / 1e8)
+
+        tx_hash = self._sendOrder(self.morpher_oracle.functions.createOrder(
             market_id,
             0,
             mph_token_amount,
@@ -101,18 +211,20 @@ class MorpherTrading:
             only_if_price_below,
             good_until,
             good_from
-        ).build_transaction({
-            "from": self.address,
-            "gas": 2000000,
-            "gasPrice": 100,
-            "nonce": self.web3.eth.get_transaction_count(self.address)
+        ), reservation)
+
+        return self._getOrderId(tx_hash, {
+            "market_id": market_id,
+            "close_shares_amount": 0,
+            "open_mph_token_amount": mph_token_amount,
+            "direction": direction,
+            "leverage": leverage,
+            "only_if_price_above": only_if_price_above,
+            "only_if_price_below": only_if_price_below,
+            "good_until": good_until,
+            "good_from": good_from
         })
 
-        signed_tx = self.web3.eth.account.sign_transaction(tx, self.private_key)
-        tx_hash = self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-
-        return self._getOrderId(self.web3.to_hex(tx_hash))
-
 
     def closePosition(
             self,
@@ -136,16 +248,20 @@ class MorpherTrading:
 
         Returns:
             str: ID of the order.
-        """
-        position = self.getPosition(market_id)
-        if position["longShares"] > 0 and position["shortShares"] > 0:
-            raise Exception("Found mixed position (long and short), can't close!")
-        elif position["longShares"] == 0 and position["shortShares"] == 0:
-            raise Exception("No position found for this market!")
 
+        Raises:
+            RiskRejected: if a risk engine is configured and the order fails its checks.
+            PositionError: if there is no position (or a mixed one) in the market.
+            RpcError: if the sidechain RPC failed, see `resilience.Endpoint`. `SendError` if it
+                failed sending the order, which may still be mined.
+            TransactionTimeout: if the order transaction has no receipt after 30 seconds.
+        """
+        position, reservation = self._closablePosition(market_id)
         close_shares = position["longShares"] if position["longShares"] > 0 else position["shortShares"]
-        return self.closePositionExact(
+        return self._sendCloseOrder(
             market_id,
+            position,
+            reservation,
             round(percentage * close_shares),
             round(only_if_price_above * 1e8),
             round(only_if_price_below * 1e8),
@@ -176,14 +292,58 @@ class MorpherTrading:
 
         Returns:
             str: ID of the order.
+
+        Raises:
+            RiskRejected: if a risk engine is configured and the order fails its checks.
+            PositionError: if there is no position (or a mixed one) in the market.
+            RpcError: if the sidechain RPC failed, see `resilience.Endpoint`. `SendError` if it
+                failed sending the order, which may still be mined.
+            TransactionTimeout: if the order transaction has no receipt after 30 seconds.
         """
-        position = self.getPosition(market_id)
-        if position["longShares"] > 0 and position["shortShares"] > 0:
-            raise Exception("Found mixed position (long and short), can't close!")
-        elif position["longShares"] == 0 and position["shortShares"] == 0:
-            raise Exception("No position found for this market!")
+        position, reservation = self._closablePosition(market_id)
+        return self._sendCloseOrder(
+            market_id,
+            position,
+            reservation,
+            close_shares_amount,
+            only_if_price_above,
+            only_if_price_below,
+            good_until,
+            good_from
+        )
+
+
+    def _closablePosition(self, market_id: str):
+        # runs the pre-trade check and reads the position to close, once per close order
+        reservation = None
+        if self.risk_engine is not None:
+            reservation = self.risk_engine.reserve_close(market_id)
+
+        try:
+            position = self.getPosition(market_id)
+            if position["longShares"] > 0 and position["shortShares"] > 0:
+                raise PositionError(market_id, "Found mixed position (long and short), can't close!")
+            elif position["longShares"] == 0 and position["shortShares"] == 0:
+                raise PositionError(market_id, "No position found for this market!")
+        except BaseException:
+            if reservation is not None:
+                self.risk_engine.release(reservation)
+            raise
+        return position, reservation
 
-        tx = self.morpher_oracle.functions.createOrder(
+
+    def _sendCloseOrder(
+            self,
+            market_id: str,
+            position: dict,
+            reservation: dict,
+            close_shares_amount: int,
+            only_if_price_above: int,
+            only_if_price_below: int,
+            good_until: int,
+            good_from: int
+        ):
+        tx_hash = self._sendOrder(self.morpher_oracle.functions.createOrder(
             market_id,
             close_shares_amount,
             0,
@@ -193,18 +353,20 @@ class MorpherTrading:
             only_if_price_below,
             good_until,
             good_from
-        ).build_transaction({
-            "from": self.address,
-            "gas": 2000000,
-            "gasPrice": 100,
-            "nonce": self.web3.eth.get_transaction_count(self.address)
+        ), reservation, close_shares_amount / (position["longShares"] + position["shortShares"]))
+
+        return self._getOrderId(tx_hash, {
+            "market_id": market_id,
+            "close_shares_amount": close_shares_amount,
+            "open_mph_token_amount": 0,
+            "direction": False if position["longShares"] > 0 else True,
+            "leverage": 100000000,
+            "only_if_price_above": only_if_price_above,
+            "only_if_price_below": only_if_price_below,
+            "good_until": good_until,
+            "good_from": good_from
         })
 
-        signed_tx = self.web3.eth.account.sign_transaction(tx, self.private_key)
-        tx_hash = self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-
-        return self._getOrderId(self.web3.to_hex(tx_hash))
-
 
     def getBalance(self):
         """
@@ -223,7 +385,7 @@ class MorpherTrading:
         Returns:
             int: current MPH balance in WEI.
         """
-        return self.morpher_token.functions.balanceOf(self.address).call()
+        return self.rpc.call(self.morpher_token.functions.balanceOf(self.address).call)
 
 
     def getPosition(self, market_id: str):
@@ -233,7 +395,7 @@ class MorpherTrading:
         Returns:
             dict: All information regarding current position in the market.
         """
-        result = self.morpher_trade_engine.functions.getPosition(self.address, market_id).call()
+        result = self.rpc.call(self.morpher_trade_engine.functions.getPosition(self.address, market_id).call)
         return {
             "longShares": result[0],
             "shortShares": result[1],
@@ -244,13 +406,13 @@ class MorpherTrading:
         }
 
 
-    def getPositionValue(self, market_id: str, current_price: float, current_spread: float = None):
+    def getPositionValue(self, market_id: str, current_price: float = None, current_spread: float = None):
         """
         Shows current value of the position for a specific market.
 
         Args:
             market_id (str): The ID (hash) of the market of the position.
-            current_price (float): The current market price.
+            current_price (float): The current market price, if None it's read from the price store.
             current_spread (float): The current market spread in USD, if None it will use the same spread as position
 
         Returns:
@@ -259,30 +421,41 @@ class MorpherTrading:
         return self.getPositionValueExact(market_id, current_price, current_spread) / 1e18
 
 
-    def getPositionValueExact(self, market_id: str, current_price: float, current_spread: float = None):
+    def getPositionValueExact(self, market_id: str, current_price: float = None, current_spread: float = None):
         """
         Shows current value of the position for a specific market.
 
         Args:
             market_id (str): The ID (hash) of the market of the position.
-            current_price (float): The current market price.
+            current_price (float): The current market price, if None it's read from the price store
+                together with its spread, when the store has one.
             current_spread (float): The current market spread in USD, if None it will use the same spread as position
 
         Returns:
             int: Position value in MPH WEI.
+
+        Raises:
+            StalePrice: If the price is read from the store and it's missing or too old.
         """
+        if current_price is None:
+            if self.price_store is None:
+                raise MorpherError("No price given and no price store configured!")
+            # one read, so the price and the spread are of the same update
+            current_price, spread, _ = self.price_store.quote(market_id)
+            if current_spread is None:
+                current_spread = spread
         position = self.getPosition(market_id)
         if position["longShares"] > 0 and position["shortShares"] > 0:
-            raise Exception("Found mixed position (long and short)!")
+            raise PositionError(market_id, "Found mixed position (long and short)!")
         elif position["longShares"] == 0 and position["shortShares"] == 0:
             return 0
 
         price = round(current_price * 1e8)
         spread = round(current_spread * 1e8) if current_spread is not None else position["averageSpread"]
-        last_updated = self.morpher_state.functions.getLastUpdated(self.address, market_id).call()
+        last_updated = self.rpc.call(self.morpher_state.functions.getLastUpdated(self.address, market_id).call)
 
         if position["longShares"] > 0:
-            value = self.morpher_trade_engine.functions.longShareValue(
+            value = self.rpc.call(self.morpher_trade_engine.functions.longShareValue(
                 position["averagePrice"],
                 position["averageLeverage"],
                 last_updated,
@@ -290,10 +463,10 @@ class MorpherTrading:
                 spread,
                 position["averageLeverage"],
                 True
-            ).call()
+            ).call)
             return value * position["longShares"]
 
-        value = self.morpher_trade_engine.functions.shortShareValue(
+        value = self.rpc.call(self.morpher_trade_engine.functions.shortShareValue(
             position["averagePrice"],
             position["averageLeverage"],
             last_updated,
@@ -301,7 +474,7 @@ class MorpherTrading:
             spread,
             position["averageLeverage"],
             True
-        ).call()
+        ).call)
         return value * position["shortShares"]
 
 
@@ -312,38 +485,313 @@ class MorpherTrading:
         Returns:
             bool: True if order was cancelled, False if it's already executed.
         """
-        order = self.morpher_trade_engine.functions.getOrder(order_id).call()
-        if order[0] == '0x0000000000000000000000000000000000000000':
+        if self.order_book is not None and self.order_book.get(order_id) is not None and not self.order_book.is_active(order_id):
+            return False
+
+        order = self.rpc.call(self.morpher_trade_engine.functions.getOrder(order_id).call)
+        if order[0] == ZERO_ADDRESS:
+            self._resolveMissingOrders([order_id])
             return False
         if order[0].lower() != self.address.lower():
-            raise Exception("Cannot cancel another user order!")
+            raise OrderError("Cannot cancel another user order!")
 
-        tx = self.morpher_oracle.functions.initiateCancelOrder(order_id).build_transaction({
-            "from": self.address,
-            "gas": 2000000,
-            "gasPrice": 100,
-            "nonce": self.web3.eth.get_transaction_count(self.address)
-        })
+        tx = self._buildTransaction(self.morpher_oracle.functions.initiateCancelOrder(order_id))
+
+        self._sendTransaction(tx)
 
-        signed_tx = self.web3.eth.account.sign_transaction(tx, self.private_key)
-        self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        if self.order_book is not None:
+            self.order_book.update_status(order_id, STATUS_CANCEL_REQUESTED)
 
         return True
 
 
-    def _getOrderId(self, tx_hash: str):
-        retries = 0
-        tx_receipt = None
-        while retries < 30:
+    def cancelOrders(self, order_ids: list):
+        """
+        Cancels several pending orders at once. Ownership of all orders is checked in a single
+        batched request, nonces are assigned locally and all cancel transactions are sent
+        together without waiting for receipts.
+
+        Args:
+            order_ids (list): IDs of the orders to cancel.
+
+        Returns:
+            dict: Outcome per order ID: `{"status": ..., "txHash": ..., "error": ...}` where status is
+                "sent" (cancel transaction sent), "not_found" (already executed or cancelled),
+                "not_owner" (order of another user) or "error" (the transaction could not be sent).
+        """
+        outcomes = {}
+        to_check = []
+        for order_id in dict.fromkeys(order_ids):
+            if self.order_book is not None and self.order_book.get(order_id) is not None and not self.order_book.is_active(order_id):
+                outcomes[order_id] = {"status": CANCEL_NOT_FOUND, "txHash": None, "error": None}
+            else:
+                to_check.append(order_id)
+        if len(to_check) == 0:
+            return outcomes
+
+        def get_orders():
+            with self.web3.batch_requests() as batch:
+                for order_id in to_check:
+                    batch.add(self.morpher_trade_engine.functions.getOrder(order_id))
+                return batch.execute()
+
+        orders = self.rpc.call(get_orders)
+
+        to_cancel = []
+        missing = []
+        for order_id, order in zip(to_check, orders):
+            if order[0] == ZERO_ADDRESS:
+                missing.append(order_id)
+                outcomes[order_id] = {"status": CANCEL_NOT_FOUND, "txHash": None, "error": None}
+            elif order[0].lower() != self.address.lower():
+                outcomes[order_id] = {"status": CANCEL_NOT_OWNER, "txHash": None, "error": None}
+            else:
+                to_cancel.append(order_id)
+        self._resolveMissingOrders(missing)
+        if len(to_cancel) == 0:
+            return outcomes
+
+        transactions = [self._buildTransaction(self.morpher_oracle.functions.initiateCancelOrder(order_id)) for order_id in to_cancel]
+        first_nonce = self._nextNonce(len(transactions))
+        try:
+            raw_transactions = []
+            for i, tx in enumerate(transactions):
+                tx["nonce"] = first_nonce + i
+                raw_transactions.append(self.web3.eth.account.sign_transaction(tx, self.private_key).raw_transaction)
+        except BaseException:
+            self._resetNonce()  # none of them was sent
+            raise
+
+        def send_all():
+            with self.web3.batch_requests() as batch:
+                for raw_transaction in raw_transactions:
+                    batch.add(self.web3.eth.send_raw_transaction(raw_transaction))
+                return batch.execute()
+
+        try:
+            tx_hashes = self.rpc.call(send_all, idempotent=False)
+            errors = [None] * len(tx_hashes)
+        except RpcError:
+            # the batch failed as a whole, resend one by one to find out which transactions went through
+            tx_hashes, errors = [], []
+            for raw_transaction in raw_transactions:
+                try:
+                    tx_hashes.append(self.rpc.call(self.web3.eth.send_raw_transaction, raw_transaction, idempotent=False))
+                    errors.append(None)
+                except RpcError as e:
+                    if "already known" in str(e):
+                        tx_hashes.append(self.web3.keccak(raw_transaction))
+                        errors.append(None)
+                    else:
+                        tx_hashes.append(None)
+                        errors.append(str(e))
+
+        for order_id, tx_hash, error in zip(to_cancel, tx_hashes, errors):
+            if error is not None:
+                outcomes[order_id] = {"status": CANCEL_ERROR, "txHash": None, "error": error}
+                continue
+            outcomes[order_id] = {"status": CANCEL_SENT, "txHash": self.web3.to_hex(tx_hash), "error": None}
+            if self.order_book is not None:
+                self.order_book.update_status(order_id, STATUS_CANCEL_REQUESTED)
+        if any(error is not None for error in errors):
+            # a gap in the nonce sequence stalls every later transaction, start again from the chain
+            self._resetNonce()
+
+        return outcomes
+
+
+    def cancelAll(self, market_id: str = None):
+        """
+        Cancels all open orders known to the local order book.
+
+        Args:
+            market_id (str): Only cancel orders for this market. None for all markets.
+
+        Returns:
+            dict: Outcome per order ID, see `cancelOrders`.
+        """
+        order_ids = [order["orderId"] for order in self.getOpenOrders(market_id) if order["status"] != STATUS_CANCEL_REQUESTED]
+        return self.cancelOrders(order_ids)
+
+
+    def getOpenOrders(self, market_id: str = None):
+        """
+        Lists the orders of this account that may still be executed, from the local order book.
+
+        Args:
+            market_id (str): Only list orders for this market. None for all markets.
+
+        Returns:
+            list: Order dicts, oldest first.
+        """
+        if self.order_book is None:
+            raise OrderError("No order book configured!")
+        self.order_book.expire()
+        return self.order_book.open_orders(market_id)
+
+
+    def syncOrders(self, from_block: int = None):
+        """
+        Updates the local order book from the oracle logs of the open orders and expires
+        orders whose `good_until` has passed.
+
+        Args:
+            from_block (int): First block to scan. None to start from the oldest open order.
+
+        Returns:
+            int: Number of orders that changed state.
+        """
+        if self.order_book is None:
+            raise OrderError("No order book configured!")
+        changed = len(self.order_book.expire())
+        open_orders = self.order_book.open_orders()
+        if len(open_orders) == 0:
+            return changed
+
+        for log in self._getOrderLogs(open_orders, from_block):
+            if self._applyOrderLog(log):
+                changed += 1
+        return changed
+
+
+    def _getOrderLogs(self, orders: list, from_block: int = None):
+        # outcome logs of `orders`, read in pages of LOG_PAGE_SIZE blocks up to the latest block
+        if from_block is None:
+            from_block = min(order["blockNumber"] or 0 for order in orders)
+        to_block = self.rpc.call(lambda: self.web3.eth.block_number)
+        order_ids = [order["orderId"] for order in orders]
+        logs = []
+        while from_block <= to_block:
+            page_end = min(from_block + LOG_PAGE_SIZE - 1, to_block)
+            for i in range(0, len(order_ids), 100):
+                logs += self.rpc.call(self.web3.eth.get_logs, {
+                    "address": MORPHER_ORACLE_ADDRESS,
+                    "fromBlock": from_block,
+                    "toBlock": page_end,
+                    "topics": [['0x' + topic for topic in ORDER_EVENT_STATUS], order_ids[i:i + 100]]
+                })
+            from_block = page_end + 1
+        return sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"]))
+
+
+    def _applyOrderLog(self, log):
+        topic = log["topics"][0].hex()
+        if topic.startswith('0x'):
+            topic = topic[2:]
+        status = ORDER_EVENT_STATUS.get(topic)
+        if status is None:
+            return False
+        order_id = log["topics"][1].hex()
+        return self.order_book.update_status(order_id if order_id.startswith('0x') else '0x' + order_id, status)
+
+
+    def _resolveMissingOrders(self, order_ids: list):
+        # the orders are gone from the trade engine: executed, cancelled or failed, only their
+        # oracle log tells which. Without one (e.g. the node is behind) they stay active.
+        if self.order_book is None:
+            return
+        self.order_book.expire()
+        orders = [self.order_book.get(order_id) for order_id in order_ids if self.order_book.is_active(order_id)]
+        if len(orders) == 0:
+            return
+        for log in self._getOrderLogs(orders):
+            self._applyOrderLog(log)
+
+
+    def _nextNonce(self, count: int = 1):
+        # reserves `count` consecutive nonces and returns the first one
+        with self._nonce_lock:
+            if self._nonce is None:
+                self._nonce = self.rpc.call(self.web3.eth.get_transaction_count, self.address, 'pending')
+            nonce = self._nonce
+            self._nonce += count
+            return nonce
+
+
+    def _resetNonce(self):
+        with self._nonce_lock:
+            self._nonce = None
+
+
+    def _sendOrder(self, function, reservation: dict = None, fraction: float = None):
+        # sends an order transaction, its risk reservation is committed once it's sent and
+        # released if it can't be
+        try:
+            tx = self._buildTransaction(function)
+            tx_hash = self._sendTransaction(tx)
+        except SendError as e:
+            if reservation is not None:
+                if e.transient:
+                    # the connection failed, it may have reached the node: counted until the next refresh
+                    self.risk_engine.commit(reservation, fraction)
+                else:
+                    self.risk_engine.release(reservation)  # the node refused it
+            raise
+        except BaseException:
+            if reservation is not None:
+                self.risk_engine.release(reservation)
+            raise
+        if reservation is not None:
+            self.risk_engine.commit(reservation, fraction)
+        return tx_hash
+
+
+    def _buildTransaction(self, function):
+        # built without a nonce: it's only reserved once the transaction can be signed and sent
+        return function.build_transaction({
+            "from": self.address,
+            "chainId": self.chain_id,
+            "gas": 2000000,
+            "gasPrice": 100
+        })
+
+
+    def _sendTransaction(self, tx: dict):
+        tx["nonce"] = self._nextNonce()
+        try:
+            signed_tx = self.web3.eth.account.sign_transaction(tx, self.private_key)
+            tx_hash = self.rpc.call(self.web3.eth.send_raw_transaction, signed_tx.raw_transaction, idempotent=False)
+        except RpcError as e:
+            self._resetNonce()
+            raise SendError(e.endpoint, e.cause, e.transient) from e
+        except BaseException:
+            self._resetNonce()  # not sent, the nonce would leave a gap
+            raise
+        tx_hash = self.web3.to_hex(tx_hash)
+        event(self.log, logging.INFO, "transaction_sent", txHash=tx_hash, nonce=tx["nonce"])
+        return tx_hash
+
+
+    def _getOrderId(self, tx_hash: str, order: dict = None):
+        if self.backend is not None:
+            TransactionNotFound = self.backend.TransactionNotFound
+        else:
+            from web3.exceptions import TransactionNotFound
+
+        def get_receipt():
             try:
-                tx_receipt = self.web3.eth.get_transaction_receipt(tx_hash)
-                break
+                return self.web3.eth.get_transaction_receipt(tx_hash)
             except TransactionNotFound:
-                retries += 1
-                time.sleep(1)
+                return None
+
+        # polled often at first, most receipts are there after a block or two
+        tx_receipt = self.rpc.call(get_receipt)
+        waited = 0
+        delay = 0.05
+        while tx_receipt is None and waited < RECEIPT_TIMEOUT:
+            time.sleep(delay)
+            waited += delay
+            delay = min(delay * 2, 2)
+            tx_receipt = self.rpc.call(get_receipt)
         if tx_receipt is None:
-            raise Exception("Transaction not found on chain after 30 seconds!")
+            # the transaction was probably dropped, don't build on top of its nonce
+            self._resetNonce()
+            raise TransactionTimeout(tx_hash, RECEIPT_TIMEOUT)
         for log in tx_receipt["logs"]:
             if log["address"].lower() == MORPHER_ORACLE_ADDRESS.lower() and log["topics"][0].hex() == ORDER_CREATED:
-                return '0x' + log["topics"][1].hex()
-        raise Exception("No order created log found!")
+                order_id = '0x' + log["topics"][1].hex()
+                if self.order_book is not None and order is not None:
+                    self.order_book.add(order_id, tx_hash=tx_hash, block_number=tx_receipt["blockNumber"], **order)
+                event(self.log, logging.INFO, "order_created", orderId=order_id, txHash=tx_hash, blockNumber=tx_receipt["blockNumber"])
+                return order_id
+        raise OrderError("No order created log found!")